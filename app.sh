@@ -9,4 +9,15 @@ else
 fi
 
 cd $APPDIR
-python3 -m flask run --host=0.0.0.0 --port=8888
+case "${SERVICE_ROLE:-all}" in
+    api)
+        # Stateless API processes; run them alongside any number of worker containers sharing the same database
+        exec gunicorn --workers ${API_WORKERS:-4} --bind 0.0.0.0:8888 "app:app"
+        ;;
+    worker)
+        exec python3 worker.py
+        ;;
+    *)
+        python3 -m flask run --host=0.0.0.0 --port=8888
+        ;;
+esac
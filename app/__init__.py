@@ -22,6 +22,16 @@ db = Database()
 try:
     from app.encryption import Encrypter
     encrypter = Encrypter()
+    from app.dockerclient import DockerImageCache
+    imageCache = DockerImageCache()
+    from app.cache import StatusResponseCache
+    statusCache = StatusResponseCache()
+    from app.cancellation import CancellationRegistry
+    cancellations = CancellationRegistry()
+    from app.throttle import TrafficGovernor
+    trafficGovernor = TrafficGovernor()
+    from app.cluster import WorkerPool
+    workerPool = WorkerPool()
     from app.scheduling import Scheduler
     scheduler = Scheduler()
 
@@ -49,13 +59,33 @@ try:
 
     encrypter.setKeyFile(app.config["ENCRYPTION_KEY_FILE"])
 
+    if app.config["SERVICE_ROLE"] not in ("all", "api", "worker"):
+        raise(ValueError("SERVICE_ROLE must be one of 'all', 'api' or 'worker', not '{0}'".format(app.config["SERVICE_ROLE"])))
+
     db.start(app.config["SQLALCHEMY_DATABASE_URI"])
     db.initDB()
-    db.updateServiceJobs()
-    db.updateProjectJobs()
-    db.updateExecutions()
 
-    scheduler.start(maxWorkers = app.config["JOBS_MAX_CONCURRENT_WORKERS"])
+    # "api" processes only serve HTTP and can be scaled out; every "worker" (or "all") process runs a scheduler and
+    #  shares the exports with the others (see app/cluster.py)
+    if app.config["SERVICE_ROLE"] in ("all", "worker"):
+        db.updateServiceJobs()
+        db.updateProjectJobs()
+
+        # Images exported before a restart still count against the image cache budget
+        if app.config["DOCKER_IMAGE_CACHE_ENABLED"]:
+            from app.dockerclient import DockerClient
+            try:
+                imageCache.restore(DockerClient(None, None).labeledImages(DockerImageCache.keyLabel))
+            except Exception as e:
+                logging.getLogger(__name__).warning("Could not restore the Docker image cache: {0}".format(repr(e)))
+
+        # Executions interrupted by a restart are reclaimed through their expired leases (see app/cluster.py)
+        scheduler.start(
+            maxWorkers = app.config["JOBS_MAX_CONCURRENT_WORKERS"],
+            syncFrequencySeconds = app.config["WORKER_JOB_SYNC_FREQUENCY_SECONDS"],
+            heartbeatSeconds = app.config["WORKER_HEARTBEAT_SECONDS"],
+            cancellationPollSeconds = app.config["EXPORT_CANCELLATION_POLL_SECONDS"]
+        )
 
 except KeyboardInterrupt:
     print("Captured Ctrl+C Interrupt")
@@ -1,12 +1,20 @@
 from app import app
 from app.dbcommon import DBCommon
-from app.dockerclient import DockerClient
+from app.helpers import DBHelpers
+from app.metrics import MetricsRollup, LatencyHistogram
+from app.registry import RegistryClient
 from domino import DominoAPISession
 
 import boto3
+from botocore.config import Config
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime, timedelta
 from urllib.parse import urlparse
-import stopit
+from time import time, monotonic
+import threading
+import json
+import os
+import pytz
 
 
 class Cleanup(object):
@@ -14,10 +22,23 @@ class Cleanup(object):
         self.dbSession = dbSession
         self.dbCommon = DBCommon(self.dbSession)
 
-    def pruneMetrics(self):
-        dt = datetime.today() - timedelta(days = app.config.get("DATABASE_HISTORY_AGE_DAYS", 30))
+    # Raw health checks are kept for METRICS_RAW_RETENTION_SECONDS once they have been rolled up (rolledUpUntil, see
+    #  app/metrics.py); without a watermark only the ones older than DATABASE_HISTORY_AGE_DAYS go
+    def pruneMetrics(self, rolledUpUntil = None):
+        now = DBHelpers.now()
+        if rolledUpUntil is not None:
+            dt = min(rolledUpUntil, now - timedelta(seconds = app.config["METRICS_RAW_RETENTION_SECONDS"]))
+        else:
+            dt = now - timedelta(days = app.config.get("DATABASE_HISTORY_AGE_DAYS", 30))
+        probes = self.dbCommon.getAllMetricProbesPriorToDatetime(dt)
+        probes.delete(synchronize_session=False)
         metrics = self.dbCommon.getAllMetricsPriorToDatetime(dt)
-        metrics.delete(synchronize_session='fetch')
+        metrics.delete(synchronize_session=False)
+
+        minuteRollups = self.dbCommon.getAllMetricRollupsPriorToDatetime(MetricsRollup.minuteSeconds, now - timedelta(seconds = app.config["METRICS_MINUTE_ROLLUP_RETENTION_SECONDS"]))
+        minuteRollups.delete(synchronize_session=False)
+        hourRollups = self.dbCommon.getAllMetricRollupsPriorToDatetime(MetricsRollup.hourSeconds, now - timedelta(days = app.config["METRICS_HOUR_ROLLUP_RETENTION_DAYS"]))
+        hourRollups.delete(synchronize_session=False)
         self.dbSession.commit();
 
     def pruneExecutions(self):
@@ -25,94 +46,214 @@ class Cleanup(object):
         executions = self.dbCommon.getAllExecutionsPriorToDatetime(dt)
         executionIDs = [x[0] for x in executions.values("execution_id")]
         jobruns = self.dbCommon.getJobRunByExecutionIDs(executionIDs)
+        leases = self.dbCommon.getExecutionLeasesByExecutionIDs(executionIDs)
+
+        leases.delete(synchronize_session=False)
+        jobruns.delete(synchronize_session=False)
+        executions.delete(synchronize_session=False)
+        self.dbSession.commit();
 
-        jobruns.delete(synchronize_session='fetch')
-        executions.delete(synchronize_session='fetch')
+    def pruneCancellations(self):
+        dt = DBHelpers.now() - timedelta(days = app.config.get("DATABASE_HISTORY_AGE_DAYS", 30))
+        cancellations = self.dbCommon.getAllExportCancellationsPriorToDatetime(dt)
+        cancellations.delete(synchronize_session=False)
+        self.dbSession.commit();
+
+    def pruneWorkerNodes(self):
+        dt = datetime.utcnow() - timedelta(days = app.config.get("DATABASE_HISTORY_AGE_DAYS", 30))
+        nodes = self.dbCommon.getAllWorkerNodesPriorToDatetime(dt)
+        nodes.delete(synchronize_session=False)
+        self.dbSession.commit();
+
+    def pruneNodeStats(self):
+        dt = DBHelpers.now() - timedelta(days = app.config.get("DATABASE_HISTORY_AGE_DAYS", 30))
+        nodeStats = self.dbCommon.getAllNodeStatsPriorToDatetime(dt)
+        nodeStats.delete(synchronize_session=False)
         self.dbSession.commit();
 
 class HealthMetrics(object):
+    # Dependency probes run concurrently against clients that are kept between runs. Each probe has at most one
+    #  call in flight, so a dependency that hangs is reported as timed out rather than piling up threads
+    probeNames = ("domino_api", "domino_registry", "external_registry", "s3_bucket")
+
     def __init__(self):
-        pass
+        self.__executor = ThreadPoolExecutor(max_workers = len(self.probeNames))
+        self.__inFlight = {}
+        self.__clients = {}
+        self.__lock = threading.Lock()
 
-    @stopit.threading_timeoutable(default=False)
-    def isDominoAPIHealthy(self):
-        healthy = True
+    def __client(self, name, factory):
+        with self.__lock:
+            client = self.__clients.get(name, None)
+        if client is None:
+            client = factory()
+            with self.__lock:
+                self.__clients[name] = client
 
-        try:
-            DominoAPISession(app.config["DOMINO_API_SERVER"], "", verifySSL = app.config["DOMINO_API_SERVER_VERIFY_SSL"])
-        except:
-            healthy = False
-
-        return healthy
-
-    @stopit.threading_timeoutable(default=False)
-    def isDominoDockerRegistryHealthy(self):
-        healthy = True
-        dominoRegistry = app.config.get("DOMINO_DOCKER_REGISTRY", None)
-        registry = {
-            "url": dominoRegistry,
-            "username": app.config.get("DOMINO_DOCKER_REGISTRY_USER", None),
-            "password": app.config.get("DOMINO_DOCKER_REGISTRY_PASSWORD", None)
-        }
+        return client
 
-        if dominoRegistry:
-            try:
-                dockerClient = DockerClient(registry, {})
-                healthy = dockerClient.dominoRegistryHealth().get("online", False)
-            except:
-                healthy = False
-
-        return healthy
-
-    @stopit.threading_timeoutable(default=False)
-    def isExternalDockerRegistryHealthy(self):
-        healthy = True
-        registry = {
-            "url": app.config["EXPORTS_DOCKER_REGISTRY"],
-            "username": app.config.get("EXPORTS_DOCKER_REGISTRY_USERNAME", None),
-            "password": app.config.get("EXPORTS_DOCKER_REGISTRY_PASSWORD", None)
-        }
+    def __dropClient(self, name):
+        with self.__lock:
+            self.__clients.pop(name, None)
 
-        try:
-            dockerClient = DockerClient({}, registry)
-            healthy = dockerClient.externalRegistryHealth().get("online", False)
-        except:
-            healthy = False
+    def probeDominoAPI(self):
+        dominoAPI = self.__client("domino_api", lambda: DominoAPISession(app.config["DOMINO_API_SERVER"], "", verifySSL = app.config["DOMINO_API_SERVER_VERIFY_SSL"]))
+        dominoAPI.version()
 
-        return healthy
+    def probeDominoRegistry(self):
+        if not app.config.get("DOMINO_DOCKER_REGISTRY", None):
+            return False
 
-    @stopit.threading_timeoutable(default=False)
-    def isS3BucketHealthy(self):
-        healthy = True
+        registryClient = self.__client("domino_registry", lambda: RegistryClient(
+            {
+                "url": app.config["DOMINO_DOCKER_REGISTRY"],
+                "username": app.config.get("DOMINO_DOCKER_REGISTRY_USER", None),
+                "password": app.config.get("DOMINO_DOCKER_REGISTRY_PASSWORD", None)
+            },
+            insecure = app.config["DOMINO_DOCKER_REGISTRY_INSECURE"],
+            verifySSL = app.config["DOCKER_REGISTRY_VERIFY_SSL"],
+            timeout = app.config["HEALTHCHECK_TIMEOUT_IN_SECONDS"]
+        ))
+        registryClient.ping()
+
+    def probeExternalRegistry(self):
+        registryClient = self.__client("external_registry", lambda: RegistryClient(
+            {
+                "url": app.config["EXPORTS_DOCKER_REGISTRY"],
+                "username": app.config.get("EXPORTS_DOCKER_REGISTRY_USERNAME", None),
+                "password": app.config.get("EXPORTS_DOCKER_REGISTRY_PASSWORD", None)
+            },
+            insecure = app.config["EXPORTS_DOCKER_REGISTRY_INSECURE"],
+            verifySSL = app.config["DOCKER_REGISTRY_VERIFY_SSL"],
+            timeout = app.config["HEALTHCHECK_TIMEOUT_IN_SECONDS"]
+        ))
+        registryClient.ping()
+
+    def probeS3Bucket(self):
         s3Bucket = urlparse(app.config["EXPORTS_PROJECT_FILES_S3_BUCKET"])
+        # Local and NFS export folders only need to be writable
+        if s3Bucket.scheme == "file":
+            if not os.access(s3Bucket.path, os.W_OK):
+                raise(PermissionError("Export folder {0} is not writable".format(s3Bucket.path)))
+            return
+
+        s3Client = self.__client("s3_bucket", lambda: boto3.client("s3", config = Config(
+            connect_timeout = app.config["HEALTHCHECK_TIMEOUT_IN_SECONDS"],
+            read_timeout = app.config["HEALTHCHECK_TIMEOUT_IN_SECONDS"],
+            retries = {"max_attempts": 1}
+        )))
+        s3Client.head_bucket(Bucket=s3Bucket.netloc)
+
+    def __timedProbe(self, name, probe):
+        result = {
+            "healthy": True,
+            "latency_ms": None,
+            "error_class": None
+        }
+        started = time()
 
         try:
-            s3 = boto3.resource('s3')
-            s3.meta.client.head_bucket(Bucket=s3Bucket.netloc)
-        except:
-            healthy = False
-    
-        return healthy
+            # Probes return False when the dependency is not configured, in which case nothing is measured
+            if probe() is not False:
+                result["latency_ms"] = (time() - started) * 1000
+        except Exception as e:
+            result["healthy"] = False
+            result["latency_ms"] = (time() - started) * 1000
+            result["error_class"] = type(e).__name__
+            # Start from a fresh client next time in case this one holds a broken connection or stale token
+            self.__dropClient(name)
+
+        return result
+
+    def collect(self, timeoutSeconds):
+        probes = {
+            "domino_api": self.probeDominoAPI,
+            "domino_registry": self.probeDominoRegistry,
+            "external_registry": self.probeExternalRegistry,
+            "s3_bucket": self.probeS3Bucket
+        }
+        futures = {}
+
+        with self.__lock:
+            for (name, probe) in probes.items():
+                inFlight = self.__inFlight.get(name, None)
+                if inFlight and not inFlight.done():
+                    continue
+                futures[name] = self.__inFlight[name] = self.__executor.submit(self.__timedProbe, name, probe)
+
+        wait(futures.values(), timeout = timeoutSeconds)
+
+        results = {}
+        for name in self.probeNames:
+            future = futures.get(name, None)
+            if future and future.done():
+                results[name] = future.result()
+            else:
+                results[name] = {
+                    "healthy": False,
+                    "latency_ms": timeoutSeconds * 1000,
+                    "error_class": "Timeout"
+                }
+
+        return results
+
+healthMetrics = HealthMetrics()
+
+class HealthSnapshot(object):
+    # The last built /health body. A new snapshot replaces the old one in a single assignment, so readers need no lock
+    #  and never see a half-updated one. The collector publishes after every run; processes that do not collect
+    #  (SERVICE_ROLE "api") or have not collected yet rebuild it from the database once it is older than maxAgeSeconds
+    def __init__(self):
+        self.__snapshot = None
+        self.__rebuildLock = threading.Lock()
+
+    def publish(self, healthStatus):
+        self.__snapshot = (monotonic(), healthStatus)
+
+    def get(self, maxAgeSeconds):
+        snapshot = self.__snapshot
+        if snapshot and (monotonic() - snapshot[0] <= maxAgeSeconds):
+            return snapshot[1]
+
+        return None
+
+    def getOrBuild(self, maxAgeSeconds, build):
+        healthStatus = self.get(maxAgeSeconds)
+        if healthStatus is None:
+            # Only one request per process goes to the database; the others wait for its result
+            with self.__rebuildLock:
+                healthStatus = self.get(maxAgeSeconds)
+                if healthStatus is None:
+                    healthStatus = build()
+                    self.publish(healthStatus)
+
+        return healthStatus
+
+healthSnapshot = HealthSnapshot()
 
 class AdministrationAPI(object):
     def __init__(self, dbSession):
         self.dbSession = dbSession
         self.dbCommon = DBCommon(self.dbSession)
-        self.healthMetrics = HealthMetrics()
+        self.healthMetrics = healthMetrics
 
     def health(self):
-        import pytz
-        import datetime
-
         respCode = 200
+        healthStatus = healthSnapshot.getOrBuild(app.config["HEALTHCHECK_SNAPSHOT_MAX_AGE_SECONDS"], self.buildHealthSnapshot)
+
+        return (respCode, healthStatus)
+
+    # Called by the collector with the metrics it just saved; otherwise the latest saved ones are read
+    def buildHealthSnapshot(self, metrics = None):
         (respCode, version) = self.version()
-        collectionTimestamp = datetime.datetime.utcnow()
+        collectionTimestamp = datetime.utcnow()
         dominoAPIHealthy = None
         dominoDockerRegistryHealthy = None
         externalDockerRegistryHealthy = None
         S3BucketHealthy = None
 
-        metrics = self.dbCommon.getLatestHealthMetrics()
+        if metrics is None:
+            metrics = self.dbCommon.getLatestHealthMetrics()
         if metrics:
             collectionTimestamp = metrics.collection_timestamp
             dominoAPIHealthy = metrics.domino_api_healthy
@@ -127,10 +268,55 @@ class AdministrationAPI(object):
             "domino_registry_connection_healthy": dominoDockerRegistryHealthy,
             "s3_connection_healthy": S3BucketHealthy,
             "external_registry_connection_healthy": externalDockerRegistryHealthy,
-            "last_successful_backup_job_timestamp": None
+            "dependency_latency_ms": self.dependencyLatency(),
+            "availability_percent": self.availability(),
+            "availability_window_seconds": app.config["HEALTHCHECK_AVAILABILITY_WINDOW_SECONDS"],
+            "last_successful_backup_job_timestamp": None,
+            "worker_nodes": self.workerNodeStats()
         }
 
-        return (respCode, healthStatus)
+        return healthStatus
+
+    def publishHealthSnapshot(self, metrics):
+        healthSnapshot.publish(self.buildHealthSnapshot(metrics))
+
+    # Image cache and traffic stats of every live worker node, as saved with their heartbeats
+    def workerNodeStats(self):
+        updatedAfter = datetime.utcnow() - timedelta(seconds = app.config["WORKER_NODE_TIMEOUT_SECONDS"])
+
+        return {
+            nodeStats.node_id: dict(
+                json.loads(nodeStats.node_stats),
+                hostname = nodeStats.node_hostname,
+                stats_timestamp = str(pytz.utc.localize(nodeStats.stats_timestamp))
+            )
+            for nodeStats in self.dbCommon.getNodeStatsSince(updatedAfter)
+        }
+
+    # p50/p95 probe latency and error classes per dependency over the last HEALTHCHECK_LATENCY_WINDOW_SECONDS
+    def dependencyLatency(self):
+        latency = MetricsRollup(self.dbSession).latency(app.config["HEALTHCHECK_LATENCY_WINDOW_SECONDS"])
+
+        results = {}
+        for name in HealthMetrics.probeNames:
+            histogram = latency[name]["histogram"] if name in latency else LatencyHistogram()
+            results[name] = {
+                "p50": histogram.percentile(50),
+                "p95": histogram.percentile(95),
+                "samples": histogram.samples(),
+                "errors": latency[name]["errors"] if name in latency else {}
+            }
+
+        return results
+
+    # Percent of healthy checks over the last HEALTHCHECK_AVAILABILITY_WINDOW_SECONDS, overall and per dependency
+    def availability(self):
+        availability = MetricsRollup(self.dbSession).availability(app.config["HEALTHCHECK_AVAILABILITY_WINDOW_SECONDS"])
+
+        return {
+            name: availability.get(name, None)
+            for name in (MetricsRollup.overallName,) + HealthMetrics.probeNames
+        }
 
     def version(self):
         respCode = 200
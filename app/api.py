@@ -1,12 +1,19 @@
 from app import app
 from app import db
+from app import statusCache
 import app.models as models
 from app.projects import ProjectsAPI
 from app.admin import AdministrationAPI
+from app.helpers import DBHelpers
 
 from flask import jsonify
 from flask import make_response
 from flask import request
+from flask import json
+from flask import stream_with_context
+from flask import Response
+from werkzeug.exceptions import BadRequest
+from urllib.parse import urlencode
 
 app.config["API_VERSION"] = "v1"
 
@@ -46,8 +53,39 @@ def projectsCreate():
     exportGroupName = requestData["export_group_name"]
 # Check for allowed characters
     exportProjectName = requestData["export_project_name"]
+    exportDestinations = requestData.get("export_destinations", None)
+    includeFiles = requestData.get("include_files", None)
+    excludeFiles = requestData.get("exclude_files", None)
+    maxFileSizeBytes = requestData.get("max_file_size_bytes", None)
 
-    (respCode, jsonData) = projectsAPI.create(username, projectName, exportGroupName, exportProjectName)
+    (respCode, jsonData) = projectsAPI.create(username, projectName, exportGroupName, exportProjectName, exportDestinations, includeFiles, excludeFiles, maxFileSizeBytes)
+    if respCode < 300:
+        statusCache.invalidate(db.dbSession)
+
+    if "application/json" not in request.headers.get("Content-Type", ""):
+        jsonMessageFormat = "{MESSAGE}"
+        if jsonData.get("message", None):
+            jsonMessageFormat = "{ORIGINAL};  {MESSAGE}"
+
+        jsonData["message"] = jsonMessageFormat.format(
+            ORIGINAL = jsonData.get("message", None),
+            MESSAGE = "Warning: request has been processed, but the 'Content-Type: application/json' header is missing"
+        )
+
+    response = make_response(jsonify(jsonData), respCode)
+    return response
+
+
+@app.route("/v1/projects/create/batch", methods=["POST"])
+def projectsCreateBatch():
+    dominoAPIKey = request.headers.get("X-Domino-Api-Key")
+    projectsAPI = ProjectsAPI(dominoAPIKey, db.dbSession)
+
+    requestData = request.get_json(force=True)
+
+    (respCode, jsonData) = projectsAPI.createBatch(requestData)
+    if respCode < 300:
+        statusCache.invalidate(db.dbSession)
 
     if "application/json" not in request.headers.get("Content-Type", ""):
         jsonMessageFormat = "{MESSAGE}"
@@ -68,9 +106,65 @@ def projectsCreate():
 @app.route("/v1/projects/status/<identity>/<projectName>", methods=["GET"])
 def projectsStatus(identity, projectName):
     dominoAPIKey = request.headers.get("X-Domino-Api-Key")
+
+    try:
+        cursor = None if "cursor" not in request.args else int(request.args["cursor"])
+        limit = None if "limit" not in request.args else int(request.args["limit"])
+    except ValueError:
+        raise(BadRequest("'cursor' and 'limit' must be integers"))
+    if (limit is not None) and not (0 < limit <= app.config["API_STATUS_PAGE_MAX_LIMIT"]):
+        raise(BadRequest("'limit' must be between 1 and {0}".format(app.config["API_STATUS_PAGE_MAX_LIMIT"])))
+
+    # One JSON record per line, written as each job's status is computed
+    if request.accept_mimetypes.best_match(["application/json", "application/x-ndjson"]) == "application/x-ndjson":
+        projectsAPI = ProjectsAPI(dominoAPIKey, db.dbSession)
+        (respCode, records) = projectsAPI.statusStream(identity, projectName, cursor, limit)
+        if respCode != 200:
+            return make_response(jsonify([]), respCode)
+
+        return Response(stream_with_context(json.dumps(record) + "\n" for record in records), mimetype = "application/x-ndjson")
+
+    cacheKey = (DBHelpers.hashEncode(dominoAPIKey), identity, projectName, cursor, limit)
+
+    # Unchanged polls are answered from the cache with one read of the generation row and, at most every few seconds, an API key check
+    (generation, cached) = (None, None)
+    if app.config["API_STATUS_CACHE_ENABLED"]:
+        generation = statusCache.generation(db.dbSession)
+        cached = statusCache.get(cacheKey, generation)
+        # A key revoked since the response was cached gets the uncached path's answer
+        if cached and not ProjectsAPI.isValidAPIKey(dominoAPIKey):
+            cached = None
+    if not cached:
+        projectsAPI = ProjectsAPI(dominoAPIKey, db.dbSession)
+
+        (respCode, jsonData, nextCursor) = projectsAPI.status(identity, projectName, cursor, limit)
+        response = make_response(jsonify(jsonData), respCode)
+        if respCode != 200:
+            return response
+
+        # The next page is advertised in headers so the body stays a plain list
+        pageHeaders = {}
+        if nextCursor is not None:
+            pageHeaders["X-Next-Cursor"] = str(nextCursor)
+            pageHeaders["Link"] = '<{0}?{1}>; rel="next"'.format(request.base_url, urlencode({"limit": limit, "cursor": nextCursor}))
+
+        cached = statusCache.set(cacheKey, generation, respCode, response.get_data(), app.config["API_STATUS_CACHE_TTL_SECONDS"], pageHeaders)
+
+    response = make_response(cached["body"], cached["status_code"])
+    response.mimetype = "application/json"
+    response.headers.extend(cached["headers"])
+    response.set_etag(cached["etag"])
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response.make_conditional(request)
+
+
+@app.route("/v1/projects/cancel/<exportID>", methods=["POST"])
+def projectsCancel(exportID):
+    dominoAPIKey = request.headers.get("X-Domino-Api-Key")
     projectsAPI = ProjectsAPI(dominoAPIKey, db.dbSession)
 
-    (respCode, jsonData) = projectsAPI.status(identity, projectName)
+    (respCode, jsonData) = projectsAPI.cancel(exportID)
+
     response = make_response(jsonify(jsonData), respCode)
     return response
 
@@ -87,8 +181,13 @@ def projectsUpdate(identity):
 # Check for allowed characters
     exportProjectName = requestData.get("export_project_name", None)
     disabled = requestData.get("disabled", None)
+    includeFiles = requestData.get("include_files", None)
+    excludeFiles = requestData.get("exclude_files", None)
+    maxFileSizeBytes = requestData.get("max_file_size_bytes", None)
 
-    (respCode, jsonData) = projectsAPI.update(identity, updateAPIKey, exportGroupName, exportProjectName, disabled)
+    (respCode, jsonData) = projectsAPI.update(identity, updateAPIKey, exportGroupName, exportProjectName, disabled, includeFiles, excludeFiles, maxFileSizeBytes)
+    if respCode < 300:
+        statusCache.invalidate(db.dbSession)
 
     if not jsonData.get("message", None) and "application/json" not in request.headers.get("Content-Type", ""):
         jobData["message"] = "Warning: request has been processed, but the 'Content-Type: application/json' header is missing"
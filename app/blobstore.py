@@ -0,0 +1,60 @@
+import app.models as models
+from app.dbcommon import DBCommon
+from app.transfer import LocalFileWriter
+from sqlalchemy.exc import IntegrityError
+
+from urllib.parse import urlparse, quote
+import os
+
+class ProjectBlobStore(object):
+    # Content-addressed layout for project files: every Domino blob is stored once under a path derived from its key, so
+    #  forks and templates sharing blobs share the exported objects too, and each export only writes a manifest of its
+    #  paths. The exported_blobs table indexes the blobs known to exist, so a blob already exported by any project costs
+    #  a database lookup, or a single HEAD the first time this service sees it, and no upload
+    def __init__(self, dbSession, s3Client, blobRootPath):
+        self.dbSession = dbSession
+        self.dbCommon = DBCommon(self.dbSession)
+        self.s3Client = s3Client
+        self.blobRootPath = blobRootPath.rstrip("/")
+
+    def blobPath(self, blobKey):
+        encodedKey = quote(blobKey, safe = "")
+        return "{0}/{1}/{2}".format(self.blobRootPath, encodedKey[:2], encodedKey)
+
+    def __head(self, blobPath):
+        blobPathParsed = urlparse(blobPath)
+        # Blob stores of file:// destinations have no S3 client
+        if blobPathParsed.scheme == "file":
+            try:
+                stat = os.stat(blobPathParsed.path)
+            except FileNotFoundError:
+                return None
+            return {"ETag": LocalFileWriter.etagFromStat(stat), "ContentLength": stat.st_size}
+
+        try:
+            return self.s3Client.head_object(Bucket = blobPathParsed.netloc, Key = blobPathParsed.path.lstrip("/"))
+        except self.s3Client.exceptions.ClientError as e:
+            if e.response.get("Error", {}).get("Code", None) in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+
+    # ETag of the exported blob, or None when it still has to be uploaded
+    def exportedETag(self, blobPath, blobKey):
+        exportedBlob = self.dbCommon.getExportedBlob(blobPath)
+        if exportedBlob is not None:
+            return exportedBlob.etag
+
+        response = self.__head(blobPath)
+        if response is None:
+            return None
+
+        self.record(blobPath, blobKey, response.get("ContentLength", None), response.get("ETag", None))
+        return response.get("ETag", None)
+
+    def record(self, blobPath, blobKey, fileSize, etag):
+        # Another worker may have exported the same blob in the meantime; either record will do
+        try:
+            self.dbSession.add(models.ExportedBlob(blobPath, blobKey, fileSize, etag))
+            self.dbSession.commit()
+        except IntegrityError:
+            self.dbSession.rollback()
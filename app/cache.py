@@ -0,0 +1,111 @@
+from sqlalchemy.exc import IntegrityError
+from time import time
+from hashlib import sha256
+import threading
+
+class TTLCache(object):
+    # Small thread-safe in-process cache; entries expire ttlSeconds after being set and the
+    #  oldest entries are dropped once maxEntries is reached
+    def __init__(self, ttlSeconds, maxEntries = 1024):
+        self.__ttlSeconds = ttlSeconds
+        self.__maxEntries = maxEntries
+        self.__entries = {}
+        self.__lock = threading.Lock()
+
+    def get(self, key, default = None):
+        with self.__lock:
+            entry = self.__entries.get(key, None)
+            if entry is None:
+                return default
+            if entry[0] < time():
+                del self.__entries[key]
+                return default
+
+            return entry[1]
+
+    def set(self, key, value, ttlSeconds = None):
+        with self.__lock:
+            if (key not in self.__entries) and (len(self.__entries) >= self.__maxEntries):
+                oldestKey = min(self.__entries, key = lambda k: self.__entries[k][0])
+                del self.__entries[oldestKey]
+
+            self.__entries[key] = (time() + (ttlSeconds if ttlSeconds is not None else self.__ttlSeconds), value)
+
+    def invalidate(self, key = None):
+        with self.__lock:
+            if key is None:
+                self.__entries.clear()
+            else:
+                self.__entries.pop(key, None)
+
+
+class StatusResponseCache(object):
+    # Rendered /v1/projects/status responses keyed by (API key hash, route params). Anything that changes
+    #  export state bumps the generation, which orphans every entry rendered before it. The generation is a
+    #  counter row in the database, so a change made by any process (e.g. a worker finishing an execution)
+    #  reaches the caches of every API process
+    cacheName = "status"
+
+    def __init__(self):
+        self.__responses = TTLCache(0)
+
+    def generation(self, dbSession):
+        import app.models as models
+
+        row = dbSession.query(models.CacheGeneration).filter(models.CacheGeneration.cache_name == self.cacheName).first()
+        return row.generation if row else 0
+
+    # Commits, so call it once the change itself has been committed
+    def invalidate(self, dbSession):
+        import app.models as models
+
+        for attempt in range(2):
+            updated = dbSession.query(models.CacheGeneration).filter(models.CacheGeneration.cache_name == self.cacheName).update({
+                models.CacheGeneration.generation: models.CacheGeneration.generation + 1
+            }, synchronize_session=False)
+            if updated:
+                dbSession.commit()
+                return
+
+            # The first invalidation creates the row; if another process got there first, bump theirs
+            try:
+                dbSession.add(models.CacheGeneration(self.cacheName, 1))
+                dbSession.commit()
+                return
+            except IntegrityError:
+                dbSession.rollback()
+
+    # Only export executions reaching a final status change what /v1/projects/status returns; service tasks
+    #  (health metrics, S3 status updates, rollups) finish every few seconds and leave the cache alone. Commits
+    #  either way, so set the new status on the execution and call this in place of the commit
+    def invalidateForExecution(self, dbSession, execution, previousStatus):
+        from app.status import StatusTypes
+
+        if (execution.execution_status != previousStatus) and (execution.execution_status in StatusTypes.terminal) \
+                and (execution.jobs.job_type == "ProjectExport"):
+            dbSession.commit()
+            self.invalidate(dbSession)
+        else:
+            dbSession.commit()
+
+    # Pass the generation read at the start of the request
+    def get(self, key, generation):
+        entry = self.__responses.get(key)
+        if entry and (entry["generation"] == generation):
+            return entry
+
+        return None
+
+    # Pass the generation read before the response was computed so a render that raced an invalidation is
+    #  orphaned by the next request's read
+    def set(self, key, generation, respCode, body, ttlSeconds, headers = None):
+        entry = {
+            "generation": generation,
+            "status_code": respCode,
+            "body": body,
+            "headers": headers or {},
+            "etag": sha256(body).hexdigest()
+        }
+        self.__responses.set(key, entry, ttlSeconds)
+
+        return entry
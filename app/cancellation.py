@@ -0,0 +1,88 @@
+from time import monotonic
+import threading
+import logging
+
+class ExecutionCancelled(Exception):
+    pass
+
+class ExecutionRunTimeout(ExecutionCancelled):
+    pass
+
+class CancellationToken(object):
+    # Tasks call check() between files, chunks, blobs and log lines; it raises ExecutionCancelled once the execution has
+    #  been cancelled, or ExecutionRunTimeout once timeoutSeconds have passed, so work always stops at a safe point
+    #  (never in the middle of a commit or an S3 call) and the code on the way out can abort what it had in flight
+    def __init__(self, timeoutSeconds = None):
+        self.__event = threading.Event()
+        self.__deadline = (monotonic() + timeoutSeconds) if timeoutSeconds else None
+
+    def cancel(self):
+        self.__event.set()
+
+    def isCancelled(self):
+        return self.__event.is_set()
+
+    def isTimedOut(self):
+        return (self.__deadline is not None) and (monotonic() >= self.__deadline)
+
+    def check(self):
+        if self.__event.is_set():
+            raise(ExecutionCancelled("Execution was cancelled"))
+        if self.isTimedOut():
+            raise(ExecutionRunTimeout("Execution ran over its allotted time"))
+
+class CancellableStream(object):
+    # File-like wrapper that checks a CancellationToken before every read, for streams handed to requests or boto3
+    def __init__(self, stream, cancellation):
+        self.__stream = stream
+        self.__cancellation = cancellation
+
+    def read(self, size = -1):
+        if self.__cancellation:
+            self.__cancellation.check()
+        return self.__stream.read(size)
+
+class CancellationRegistry(object):
+    # Tokens of the executions running in this process. Cancellations are requested through the export_cancellations
+    #  table so that any process (SERVICE_ROLE "api" included) can make them; poll() applies them to the tokens here.
+    #  A request cancels the executions of its job that were created before it
+    def __init__(self):
+        self.__executions = {}
+        self.__lock = threading.Lock()
+        self.__logger = logging.getLogger(__name__)
+
+    def register(self, executionID, jobID, createdTimestamp, token):
+        with self.__lock:
+            self.__executions[executionID] = (jobID, createdTimestamp, token)
+
+    def unregister(self, executionID):
+        with self.__lock:
+            self.__executions.pop(executionID, None)
+
+    def cancelJob(self, jobID, requestedTimestamp):
+        with self.__lock:
+            executions = list(self.__executions.values())
+
+        cancelled = 0
+        for (executionJobID, createdTimestamp, token) in executions:
+            if (executionJobID == jobID) and (createdTimestamp <= requestedTimestamp) and not token.isCancelled():
+                token.cancel()
+                cancelled += 1
+
+        return cancelled
+
+    def poll(self):
+        from app import db
+        from app.dbcommon import DBCommon
+
+        with self.__lock:
+            jobIDs = {jobID for (jobID, createdTimestamp, token) in self.__executions.values()}
+        if not jobIDs:
+            return
+
+        try:
+            for cancellation in DBCommon(db.dbSession).getExportCancellationsForJobs(jobIDs):
+                self.cancelJob(cancellation.job_id, cancellation.requested_timestamp)
+        except Exception as e:
+            db.dbSession.rollback()
+            self.__logger.warning("Could not read export cancellations: {0}".format(repr(e)))
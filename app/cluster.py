@@ -0,0 +1,263 @@
+from app import db
+import app.models as models
+from app.dbcommon import DBCommon
+from app.helpers import DBHelpers
+from app.status import StatusTypes
+
+from sqlalchemy import and_, or_
+from sqlalchemy.exc import IntegrityError
+from datetime import timedelta
+from bisect import bisect
+from hashlib import md5
+from time import time
+import threading
+import logging
+import json
+import socket
+import os
+
+class WorkerPool(object):
+    # Coordinates any number of worker processes sharing one database. Every node heartbeats into worker_nodes;
+    #  project export jobs are sharded across the live nodes by consistent hashing on export_id, service jobs only
+    #  run on the node holding the leader lease, and each execution runs under a lease that is renewed by the
+    #  heartbeat and can be reclaimed by another node once it expires
+    leaderLeaseName = "scheduler"
+
+    def __init__(self):
+        self.nodeID = DBHelpers.hashEncode("node__{0}__{1}__{2}".format(socket.gethostname(), os.getpid(), time()))
+        self.__heldExecutions = set()
+        self.__ring = []
+        self.__ringNodes = ()
+        self.__leader = False
+        self.__started = False
+        self.__lock = threading.Lock()
+        self.__logger = logging.getLogger(__name__)
+
+    @staticmethod
+    def __hash(value):
+        return int(md5(value.encode("utf-8")).hexdigest()[:16], 16)
+
+    def start(self):
+        self.__started = True
+        self.heartbeat()
+
+    def stop(self):
+        if not self.__started:
+            return
+
+        dbSession = db.dbSession
+        dbCommon = DBCommon(dbSession)
+        try:
+            # Hand leadership and our share of the jobs over right away instead of waiting for the timeouts
+            dbCommon.query(models.LeaderLease).filter(models.LeaderLease.node_id == self.nodeID).delete(synchronize_session=False)
+            dbCommon.query(models.WorkerNode).filter(models.WorkerNode.node_id == self.nodeID).delete(synchronize_session=False)
+            dbCommon.query(models.NodeStats).filter(models.NodeStats.node_id == self.nodeID).delete(synchronize_session=False)
+            dbSession.commit()
+        except Exception as e:
+            dbSession.rollback()
+            self.__logger.warning("Could not deregister worker node {0}: {1}".format(self.nodeID, repr(e)))
+        finally:
+            self.__started = False
+            self.__leader = False
+
+    def heartbeat(self):
+        from app import app
+        dbSession = db.dbSession
+        dbCommon = DBCommon(dbSession)
+
+        try:
+            now = DBHelpers.now()
+
+            node = dbCommon.getWorkerNode(self.nodeID)
+            if node is None:
+                dbSession.add(models.WorkerNode(self.nodeID, socket.gethostname(), os.getpid()))
+            else:
+                node.heartbeat_timestamp = now
+            dbSession.commit()
+
+            with self.__lock:
+                heldExecutions = list(self.__heldExecutions)
+            if heldExecutions:
+                dbCommon.query(models.ExecutionLease).filter(and_(
+                    models.ExecutionLease.execution_id.in_(heldExecutions),
+                    models.ExecutionLease.node_id == self.nodeID
+                )).update({
+                    models.ExecutionLease.lease_expires_timestamp: now + timedelta(seconds = app.config["WORKER_EXECUTION_LEASE_SECONDS"])
+                }, synchronize_session=False)
+                dbSession.commit()
+
+            self.__leader = self.__acquireLeadership(dbSession, dbCommon, now)
+
+            liveNodes = dbCommon.getLiveWorkerNodes(now - timedelta(seconds = app.config["WORKER_NODE_TIMEOUT_SECONDS"]))
+            self.__rebuildRing([node.node_id for node in liveNodes])
+
+            self.__saveStats(dbSession, dbCommon, now)
+
+        except Exception as e:
+            dbSession.rollback()
+            self.__logger.warning("Worker node {0} heartbeat failed: {1}".format(self.nodeID, repr(e)))
+
+    # The image cache and traffic limits are per node, and /health is served by any process, so each node saves
+    #  its own stats with every heartbeat
+    def __saveStats(self, dbSession, dbCommon, now):
+        from app import imageCache
+        from app import trafficGovernor
+
+        stats = json.dumps({
+            "image_cache": imageCache.stats(),
+            "traffic": trafficGovernor.stats()
+        })
+        nodeStats = dbCommon.getNodeStats(self.nodeID)
+        if nodeStats is None:
+            dbSession.add(models.NodeStats(self.nodeID, socket.gethostname(), stats))
+        else:
+            nodeStats.node_stats = stats
+            nodeStats.stats_timestamp = now
+        dbSession.commit()
+
+    def __acquireLeadership(self, dbSession, dbCommon, now):
+        from app import app
+        expires = now + timedelta(seconds = app.config["WORKER_LEADER_LEASE_SECONDS"])
+
+        # Renew our own lease or take over one that has run out; the conditional UPDATE is the election
+        updated = dbCommon.query(models.LeaderLease).filter(and_(
+            models.LeaderLease.lease_name == self.leaderLeaseName,
+            or_(
+                models.LeaderLease.node_id == self.nodeID,
+                models.LeaderLease.lease_expires_timestamp < now
+            )
+        )).update({
+            models.LeaderLease.node_id: self.nodeID,
+            models.LeaderLease.lease_expires_timestamp: expires
+        }, synchronize_session=False)
+        dbSession.commit()
+
+        if updated:
+            return True
+
+        if dbCommon.getLeaderLease(self.leaderLeaseName) is None:
+            try:
+                dbSession.add(models.LeaderLease(self.leaderLeaseName, self.nodeID, expires))
+                dbSession.commit()
+                return True
+            except IntegrityError:
+                dbSession.rollback()
+
+        return False
+
+    def __rebuildRing(self, nodeIDs):
+        from app import app
+        nodeIDs = tuple(sorted(set(nodeIDs) | {self.nodeID}))
+        if nodeIDs == self.__ringNodes:
+            return
+
+        self.__ring = sorted([
+            (self.__hash("{0}#{1}".format(nodeID, replica)), nodeID)
+            for nodeID in nodeIDs
+            for replica in range(app.config["WORKER_HASH_RING_REPLICAS"])
+        ])
+        self.__ringNodes = nodeIDs
+        self.__logger.info("Worker node {0} sees {1} live node(s)".format(self.nodeID, len(nodeIDs)))
+
+    def isLeader(self):
+        return self.__leader
+
+    def liveNodes(self):
+        return self.__ringNodes
+
+    def ownerOf(self, exportID):
+        ring = self.__ring
+        if not ring:
+            return self.nodeID
+
+        return ring[bisect(ring, (self.__hash(exportID),)) % len(ring)][1]
+
+    def ownsJob(self, job):
+        if job.job_type == "ProjectExport":
+            return self.ownerOf(job.export_id) == self.nodeID
+
+        return self.isLeader()
+
+    def claimExecution(self, executionID):
+        from app import app
+        dbSession = db.dbSession
+        dbCommon = DBCommon(dbSession)
+        now = DBHelpers.now()
+        expires = now + timedelta(seconds = app.config["WORKER_EXECUTION_LEASE_SECONDS"])
+
+        if dbCommon.getExecutionLease(executionID) is None:
+            try:
+                dbSession.add(models.ExecutionLease(executionID, self.nodeID, expires))
+                dbSession.commit()
+            except IntegrityError:
+                dbSession.rollback()
+                return False
+        else:
+            updated = dbCommon.query(models.ExecutionLease).filter(and_(
+                models.ExecutionLease.execution_id == executionID,
+                or_(
+                    models.ExecutionLease.node_id == self.nodeID,
+                    models.ExecutionLease.lease_expires_timestamp < now
+                )
+            )).update({
+                models.ExecutionLease.node_id: self.nodeID,
+                models.ExecutionLease.lease_expires_timestamp: expires,
+                models.ExecutionLease.lease_attempts: models.ExecutionLease.lease_attempts + 1
+            }, synchronize_session=False)
+            dbSession.commit()
+
+            if not updated:
+                return False
+
+        with self.__lock:
+            self.__heldExecutions.add(executionID)
+
+        return True
+
+    def releaseExecution(self, executionID):
+        dbSession = db.dbSession
+        dbCommon = DBCommon(dbSession)
+
+        with self.__lock:
+            self.__heldExecutions.discard(executionID)
+
+        dbCommon.query(models.ExecutionLease).filter(and_(
+            models.ExecutionLease.execution_id == executionID,
+            models.ExecutionLease.node_id == self.nodeID
+        )).delete(synchronize_session=False)
+        dbSession.commit()
+
+    # Hands executions left behind by dead nodes back to the scheduler. Executions that have already been
+    #  reclaimed WORKER_EXECUTION_MAX_ATTEMPTS times are marked ExecutionNotComplete instead
+    def reclaimExecutions(self, scheduler):
+        from app import app
+        from app import statusCache
+        dbSession = db.dbSession
+        dbCommon = DBCommon(dbSession)
+        now = DBHelpers.now()
+        reclaimed = []
+
+        try:
+            orphans = dbCommon.getOrphanedExecutions(now, now - timedelta(seconds = app.config["WORKER_EXECUTION_LEASE_SECONDS"]))
+            for execution in orphans:
+                if not self.ownsJob(execution.jobs):
+                    continue
+
+                lease = dbCommon.getExecutionLease(execution.execution_id)
+                if lease and (lease.lease_attempts >= app.config["WORKER_EXECUTION_MAX_ATTEMPTS"]):
+                    previousStatus = execution.execution_status
+                    execution.execution_status = StatusTypes.code["ExecutionNotComplete"]
+                    execution.execution_ended_timestamp = now
+                    dbSession.delete(lease)
+                    statusCache.invalidateForExecution(dbSession, execution, previousStatus)
+                    continue
+
+                self.__logger.info("Worker node {0} is reclaiming execution {1}".format(self.nodeID, execution.external_execution_id))
+                if scheduler.addExecution(execution.execution_id):
+                    reclaimed.append(execution.execution_id)
+
+        except Exception as e:
+            dbSession.rollback()
+            self.__logger.warning("Worker node {0} could not reclaim executions: {1}".format(self.nodeID, repr(e)))
+
+        return reclaimed
@@ -78,6 +78,25 @@ class Database(object):
                 job.run_frequency_seconds = app.config["HEALTHCHECK_SCHEDULE_FREQUENCY_SECONDS"]
                 self.dbSession.commit()
 
+        metricsRollupJobs = dbcommon.getServicesJobs("MetricsRollup")
+        if not metricsRollupJobs:
+            job = models.Job(
+                job_type = "MetricsRollup",
+                job_user = None,
+                job_project = None,
+                job_export_group = None,
+                job_export_project = None,
+                run_frequency_seconds = app.config["METRICS_ROLLUP_FREQUENCY_SECONDS"],
+                job_secrets = None,
+                job_details = ""
+            )
+            self.dbSession.add(job)
+            self.dbSession.commit()
+        else:
+            for job in metricsRollupJobs:
+                job.run_frequency_seconds = app.config["METRICS_ROLLUP_FREQUENCY_SECONDS"]
+                self.dbSession.commit()
+
         databasePruneJobs = dbcommon.getServicesJobs("DatabasePrune")
         if not databasePruneJobs:
             job = models.Job(
@@ -108,16 +127,6 @@ class Database(object):
             job.run_frequency_seconds = app.config["EXPORT_JOB_SCHEDULE_DEFAULT_FREQUENCY_SECONDS"]
             self.dbSession.commit()
 
-    def updateExecutions(self):
-        from app.dbcommon import DBCommon
-        from app.status import StatusTypes
-        dbcommon = DBCommon(self.dbSession)
-
-        executions = dbcommon.getAllRunningExecutions()
-        for execution in executions:
-            execution.execution_status = StatusTypes.code["ExecutionNotComplete"]
-            self.dbSession.commit()
-
     def close(self):
         if self.engine:
             self.engine.dispose()
@@ -9,6 +9,7 @@ from sqlalchemy import and_
 from sqlite3 import OperationalError
 from sqlalchemy.exc import InvalidRequestError
 from time import sleep
+from hashlib import sha256
 import json
 
 class DBError(Exception):
@@ -81,8 +82,30 @@ class DBCommon(object):
     def getAllProjectExportJobs(self):
         return self.query(models.Job).filter(models.Job.job_type == "ProjectExport").all()
 
+    # Walks project export jobs in job_id order one batch at a time so callers never hold the whole table
+    def iterProjectExportJobs(self, afterJobID = None, username = None, projectName = None, batchSize = 100):
+        lastJobID = afterJobID if afterJobID is not None else 0
+
+        while True:
+            query = self.query(models.Job).filter(and_(
+                models.Job.job_type == "ProjectExport",
+                models.Job.job_id > lastJobID
+            ))
+            if username is not None:
+                query = query.filter(models.Job.job_user == username)
+            if projectName is not None:
+                query = query.filter(models.Job.job_project == projectName)
+
+            jobs = query.order_by(models.Job.job_id).limit(batchSize).all()
+            for job in jobs:
+                yield job
+
+            if len(jobs) < batchSize:
+                break
+            lastJobID = jobs[-1].job_id
+
     def getServicesJobs(self, jobType = None):
-        serviceJobTypes = ["AllExportJobsS3Status", "HealthMetricsCollection", "DatabasePrune"]
+        serviceJobTypes = ["AllExportJobsS3Status", "HealthMetricsCollection", "MetricsRollup", "DatabasePrune"]
 
         jobs = []
         if jobType and (jobType in serviceJobTypes):
@@ -95,6 +118,66 @@ class DBCommon(object):
     def getLatestHealthMetrics(self):
         return self.query(models.Metric).order_by(models.Metric.collection_timestamp.desc()).limit(1).first()
 
+    def getNodeStats(self, nodeID):
+        return self.query(models.NodeStats).filter(models.NodeStats.node_id == nodeID).first()
+
+    def getNodeStatsSince(self, datetime):
+        return self.query(models.NodeStats).filter(models.NodeStats.stats_timestamp >= datetime).all()
+
+    def getAllNodeStatsPriorToDatetime(self, datetime):
+        return self.query(models.NodeStats).filter(
+            models.NodeStats.stats_timestamp < datetime
+        )
+
+    def getMetricProbesSince(self, datetime):
+        return self.query(models.MetricProbe).filter(
+            models.MetricProbe.collection_timestamp >= datetime
+        ).all()
+
+    def getAllMetricProbesPriorToDatetime(self, datetime):
+        return self.query(models.MetricProbe).filter(
+            models.MetricProbe.collection_timestamp < datetime
+        )
+
+    def getEarliestMetric(self):
+        return self.query(models.Metric).order_by(models.Metric.collection_timestamp.asc()).limit(1).first()
+
+    def getMetricsBetween(self, start, end):
+        return self.query(models.Metric).filter(and_(
+            models.Metric.collection_timestamp >= start,
+            models.Metric.collection_timestamp < end
+        )).all()
+
+    def getMetricProbesBetween(self, start, end):
+        return self.query(models.MetricProbe).filter(and_(
+            models.MetricProbe.collection_timestamp >= start,
+            models.MetricProbe.collection_timestamp < end
+        )).all()
+
+    def getMetricRollupsBetween(self, bucketSeconds, start, end):
+        return self.query(models.MetricRollup).filter(and_(
+            models.MetricRollup.bucket_seconds == bucketSeconds,
+            models.MetricRollup.bucket_start_timestamp >= start,
+            models.MetricRollup.bucket_start_timestamp < end
+        )).all()
+
+    # (probe_name, samples, healthy_samples) summed over the rollups starting at or after since
+    def getMetricAvailabilitySince(self, bucketSeconds, since):
+        return self.query(
+            models.MetricRollup.probe_name,
+            func.sum(models.MetricRollup.samples),
+            func.sum(models.MetricRollup.healthy_samples)
+        ).filter(and_(
+            models.MetricRollup.bucket_seconds == bucketSeconds,
+            models.MetricRollup.bucket_start_timestamp >= since
+        )).group_by(models.MetricRollup.probe_name).all()
+
+    def getAllMetricRollupsPriorToDatetime(self, bucketSeconds, datetime):
+        return self.query(models.MetricRollup).filter(and_(
+            models.MetricRollup.bucket_seconds == bucketSeconds,
+            models.MetricRollup.bucket_start_timestamp < datetime
+        ))
+
     def getExecution(self, executionID):
         return self.query(models.Execution).filter(models.Execution.execution_id == executionID).first()
 
@@ -133,6 +216,91 @@ class DBCommon(object):
             models.Execution.execution_started_timestamp < datetime
         )
 
+    def getExportedBlob(self, blobPath):
+        return self.query(models.ExportedBlob).filter(
+            models.ExportedBlob.blob_path == blobPath
+        ).first()
+
+    def getExportFileCheckpoints(self, jobID, destinationName, commitID):
+        return self.query(models.ExportFileCheckpoint).filter(and_(
+            models.ExportFileCheckpoint.job_id == jobID,
+            models.ExportFileCheckpoint.destination_name == destinationName,
+            models.ExportFileCheckpoint.commit_id == commitID
+        )).all()
+
+    def getAllExportFileCheckpointsForJob(self, jobID, destinationName):
+        return self.query(models.ExportFileCheckpoint).filter(and_(
+            models.ExportFileCheckpoint.job_id == jobID,
+            models.ExportFileCheckpoint.destination_name == destinationName
+        ))
+
+    # Executions of a job that have been scheduled or are running and have not ended yet
+    def getActiveExecutionsForJob(self, jobID):
+        return self.query(models.Execution).filter(and_(
+            models.Execution.job_id == jobID,
+            models.Execution.execution_status >= StatusTypes.code["Scheduled"],
+            models.Execution.execution_ended_timestamp == None
+        )).all()
+
+    def getExportCancellationsForJobs(self, jobIDs):
+        return self.query(models.ExportCancellation).filter(
+            models.ExportCancellation.job_id.in_(jobIDs)
+        ).all()
+
+    def getAllExportCancellationsPriorToDatetime(self, datetime):
+        return self.query(models.ExportCancellation).filter(
+            models.ExportCancellation.requested_timestamp < datetime
+        )
+
+    def getWorkerNode(self, nodeID):
+        return self.query(models.WorkerNode).filter(models.WorkerNode.node_id == nodeID).first()
+
+    def getLiveWorkerNodes(self, heartbeatAfter):
+        return self.query(models.WorkerNode).filter(models.WorkerNode.heartbeat_timestamp >= heartbeatAfter).all()
+
+    def getAllWorkerNodesPriorToDatetime(self, datetime):
+        return self.query(models.WorkerNode).filter(
+            models.WorkerNode.heartbeat_timestamp < datetime
+        )
+
+    def getExecutionLease(self, executionID):
+        return self.query(models.ExecutionLease).filter(models.ExecutionLease.execution_id == executionID).first()
+
+    def getExecutionLeasesByExecutionIDs(self, executionIDs):
+        return self.query(models.ExecutionLease).filter(
+            models.ExecutionLease.execution_id.in_(executionIDs)
+        )
+
+    def getLeaderLease(self, leaseName):
+        return self.query(models.LeaderLease).filter(models.LeaderLease.lease_name == leaseName).first()
+
+    # Unfinished executions whose lease has run out, or that were never leased and were created before unleasedBefore
+    def getOrphanedExecutions(self, now, unleasedBefore):
+        unfinished = and_(
+            models.Execution.execution_status > StatusTypes.code["Initializing"],
+            models.Execution.execution_status != StatusTypes.code["Completed"],
+            models.Execution.execution_ended_timestamp == None
+        )
+
+        expired = self.query(models.Execution).join(
+            models.ExecutionLease, models.ExecutionLease.execution_id == models.Execution.execution_id
+        ).filter(and_(
+            unfinished,
+            models.ExecutionLease.lease_expires_timestamp < now
+        )).all()
+
+        unleased = self.query(models.Execution).join(
+            models.JobRun, models.JobRun.associated_execution_id == models.Execution.execution_id
+        ).outerjoin(
+            models.ExecutionLease, models.ExecutionLease.execution_id == models.Execution.execution_id
+        ).filter(and_(
+            unfinished,
+            models.ExecutionLease.execution_id == None,
+            models.JobRun.job_run_started_timestamp < unleasedBefore
+        )).all()
+
+        return expired + unleased
+
     def isJobRunning(self, jobID):
         return self.query(models.Execution).filter(and_(
             models.Execution.job_id == jobID,
@@ -161,33 +329,80 @@ class DBCommon(object):
         statusRecords = []
 
         for job in self.getAllProjectExportJobs():
-            jobID = job.job_id
-            jobRunID = self.getLastJobRunID(jobID)
-
-            while jobRunID > 0:
-                status = self.projectExportStatusByJobIDRun(jobID, jobRunID)
-
-                if status["status"] in showOnly:
-                    break
-
-                jobRunID = jobRunID - 1
-
-            statusSubsetData = {
-                "timestamp": status["timestamp"],
-                "export_id": status["export_id"],
-                "status": status["status"],
-                "sync_log_path": DBHelpers.syncLogFilePath(
-                    status["domino_username"],
-                    status["domino_project_name"],
-                    status["export_group_name"],
-                    status["export_project_name"]
-                ) if status["status"] != "scheduled" else None
-            }
-
-            statusRecords.append(statusSubsetData)
+            statusRecords.append(self.projectExportJobStatusSubset(job.job_id, showOnly))
 
         return statusRecords
 
+    # The exports-status.log record of one job: its most recent run with a status in showOnly
+    def projectExportJobStatusSubset(self, jobID, showOnly = ["scheduled", "success", "error", "disabled"]):
+        jobRunID = self.getLastJobRunID(jobID)
+        status = None
+
+        while jobRunID > 0:
+            status = self.projectExportStatusByJobIDRun(jobID, jobRunID)
+
+            if status["status"] in showOnly:
+                break
+
+            jobRunID = jobRunID - 1
+
+        # Never run yet
+        if status is None:
+            status = self.projectExportStatusByJobIDRun(jobID, 0)
+
+        statusSubsetData = {
+            "timestamp": status["timestamp"],
+            "export_id": status["export_id"],
+            "status": status["status"],
+            "sync_log_path": DBHelpers.syncLogFilePath(
+                status["domino_username"],
+                status["domino_project_name"],
+                status["export_group_name"],
+                status["export_project_name"]
+            ) if status["status"] != "scheduled" else None
+        }
+
+        return statusSubsetData
+
+    # (job, signature) for every project export job, where the signature changes whenever anything its
+    #  exports-status.log record is built from does (the job row, its job runs or its executions)
+    def getProjectExportJobSignatures(self):
+        jobRunSignatures = {
+            row[0]: tuple(row[1:])
+            for row in self.query(
+                models.JobRun.job_id,
+                func.count(models.JobRun.job_run_pk),
+                func.max(models.JobRun.job_run_id),
+                func.max(models.JobRun.job_run_updated_timestamp)
+            ).group_by(models.JobRun.job_id).all()
+        }
+        # Executions have no status timestamp, so hash what every execution's status line is built from; a sum
+        #  or maximum misses two executions changing at once
+        executionHashes = {}
+        for row in self.query(
+            models.Execution.job_id,
+            models.Execution.execution_id,
+            models.Execution.execution_status,
+            models.Execution.execution_started_timestamp,
+            models.Execution.execution_ended_timestamp
+        ).join(models.Job).filter(models.Job.job_type == "ProjectExport").order_by(models.Execution.execution_id).all():
+            executionHashes.setdefault(row[0], sha256()).update(repr(tuple(row[1:])).encode())
+        executionSignatures = {jobID: executionHash.hexdigest() for (jobID, executionHash) in executionHashes.items()}
+
+        return [
+            (job, (
+                job.job_updated_timestamp,
+                job.job_active,
+                job.job_user,
+                job.job_project,
+                job.job_export_group,
+                job.job_export_project,
+                jobRunSignatures.get(job.job_id, None),
+                executionSignatures.get(job.job_id, None)
+            ))
+            for job in self.getAllProjectExportJobs()
+        ]
+
     def projectExportStatusLastHistory(self, jobID):
         jobRunID = self.getLastJobRunID(jobID)
         status = self.projectExportStatusByJobIDRun(jobID, jobRunID)
@@ -12,6 +12,23 @@ SQLALCHEMY_MAX_QUERY_ATTEMPTS = 10
 SQLALCHEMY_MAX_QUERY_ATTEMPTS_WAIT_SECONDS = 1
 DOCKER_BUILD_TEMPLATE_PATH = os.environ.get("DOCKER_BUILD_TEMPLATE_PATH", os.path.join(APP_INSTANCE_PATH, "docker_templates")).strip()
 
+# "all" serves the API and runs the scheduler in one process (flask run). For gunicorn, run any number of "api"
+#  processes and any number of "worker" processes (worker.py); they only share the database
+SERVICE_ROLE = os.environ.get("SERVICE_ROLE", "all").strip()
+# How often the scheduler looks in the database for jobs created or changed by "api" processes
+WORKER_JOB_SYNC_FREQUENCY_SECONDS = 15
+# Running executions check for cancellations (POST /v1/projects/cancel) requested by any process this often
+EXPORT_CANCELLATION_POLL_SECONDS = 2
+# Several worker processes (on one or more hosts) may share the database. Nodes heartbeat every WORKER_HEARTBEAT_SECONDS
+#  and drop out of the export_id hash ring after WORKER_NODE_TIMEOUT_SECONDS of silence. An execution whose lease is not
+#  renewed within WORKER_EXECUTION_LEASE_SECONDS is re-run elsewhere, at most WORKER_EXECUTION_MAX_ATTEMPTS times
+WORKER_HEARTBEAT_SECONDS = 10
+WORKER_NODE_TIMEOUT_SECONDS = 30
+WORKER_LEADER_LEASE_SECONDS = 30
+WORKER_EXECUTION_LEASE_SECONDS = 60
+WORKER_EXECUTION_MAX_ATTEMPTS = 3
+WORKER_HASH_RING_REPLICAS = 64
+
 DOMINO_API_SERVER = "https://localhost"
 DOMINO_API_SERVER_VERIFY_SSL = False
 EXPORTS_PROJECT_FILES_S3_BUCKET = "s3://none"
@@ -20,6 +37,57 @@ EXPORTS_PROJECT_FILES_S3_LATEST_FORMAT = "{EXPORTS_PROJECT_FILES_S3_PATH}/latest
 EXPORTS_PROJECT_FILES_S3_PRIOR_FORMAT = "{EXPORTS_PROJECT_FILES_S3_PATH}/prior"
 EXPORTS_PROJECT_FILES_S3_SYNC_LOG_PATH_FORMAT = "{EXPORTS_PROJECT_FILES_S3_PATH}/sync-status.log"
 EXPORTS_PROJECT_FILES_S3_SYNC_LOG_MAX_RECORDS = 10
+# Project files are downloaded in chunks of EXPORTS_PROJECT_FILES_CHUNK_SIZE_BYTES into a pool of EXPORTS_PROJECT_FILES_BUFFERS buffers
+#  while a separate thread uploads them to S3
+EXPORTS_PROJECT_FILES_CHUNK_SIZE_BYTES = 8 * 1024 * 1024
+EXPORTS_PROJECT_FILES_BUFFERS = 4
+# Files up to EXPORTS_PROJECT_FILES_S3_SINGLE_PUT_MAX_BYTES are uploaded with a single PUT, larger ones as multipart uploads with parts of
+#  EXPORTS_PROJECT_FILES_S3_PART_SIZE_BYTES (at least 5 MiB), EXPORTS_PROJECT_FILES_S3_PART_CONCURRENCY of them at a time
+EXPORTS_PROJECT_FILES_S3_SINGLE_PUT_MAX_BYTES = 16 * 1024 * 1024
+EXPORTS_PROJECT_FILES_S3_PART_SIZE_BYTES = 16 * 1024 * 1024
+EXPORTS_PROJECT_FILES_S3_PART_CONCURRENCY = 4
+# Store project files content-addressed: each Domino blob is uploaded once under EXPORTS_PROJECT_FILES_S3_BLOB_STORE_PATH_FORMAT, shared by
+#  every project and commit that contains it, and latest only holds a manifest (EXPORTS_PROJECT_FILES_S3_MANIFEST_NAME) mapping file paths
+#  to their blobs. Blobs are never deleted by the service
+EXPORTS_PROJECT_FILES_S3_BLOB_STORE_ENABLED = False
+EXPORTS_PROJECT_FILES_S3_BLOB_STORE_PATH_FORMAT = "{S3_BUCKET}/blobs"
+EXPORTS_PROJECT_FILES_S3_MANIFEST_NAME = "manifest.json"
+# Pack project files of up to EXPORTS_PROJECT_FILES_S3_SHARD_FILE_MAX_BYTES into tar shards of about EXPORTS_PROJECT_FILES_S3_SHARD_MAX_BYTES
+#  under EXPORTS_PROJECT_FILES_S3_SHARD_FOLDER in latest; larger files are still exported as objects of their own. The index there lists
+#  every path with its shard and data offset (or its object). Compression is None, "gzip" or "zstd" (needs the zstandard package).
+#  Not used with the blob store
+EXPORTS_PROJECT_FILES_S3_SHARDS_ENABLED = False
+EXPORTS_PROJECT_FILES_S3_SHARD_FILE_MAX_BYTES = 1024 * 1024
+EXPORTS_PROJECT_FILES_S3_SHARD_MAX_BYTES = 256 * 1024 * 1024
+EXPORTS_PROJECT_FILES_S3_SHARD_COMPRESSION = "gzip"
+EXPORTS_PROJECT_FILES_S3_SHARD_FOLDER = "_shards"
+EXPORTS_PROJECT_FILES_S3_SHARD_INDEX_NAME = "index.json"
+# Further buckets jobs can export project files to along with EXPORTS_PROJECT_FILES_S3_BUCKET (e.g. {"dr": "s3://exports-dr"}), chosen by
+#  name in the job's export_destinations. Each file is downloaded once and written to every destination at the same time; a destination
+#  that fails, or spends over EXPORTS_PROJECT_FILES_DESTINATION_STALL_SECONDS on one write, is dropped and resumed on the next run
+EXPORTS_PROJECT_FILES_S3_DESTINATIONS = {}
+EXPORTS_PROJECT_FILES_DESTINATION_STALL_SECONDS = 300
+# Export buckets (EXPORTS_PROJECT_FILES_S3_BUCKET and EXPORTS_PROJECT_FILES_S3_DESTINATIONS) may also be file:// folders on a local or NFS
+#  file system. Files there are written to temporary files that are fsynced and renamed into place in batches of up to
+#  EXPORTS_PROJECT_FILES_LOCAL_FSYNC_BATCH_FILES files or EXPORTS_PROJECT_FILES_LOCAL_FSYNC_BATCH_BYTES bytes
+EXPORTS_PROJECT_FILES_LOCAL_FSYNC_BATCH_FILES = 64
+EXPORTS_PROJECT_FILES_LOCAL_FSYNC_BATCH_BYTES = 256 * 1024 * 1024
+# Token bucket limits on the export traffic of the whole service, per channel: "domino" (project file downloads from the Domino API) and
+#  "s3" (project file and image uploads to S3). "bytesPerSecond" and "requestsPerSecond" are None for no limit. Each live worker node
+#  enforces an equal share, whether or not the other nodes are busy. EXPORTS_TRAFFIC_JOB_LIMITS caps every job's share of a channel the
+#  same way. Each node's usage and share are reported under worker_nodes in /health
+EXPORTS_TRAFFIC_LIMITS = {
+    "domino": {"bytesPerSecond": None, "requestsPerSecond": None},
+    "s3": {"bytesPerSecond": None, "requestsPerSecond": None}
+}
+EXPORTS_TRAFFIC_JOB_LIMITS = {
+    "domino": {"bytesPerSecond": None, "requestsPerSecond": None},
+    "s3": {"bytesPerSecond": None, "requestsPerSecond": None}
+}
+# Windows of the day ("HH:MM" local time, end excluded, may run past midnight) whose "limits" and "jobLimits" replace the ones above while
+#  they apply; the first matching window wins, e.g.
+#  [{"start": "08:00", "end": "18:00", "limits": {"s3": {"bytesPerSecond": 50 * 1000 * 1000}}}]
+EXPORTS_TRAFFIC_LIMIT_SCHEDULE = []
 
 # Define a function here that consumes a list of status log records and formats them for the EXPORTS_PROJECT_FILES_S3_SYNC_LOG_PATH_FORMAT file
 EXPORTS_PROJECT_FILES_S3_SYNC_LOG_FORMATTER = lambda records: "[\n{0}\n]".format(",\n".join([json.dumps(record, default=str) for record in records]))
@@ -29,18 +97,79 @@ EXPORTS_DOCKER_REGISTRY_USERNAME = None
 EXPORTS_DOCKER_REGISTRY_PASSWORD = None
 EXPORTS_DOCKER_IMAGE_NAME_VERSION_FORMAT = "{DOCKER_REGISTRY}/{EXPORT_GROUP_NAME}/{EXPORT_PROJECT_NAME}:{DOMINO_COMPUTE_ENVIRONMENT_ID}-v{DOMINO_COMPUTE_ENVIRONMENT_REVISION}"
 EXPORTS_DOCKER_IMAGE_NAME_LATEST_FORMAT = "{DOCKER_REGISTRY}/{EXPORT_GROUP_NAME}/{EXPORT_PROJECT_NAME}:latest"
+# Copy images directly between the Domino and export registries over the Registry HTTP API v2 (no local Docker daemon)
+#  This only applies to jobs whose Dockerfile template is a pure "FROM {DOMINO_DOCKER_IMAGE}"
+EXPORTS_DOCKER_REGISTRY_COPY_ENABLED = False
+# Check the export registry for the version tag before pulling, and skip the export or only re-point latest if it holds the
+#  digest last exported for this revision (or, for pure FROM templates, the Domino image's digest)
+EXPORTS_DOCKER_REGISTRY_PREFLIGHT_ENABLED = True
+# Set to True to talk plain HTTP to the registry (e.g. a local registry:2 instance)
+DOMINO_DOCKER_REGISTRY_INSECURE = False
+EXPORTS_DOCKER_REGISTRY_INSECURE = False
+DOCKER_REGISTRY_VERIFY_SSL = True
+DOCKER_REGISTRY_TIMEOUT_SECONDS = 60
+# Also write each exported image as an OCI image layout under the project's S3 export path, for consumers without registry access. Needs an
+#  s3:// EXPORTS_PROJECT_FILES_S3_BUCKET; with any other scheme image exports end with DockerImageS3ExportUnsupported
+EXPORTS_DOCKER_IMAGE_S3_ENABLED = False
+EXPORTS_DOCKER_IMAGE_S3_PATH_FORMAT = "{EXPORTS_PROJECT_FILES_S3_PATH}/image"
+EXPORTS_DOCKER_IMAGE_S3_PART_SIZE_BYTES = 64 * 1024 ** 2
+EXPORTS_DOCKER_IMAGE_S3_MAX_CONCURRENCY = 8
+# Images pulled/built for exports are kept locally (keyed by compute environment revision) and removed
+#  least recently used first once they exceed this many bytes
+DOCKER_IMAGE_CACHE_ENABLED = True
+DOCKER_IMAGE_CACHE_BUDGET_BYTES = 50 * 1024 ** 3
+# Docker pull/push/build logs are aggregated per layer; only the last DOCKER_LOGS_MAX_LINES lines are kept in memory
+#  and DOCKER_LOGS_SUMMARY_LINES of those are saved with the execution details
+DOCKER_LOGS_MAX_LINES = 100
+DOCKER_LOGS_MAX_LAYERS = 256
+DOCKER_LOGS_SUMMARY_LINES = 10
 JOBS_MAX_CONCURRENT_WORKERS = 20
 JOB_TASK_TIMEOUT_IN_SECONDS = 7200
 EXPORT_JOB_SCHEDULE_DEFAULT_FREQUENCY_SECONDS = 900
+# POST /v1/projects/create/batch limits, concurrent Domino lookups and the delay between the initial runs of the new exports
+EXPORT_JOB_BATCH_MAX_SIZE = 100
+EXPORT_JOB_BATCH_VALIDATION_WORKERS = 8
+EXPORT_JOB_BATCH_STAGGER_SECONDS = 10
 HEALTHCHECK_SCHEDULE_FREQUENCY_SECONDS = 15
 HEALTHCHECK_TIMEOUT_IN_SECONDS = 5
+# /health is served from an in-memory snapshot that the collector replaces after every run; a process that has not
+#  collected within this many seconds (e.g. SERVICE_ROLE "api") rebuilds it from the database
+HEALTHCHECK_SNAPSHOT_MAX_AGE_SECONDS = 30
+# /health reports p50/p95 dependency probe latency over this window
+HEALTHCHECK_LATENCY_WINDOW_SECONDS = 900
+# /health reports the percentage of healthy checks per dependency over this window, from the hourly rollups
+HEALTHCHECK_AVAILABILITY_WINDOW_SECONDS = 7 * 86400
+# Health checks are rolled up into per-minute and per-hour buckets every METRICS_ROLLUP_FREQUENCY_SECONDS (minutes are
+#  rolled up once they are METRICS_ROLLUP_SETTLE_SECONDS old, at most METRICS_ROLLUP_MAX_CATCHUP_SECONDS worth per run)
+METRICS_ROLLUP_FREQUENCY_SECONDS = 60
+METRICS_ROLLUP_SETTLE_SECONDS = 30
+METRICS_ROLLUP_MAX_CATCHUP_SECONDS = 86400
+# How long raw health checks (once rolled up), minute rollups and hour rollups are kept
+METRICS_RAW_RETENTION_SECONDS = 6 * 3600
+METRICS_MINUTE_ROLLUP_RETENTION_SECONDS = 2 * 86400
+METRICS_HOUR_ROLLUP_RETENTION_DAYS = 90
 SQLALCHEMY_ECHO = True
 DATABASE_HISTORY_AGE_DAYS = 30
 DATABASE_PRUNE_FREQUENCY_SECONDS = 86400
 OPENAPI_YAML_TEMPLATE_FILE = "domino-export-spec.yaml"
 API_STATUS_LOG_MAX_RECORDS = 10
+# Project access for /v1/projects/status is resolved from one paginated project listing per API key and cached for this long
+PROJECT_ACCESS_CACHE_TTL_SECONDS = 60
+PROJECT_ACCESS_LIST_PAGE_SIZE = 500
+# Rendered status responses are reused (and answered with 304 on a matching If-None-Match) until an execution finishes, an export is created or updated, or this many seconds pass
+API_STATUS_CACHE_ENABLED = True
+API_STATUS_CACHE_TTL_SECONDS = 15
+# Cached status responses skip the Domino API, so the API key is checked first; a key found valid is trusted for this long
+API_KEY_VALIDITY_CACHE_TTL_SECONDS = 5
+# Status listings accept ?limit=&cursor= (cursor is the job_id of the last record of the previous page); jobs are read from the DB in batches of API_STATUS_QUERY_BATCH_SIZE
+API_STATUS_PAGE_MAX_LIMIT = 1000
+API_STATUS_QUERY_BATCH_SIZE = 100
 EXPORTS_PROJECT_FILES_S3_TOP_LEVEL_LOG_FREQUENCY_SECONDS = 30
 EXPORTS_PROJECT_FILES_S3_TOP_LEVEL_LOG_PATH_FORMAT = "{S3_BUCKET}/exports-status.log"
+# Write one status log per export group instead, with EXPORTS_PROJECT_FILES_S3_TOP_LEVEL_LOG_PATH_FORMAT listing the groups and their
+#  log paths, so a status change only rewrites its own group's log
+EXPORTS_PROJECT_FILES_S3_TOP_LEVEL_LOG_SHARDED = False
+EXPORTS_PROJECT_FILES_S3_TOP_LEVEL_LOG_SHARD_PATH_FORMAT = "{S3_BUCKET}/exports-status/{EXPORT_GROUP_NAME}.log"
 
 # Define a function here that consumes a list of status log records and formats them for the EXPORTS_PROJECT_FILES_S3_TOP_LEVEL_LOG_PATH_FORMAT file
 EXPORTS_PROJECT_FILES_S3_TOP_LEVEL_LOG_FORMATTER = lambda records: "[\n{0}\n]".format(",\n".join([json.dumps(record, default=str) for record in records]))
@@ -0,0 +1,130 @@
+from app.helpers import S3Helpers, LocalHelpers
+from app.blobstore import ProjectBlobStore
+from app.transfer import FsyncBatcher, LocalFileWriter
+
+from urllib.parse import urlparse
+from smart_open import open
+import os
+
+class ExportDestinationFailed(Exception):
+    pass
+
+class ExportDestination(object):
+    # The latest/prior folders a project's files are exported to under one bucket URL. The primary one is
+    #  EXPORTS_PROJECT_FILES_S3_BUCKET; jobs can name more from EXPORTS_PROJECT_FILES_S3_DESTINATIONS (e.g. a DR region).
+    #  Bucket URLs are s3:// buckets or file:// folders on a local or NFS file system
+    primaryName = "default"
+
+    def __init__(self, name, bucketURL, pathFormatArgs):
+        from app import app
+
+        self.name = name
+        self.bucketURL = bucketURL
+
+        exportsS3Path = app.config["EXPORTS_PROJECT_FILES_S3_PATH_FORMAT"].format(S3_BUCKET = bucketURL, **pathFormatArgs)
+        self.latestPath = app.config["EXPORTS_PROJECT_FILES_S3_LATEST_FORMAT"].format(S3_BUCKET = bucketURL, EXPORTS_PROJECT_FILES_S3_PATH = exportsS3Path, **pathFormatArgs)
+        self.priorPath = app.config["EXPORTS_PROJECT_FILES_S3_PRIOR_FORMAT"].format(S3_BUCKET = bucketURL, EXPORTS_PROJECT_FILES_S3_PATH = exportsS3Path, **pathFormatArgs)
+
+    @staticmethod
+    def forURL(name, bucketURL, s3, s3Uploader, pathFormatArgs):
+        if urlparse(bucketURL).scheme == "file":
+            return LocalExportDestination(name, bucketURL, pathFormatArgs)
+
+        return S3ExportDestination(name, bucketURL, s3, s3Uploader, pathFormatArgs)
+
+    # Called once everything has been written, for destinations that defer making their files durable
+    def finish(self):
+        pass
+
+class S3ExportDestination(ExportDestination):
+    def __init__(self, name, bucketURL, s3, s3Uploader, pathFormatArgs):
+        super().__init__(name, bucketURL, pathFormatArgs)
+        self.__s3 = s3
+        self.__s3Uploader = s3Uploader
+
+        latestPathParsed = urlparse(self.latestPath)
+        self.bucket = latestPathParsed.netloc
+        self.__latestKey = latestPathParsed.path.lstrip("/")
+        self.__priorKey = urlparse(self.priorPath).path.lstrip("/")
+
+    def deletePrior(self):
+        S3Helpers.delete(self.__s3, self.bucket, self.__priorKey)
+
+    def moveLatestToPrior(self):
+        S3Helpers.move(self.__s3, self.bucket, self.__latestKey, self.__priorKey)
+
+    # ETag of every object in latest, keyed by its path relative to latest
+    def listETags(self):
+        return S3Helpers.listETags(self.__s3, self.bucket, self.__latestKey)
+
+    # Writer for a file in latest; see S3Uploader
+    def open(self, relativePath, size = None):
+        return self.__s3Uploader.open(self.bucket, "{0}/{1}".format(self.__latestKey, relativePath), size)
+
+    # Writer for any s3:// path, for blobs kept outside latest
+    def openPath(self, path, size = None):
+        pathParsed = urlparse(path)
+        return self.__s3Uploader.open(pathParsed.netloc, pathParsed.path.lstrip("/"), size)
+
+    def writeText(self, relativePath, text):
+        with open("{0}/{1}".format(self.latestPath, relativePath), "w") as textFile:
+            textFile.write(text)
+
+    def blobStore(self, dbSession):
+        from app import app
+
+        return ProjectBlobStore(
+            dbSession,
+            self.__s3.meta.client,
+            app.config["EXPORTS_PROJECT_FILES_S3_BLOB_STORE_PATH_FORMAT"].format(S3_BUCKET = self.bucketURL)
+        )
+
+class LocalExportDestination(ExportDestination):
+    # Exports to a folder on a local or NFS file system. Files are written through temporary files renamed into place
+    #  and made durable in batches (EXPORTS_PROJECT_FILES_LOCAL_FSYNC_BATCH_FILES/_BYTES), and latest becomes prior
+    #  with a single directory rename. Needs no network, so it also suits benchmarking the rest of the export
+    def __init__(self, name, bucketURL, pathFormatArgs):
+        from app import app
+
+        super().__init__(name, bucketURL, pathFormatArgs)
+        self.__latestDirectory = urlparse(self.latestPath).path
+        self.__priorDirectory = urlparse(self.priorPath).path
+        self.__batcher = FsyncBatcher(app.config["EXPORTS_PROJECT_FILES_LOCAL_FSYNC_BATCH_FILES"], app.config["EXPORTS_PROJECT_FILES_LOCAL_FSYNC_BATCH_BYTES"])
+
+    def deletePrior(self):
+        LocalHelpers.delete(self.__priorDirectory)
+
+    def moveLatestToPrior(self):
+        LocalHelpers.delete(self.__priorDirectory)
+        LocalHelpers.move(self.__latestDirectory, self.__priorDirectory)
+
+    def listETags(self):
+        return LocalHelpers.listETags(self.__latestDirectory)
+
+    def open(self, relativePath, size = None):
+        return LocalFileWriter(os.path.join(self.__latestDirectory, relativePath), size, self.__batcher)
+
+    # Blobs are recorded as exported as soon as they are written, so they are made durable right away
+    def openPath(self, path, size = None):
+        return LocalFileWriter(urlparse(path).path, size)
+
+    def writeText(self, relativePath, text):
+        textFile = self.open(relativePath)
+        try:
+            textFile.write(text.encode("utf-8"))
+            textFile.close()
+        except BaseException:
+            textFile.terminate()
+            raise
+
+    def blobStore(self, dbSession):
+        from app import app
+
+        return ProjectBlobStore(
+            dbSession,
+            None,
+            app.config["EXPORTS_PROJECT_FILES_S3_BLOB_STORE_PATH_FORMAT"].format(S3_BUCKET = self.bucketURL)
+        )
+
+    def finish(self):
+        self.__batcher.flush()
@@ -1,6 +1,10 @@
 import docker
 import re
+from app.cancellation import ExecutionCancelled
 from io import BytesIO
+from collections import deque, OrderedDict
+from time import time
+import threading
 import json
 
 class DockerException(Exception):
@@ -21,18 +25,276 @@ class DockerInvalidRepository(DockerException):
 class DockerBuildError(DockerException):
     pass
 
+class DockerProgressLog(object):
+    # Streaming consumer for the decoded pull/push/build log generators
+    # Progress events are folded into a fixed-size per-layer state table and only the
+    #  last maxLines events are kept (unformatted) in a ring buffer
+    transferPhases = ("Downloading", "Pushing")
+
+    def __init__(self, maxLines = 100, maxLayers = 256):
+        self.__lines = deque(maxlen = maxLines)
+        self.__layers = OrderedDict()
+        self.__maxLayers = maxLayers
+        self.__startTime = time()
+        self.__events = 0
+        self.__droppedLayers = 0
+        self.__droppedBytes = 0
+        self.response = {
+            "errorDetail": None,
+            "error": None
+        }
+
+    def consume(self, logs):
+        for line in logs:
+            self.__events += 1
+
+            if "status" in line:
+                self.__updateLayer(line)
+                self.__lines.append((
+                    line.get("id", "No ID"),
+                    line.get("status", "No Status"),
+                    (line.get("progressDetail") or {}).get("current", 0),
+                    (line.get("progressDetail") or {}).get("total", 0)
+                ))
+            elif "stream" in line:
+                self.__lines.append(line["stream"])
+            else:
+                for k in line:
+                    self.response[k] = line[k]
+
+        return self
+
+    def __updateLayer(self, line):
+        layerID = line.get("id", None)
+        if not layerID:
+            return
+
+        now = time()
+        status = line.get("status", "")
+        progress = line.get("progressDetail") or {}
+        layer = self.__layers.get(layerID, None)
+
+        if layer is None:
+            if len(self.__layers) >= self.__maxLayers:
+                # Table is full, fold the least recently updated layer into the aggregate counters
+                #  (preferring layers that are no longer transferring)
+                droppedID = next((k for (k, v) in self.__layers.items() if v["status"] not in self.transferPhases), None)
+                if droppedID is None:
+                    droppedID = next(iter(self.__layers))
+                dropped = self.__layers.pop(droppedID)
+                self.__droppedLayers += 1
+                self.__droppedBytes += dropped["bytes"]
+
+            layer = {
+                "status": status,
+                "bytes": 0,
+                "total": 0,
+                "phaseStarted": now,
+                "phaseUpdated": now,
+                "seconds": 0.0
+            }
+            self.__layers[layerID] = layer
+        else:
+            self.__layers.move_to_end(layerID)
+            if layer["status"] != status:
+                layer["phaseStarted"] = now
+
+        layer["status"] = status
+        layer["phaseUpdated"] = now
+
+        if status in self.transferPhases and progress:
+            layer["bytes"] = max(layer["bytes"], progress.get("current", 0))
+            layer["total"] = max(layer["total"], progress.get("total", 0) or 0)
+            layer["seconds"] = now - layer["phaseStarted"]
+
+    def lines(self):
+        formatted = []
+        for line in self.__lines:
+            if type(line) == tuple:
+                formatted.append("[{0}] {1} (progress: {2}/{3})".format(*line))
+            else:
+                formatted.append(line)
+
+        return formatted
+
+    def summary(self, maxLines = None):
+        elapsedSeconds = time() - self.__startTime
+        totalBytes = self.__droppedBytes + sum([layer["bytes"] for layer in self.__layers.values()])
+        tail = self.lines()
+        if maxLines is not None:
+            tail = tail[-maxLines:] if maxLines > 0 else []
+
+        return {
+            "events": self.__events,
+            "layers": len(self.__layers) + self.__droppedLayers,
+            "layersDropped": self.__droppedLayers,
+            "bytes": totalBytes,
+            "seconds": round(elapsedSeconds, 3),
+            "bytesPerSecond": int(totalBytes / elapsedSeconds) if elapsedSeconds > 0 else 0,
+            "layerThroughput": {
+                layerID: {
+                    "status": layer["status"],
+                    "bytes": layer["bytes"],
+                    "bytesPerSecond": int(layer["bytes"] / layer["seconds"]) if layer["seconds"] > 0 else 0
+                } for (layerID, layer) in self.__layers.items() if layer["bytes"]
+            },
+            "digest": (self.response.get("aux") or {}).get("Digest", None),
+            "error": self.response["error"],
+            "tail": tail
+        }
+
+class DockerImageCache(object):
+    # Tracks the local images used for exports, keyed by compute environment revision, so that the next
+    #  export of the same revision can reuse them. Least recently used entries are removed once the tracked
+    #  images exceed the byte budget; entries pinned by running executions are never removed.
+    # Export images are built with the labels below, so the index can be rebuilt from the local images after a restart
+    keyLabel = "domino-export.image-cache.key"
+    baseImageLabel = "domino-export.image-cache.base-image"
+    imageLabel = "domino-export.image-cache.image"
+
+    def __init__(self):
+        self.__lock = threading.RLock()
+        self.__entries = OrderedDict()
+        self.__hits = 0
+        self.__misses = 0
+        self.__evictions = 0
+        self.__bytesReclaimed = 0
+        self.__trackedBytes = 0
+        self.__budgetBytes = None
+
+    def pin(self, key, imageURL):
+        with self.__lock:
+            entry = self.__entries.setdefault(key, {
+                "images": [],
+                "pins": 0,
+                "bytes": 0,
+                "lastUsed": None
+            })
+            if imageURL not in entry["images"]:
+                entry["images"].insert(0, imageURL)
+            entry["pins"] += 1
+            entry["lastUsed"] = time()
+            self.__entries.move_to_end(key)
+
+    def unpin(self, key):
+        with self.__lock:
+            entry = self.__entries.get(key, None)
+            if entry and entry["pins"] > 0:
+                entry["pins"] -= 1
+
+    def track(self, key, imageURLs):
+        # Derived images (e.g. the export tags built on top of the Domino image) are removed together with the entry
+        with self.__lock:
+            entry = self.__entries.get(key, None)
+            if entry:
+                for imageURL in imageURLs:
+                    if imageURL not in entry["images"]:
+                        entry["images"].append(imageURL)
+
+    def labels(self, key, baseImageURL, imageURL):
+        return {
+            self.keyLabel: key,
+            self.baseImageLabel: baseImageURL,
+            self.imageLabel: imageURL
+        }
+
+    def restore(self, images):
+        # images are "docker images" records of the labelled export images; oldest first, so the most recently
+        #  built revisions are the last to be evicted
+        with self.__lock:
+            restored = OrderedDict()
+            for image in sorted(images, key = lambda image: image.get("Created", 0)):
+                labels = image.get("Labels") or {}
+                key = labels.get(self.keyLabel, None)
+                if not key or (key in self.__entries):
+                    continue
+
+                restored[key] = {
+                    "images": [imageURL for imageURL in (labels.get(self.baseImageLabel, None), labels.get(self.imageLabel, None)) if imageURL],
+                    "pins": 0,
+                    "bytes": image.get("Size", 0),
+                    "lastUsed": image.get("Created", None)
+                }
+                restored.move_to_end(key)
+
+            # Entries tracked since the start are more recent than anything restored
+            restored.update(self.__entries)
+            self.__entries = restored
+            self.__trackedBytes = sum([entry["bytes"] for entry in self.__entries.values()])
+
+    def recordLookup(self, hit):
+        with self.__lock:
+            if hit:
+                self.__hits += 1
+            else:
+                self.__misses += 1
+
+    def evict(self, budgetBytes, imageSize, removeImage):
+        # imageSize(imageURL) returns the local size in bytes (0 if missing) and removeImage(imageURL) removes it
+        evicted = []
+
+        with self.__lock:
+            self.__budgetBytes = budgetBytes
+            for (key, entry) in list(self.__entries.items()):
+                # Derived images share the Domino image layers, so the largest image approximates the entry size
+                entry["bytes"] = max([imageSize(imageURL) for imageURL in entry["images"]] + [0])
+                if not entry["bytes"] and not entry["pins"]:
+                    del self.__entries[key]
+
+            self.__trackedBytes = sum([entry["bytes"] for entry in self.__entries.values()])
+
+            for (key, entry) in list(self.__entries.items()):
+                if self.__trackedBytes <= budgetBytes:
+                    break
+                if entry["pins"]:
+                    continue
+
+                # Remove derived images first so the Domino image is no longer referenced
+                for imageURL in reversed(entry["images"]):
+                    removeImage(imageURL)
+
+                del self.__entries[key]
+                self.__trackedBytes -= entry["bytes"]
+                self.__bytesReclaimed += entry["bytes"]
+                self.__evictions += 1
+                evicted.append(key)
+
+        return evicted
+
+    def stats(self):
+        with self.__lock:
+            lookups = self.__hits + self.__misses
+            return {
+                "entries": len(self.__entries),
+                "pinned_entries": len([entry for entry in self.__entries.values() if entry["pins"]]),
+                "tracked_bytes": self.__trackedBytes,
+                "budget_bytes": self.__budgetBytes,
+                "hits": self.__hits,
+                "misses": self.__misses,
+                "hit_rate": round(self.__hits / lookups, 4) if lookups else None,
+                "evictions": self.__evictions,
+                "bytes_reclaimed": self.__bytesReclaimed
+            }
+
 class DockerClient(object):
-    def __init__(self, dominoDockerRegistry, externalDockerRegistry):
+    def __init__(self, dominoDockerRegistry, externalDockerRegistry, logMaxLines = 100, logMaxLayers = 256, logSummaryLines = 10, cancellation = None):
         self.__dockerClient = docker.from_env()
         self.__dockerClientAPI = docker.APIClient(base_url='unix://var/run/docker.sock')
         self.__dominoDockerRegistry = dominoDockerRegistry
         self.__externalDockerRegistry = externalDockerRegistry
         self.__raiseOnException = False
+        self.__logMaxLines = logMaxLines
+        self.__logMaxLayers = logMaxLayers
+        self.__logSummaryLines = logSummaryLines
+        self.__cancellation = cancellation
 
     def raiseOnException(self, roe = True):
         self.__raiseOnException = roe
 
     def __raiseErrorChain(self, e):
+        if isinstance(e, ExecutionCancelled):
+            raise(e)
+
         if self.__raiseOnException:
             if type(e) == docker.errors.APIError:
                 raise DockerAPIError() from e
@@ -89,7 +351,7 @@ class DockerClient(object):
     def externalRegistryHealth(self):
         return self.registryHealth(self.__externalDockerRegistry)
 
-    def cleanup(self):
+    def cleanup(self, imageCache = None, budgetBytes = None):
         status = {
             "success": False,
             "message": None,
@@ -98,7 +360,14 @@ class DockerClient(object):
 
         if self.clientHealth()["online"]:
             try:
-                status["status"] = self.__dockerClientAPI.prune_builds()
+                if imageCache is not None:
+                    evicted = imageCache.evict(budgetBytes, self.imageSize, self.removeImage)
+                    status["status"] = {"evicted": evicted}
+                    # Build cache only references the evicted images once they are gone
+                    if evicted:
+                        self.__dockerClientAPI.prune_builds()
+                else:
+                    status["status"] = self.__dockerClientAPI.prune_builds()
                 status["success"] = True
             except Exception as e:
                 self.__raiseErrorChain(e)
@@ -106,11 +375,41 @@ class DockerClient(object):
         else:
             status["message"] = "Docker client unavailable"
 
-    def build(self, dockerFileTemplatePath, dominoImageURL, exportImageURL):
+        return status
+
+    def isImagePresent(self, imageURL):
+        try:
+            self.__dockerClientAPI.inspect_image(imageURL)
+            return True
+        except docker.errors.ImageNotFound:
+            return False
+
+    def imageSize(self, imageURL):
+        try:
+            return self.__dockerClientAPI.inspect_image(imageURL).get("Size", 0)
+        except docker.errors.ImageNotFound:
+            return 0
+
+    def removeImage(self, imageURL):
+        try:
+            self.__dockerClientAPI.remove_image(imageURL)
+        except (docker.errors.ImageNotFound, docker.errors.APIError):
+            # Already gone or still in use by a container
+            pass
+
+    def labeledImages(self, label):
+        try:
+            return self.__dockerClientAPI.images(filters = {"label": label})
+        except Exception as e:
+            self.__raiseErrorChain(e)
+            return []
+
+    def build(self, dockerFileTemplatePath, dominoImageURL, exportImageURL, labels = None):
         status = {
             "success": False,
             "message": None,
-            "logs": None
+            "logs": None,
+            "summary": None
         }
 
         if self.clientHealth()["online"] and self.dominoRegistryHealth()["online"]:
@@ -125,14 +424,15 @@ class DockerClient(object):
                 dockerFile = BytesIO(dockerFileText.encode('utf-8'))
 
                 # Perform the Docker build
-                response = self.__processBuildLogs(self.__dockerClientAPI.build(fileobj = dockerFile, rm = False, tag = exportImageURL, decode = True))
+                response = self.__processBuildLogs(self.__dockerClientAPI.build(fileobj = dockerFile, rm = False, tag = exportImageURL, labels = labels, decode = True))
 
-                status["logs"] = response["stream"]
-                if not response["error"]:
+                status["logs"] = response.lines()
+                status["summary"] = response.summary(self.__logSummaryLines)
+                if not response.response["error"]:
                     status["success"] = True
                 else:
                     status["success"] = False
-                    status["message"] = response["error"]
+                    status["message"] = response.response["error"]
             except Exception as e:
                 self.__raiseErrorChain(e)
                 status["message"] = str(e)
@@ -141,42 +441,44 @@ class DockerClient(object):
 
         return status
 
-    def __processBuildLogs(self, build):
-        response = {
-            "stream": [],
-            "errorDetail": None,
-            "error": None
-        }
-
-        for line in build:
-            if "stream" in line:
-                response["stream"].append(line["stream"])
-            else:
-                for k in line:
-                    response[k] = line[k]
+    # Stops reading a pull/push/build log stream at the next line once the export is cancelled
+    def __cancellable(self, logs):
+        for line in logs:
+            if self.__cancellation:
+                self.__cancellation.check()
+            yield line
 
-        return response
+    def __processBuildLogs(self, build):
+        return DockerProgressLog(self.__logMaxLines, self.__logMaxLayers).consume(self.__cancellable(build))
 
-    def pull(self, imageURL):
+    def pull(self, imageURL, skipIfPresent = False):
         status = {
             "success": False,
             "message": None,
-            "logs": None
+            "logs": None,
+            "summary": None,
+            "cached": False
         }
 
-        if self.clientHealth()["online"] and self.dominoRegistryHealth()["online"]:
+        if skipIfPresent and self.clientHealth()["online"] and self.isImagePresent(imageURL):
+            # Domino compute environment revisions are immutable, so a local copy is as good as a fresh pull
+            status["success"] = True
+            status["cached"] = True
+            status["message"] = "Image already present locally"
+        elif self.clientHealth()["online"] and self.dominoRegistryHealth()["online"]:
             try:
                 if self.__dominoDockerRegistry.get("username", False) and self.__dominoDockerRegistry.get("password", False):
                     response = self.__processPullAndPushLogs(self.__dockerClientAPI.pull(repository = imageURL, stream = True, decode = True, auth_config = self.__dominoDockerRegistry))
                 else:
                     response = self.__processPullAndPushLogs(self.__dockerClientAPI.pull(repository = imageURL, stream = True, decode = True))
 
-                status["logs"] = response["stream"]
-                if not response["error"]:
+                status["logs"] = response.lines()
+                status["summary"] = response.summary(self.__logSummaryLines)
+                if not response.response["error"]:
                     status["success"] = True
                 else:
                     status["success"] = False
-                    status["message"] = response["error"]
+                    status["message"] = response.response["error"]
             except Exception as e:
                 self.__raiseErrorChain(e)
                 status["message"] = str(e)
@@ -189,7 +491,8 @@ class DockerClient(object):
         status = {
             "success": False,
             "message": None,
-            "logs": None
+            "logs": None,
+            "summary": None
         }
 
         if self.clientHealth()["online"] and self.externalRegistryHealth()["online"]:
@@ -199,12 +502,13 @@ class DockerClient(object):
                 else:
                     response = self.__processPullAndPushLogs(self.__dockerClientAPI.push(repository = imageURL, stream = True, decode = True))
 
-                status["logs"] = response["stream"]
-                if not response["error"]:
+                status["logs"] = response.lines()
+                status["summary"] = response.summary(self.__logSummaryLines)
+                if not response.response["error"]:
                     status["success"] = True
                 else:
                     status["success"] = False
-                    status["message"] = response["error"]
+                    status["message"] = response.response["error"]
             except Exception as e:
                 self.__raiseErrorChain(e)
                 status["message"] = str(e)
@@ -214,24 +518,4 @@ class DockerClient(object):
         return status
 
     def __processPullAndPushLogs(self, build):
-        response = {
-            "stream": [],
-            "errorDetail": None,
-            "error": None
-        }
-
-        for line in build:
-            if "status" in line:
-                response["stream"].append(
-                    "[{0}] {1} (progress: {2}/{3})".format(
-                        line.get("id", "No ID"),
-                        line.get("status", "No Status"),
-                        line.get("progressDetail", {}).get("current", 0),
-                        line.get("progressDetail", {}).get("total", 0)
-                    )
-                )
-            else:
-                for k in line:
-                    response[k] = line[k]
-
-        return response
\ No newline at end of file
+        return DockerProgressLog(self.__logMaxLines, self.__logMaxLayers).consume(self.__cancellable(build))
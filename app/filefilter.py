@@ -0,0 +1,42 @@
+from fnmatch import fnmatchcase
+
+class ProjectFileFilter(object):
+    # Which project files a job exports. Patterns are shell globs matched against the whole path in the project, and
+    #  "*" matches across folders ("*.ckpt" excludes checkpoints anywhere). A file is exported when it matches an include
+    #  pattern (or there are none), matches no exclude pattern and is no larger than maxFileSizeBytes (if set). Files
+    #  whose size Domino does not report are never dropped for their size
+    def __init__(self, include = None, exclude = None, maxFileSizeBytes = None):
+        self.include = list(include or [])
+        self.exclude = list(exclude or [])
+        self.maxFileSizeBytes = maxFileSizeBytes
+
+    @staticmethod
+    def fromJobDetails(jobDetails):
+        return ProjectFileFilter(
+            jobDetails.get("fileIncludePatterns", None),
+            jobDetails.get("fileExcludePatterns", None),
+            jobDetails.get("fileMaxSizeBytes", None)
+        )
+
+    # Checks values given through the API, where a size of 0 means no size limit
+    @staticmethod
+    def isValid(include, exclude, maxFileSizeBytes):
+        for patterns in (include, exclude):
+            if (patterns is not None) and ((not isinstance(patterns, list)) or any([(not isinstance(pattern, str)) or (not pattern) for pattern in patterns])):
+                return False
+
+        # bool is an int too
+        if (maxFileSizeBytes is not None) and ((not isinstance(maxFileSizeBytes, int)) or isinstance(maxFileSizeBytes, bool) or (maxFileSizeBytes < 0)):
+            return False
+
+        return True
+
+    def matches(self, path, size = None):
+        if self.include and not any([fnmatchcase(path, pattern) for pattern in self.include]):
+            return False
+        if any([fnmatchcase(path, pattern) for pattern in self.exclude]):
+            return False
+        if self.maxFileSizeBytes and (size is not None) and (size > self.maxFileSizeBytes):
+            return False
+
+        return True
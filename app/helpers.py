@@ -1,3 +1,6 @@
+import os
+import shutil
+
 class DBHelpers(object):
     @staticmethod
     def hashEncode(data):
@@ -47,6 +50,29 @@ class DBHelpers(object):
 
         return syncStatusLogFilePath
 
+    @staticmethod
+    def imageExportS3Path(jobUser, jobProject, exportGroup, exportProject):
+        from app import app
+
+        exportsS3Path = app.config["EXPORTS_PROJECT_FILES_S3_PATH_FORMAT"].format(
+            S3_BUCKET = app.config["EXPORTS_PROJECT_FILES_S3_BUCKET"],
+            DOMINO_USERNAME = jobUser,
+            DOMINO_PROJECT_NAME = jobProject,
+            EXPORT_GROUP_NAME = exportGroup,
+            EXPORT_PROJECT_NAME = exportProject
+        )
+
+        imageExportS3Path = app.config["EXPORTS_DOCKER_IMAGE_S3_PATH_FORMAT"].format(
+            S3_BUCKET = app.config["EXPORTS_PROJECT_FILES_S3_BUCKET"],
+            DOMINO_USERNAME = jobUser,
+            DOMINO_PROJECT_NAME = jobProject,
+            EXPORT_GROUP_NAME = exportGroup,
+            EXPORT_PROJECT_NAME = exportProject,
+            EXPORTS_PROJECT_FILES_S3_PATH = exportsS3Path
+        )
+
+        return imageExportS3Path
+
     @staticmethod
     def exportsLogFilePath():
         from app import app
@@ -57,6 +83,17 @@ class DBHelpers(object):
 
         return exportsLogFilePath
 
+    @staticmethod
+    def exportsLogShardFilePath(exportGroup):
+        from app import app
+
+        exportsLogShardFilePath = app.config["EXPORTS_PROJECT_FILES_S3_TOP_LEVEL_LOG_SHARD_PATH_FORMAT"].format(
+            S3_BUCKET = app.config["EXPORTS_PROJECT_FILES_S3_BUCKET"],
+            EXPORT_GROUP_NAME = exportGroup
+        )
+
+        return exportsLogShardFilePath
+
 class S3Helpers(object):
     @staticmethod
     def move(s3, bucket, sourcePrefix, destinationPrefix):
@@ -75,7 +112,55 @@ class S3Helpers(object):
             s3.Object(s3Object.bucket_name, destFileKey).copy_from(CopySource=copySource)
             s3Object.delete()
 
+    # ETag of every object under prefix, keyed by the key relative to prefix
+    @staticmethod
+    def listETags(s3, bucket, prefix):
+        s3Bucket = s3.Bucket(bucket)
+        return {
+            s3Object.key[len(prefix):].lstrip("/"): s3Object.e_tag
+            for s3Object in s3Bucket.objects.filter(Prefix = prefix)
+        }
+
     @staticmethod
     def delete(s3, bucket, prefix):
         s3Bucket = s3.Bucket(bucket)
         s3Bucket.objects.filter(Prefix=prefix).delete()
+
+    # Discards a partially written smart_open file: S3 writers abort their multipart upload, other files are just closed
+    @staticmethod
+    def abortWrite(fileObject):
+        terminate = getattr(fileObject, "terminate", None)
+        if terminate:
+            terminate()
+        else:
+            fileObject.close()
+
+class LocalHelpers(object):
+    # Counterparts of S3Helpers for exports to a local or NFS file system
+    @staticmethod
+    def move(sourcePath, destinationPath):
+        # One rename swaps the whole folder rather than copying file by file
+        if os.path.isdir(sourcePath):
+            os.makedirs(os.path.dirname(destinationPath), exist_ok = True)
+            os.rename(sourcePath, destinationPath)
+
+    # ETag (see LocalFileWriter) of every file under path, keyed by its path relative to path; temporary files left by
+    #  interrupted writes are not listed
+    @staticmethod
+    def listETags(path):
+        from app.transfer import LocalFileWriter
+
+        etags = {}
+        for (directory, subdirectories, fileNames) in os.walk(path):
+            for fileName in fileNames:
+                if fileName.startswith(".") and fileName.endswith(LocalFileWriter.tempSuffix):
+                    continue
+                filePath = os.path.join(directory, fileName)
+                etags[os.path.relpath(filePath, path).replace(os.sep, "/")] = LocalFileWriter.etagFromStat(os.stat(filePath))
+
+        return etags
+
+    @staticmethod
+    def delete(path):
+        if os.path.isdir(path):
+            shutil.rmtree(path)
@@ -1,39 +1,70 @@
 import app.models as models
 from app import db
 from app import encrypter
+from app import imageCache
+from app import statusCache
+from app import workerPool
+from app import cancellations
+from app import trafficGovernor
 from app.dbcommon import DBCommon
 from domino import DominoAPISession
 from domino import DominoAPIKeyInvalid, DominoAPIUnauthorized, DominoAPINotFound, DominoAPIBadRequest, DominoAPIComputeEnvironmentRevisionNotAvailable, DominoAPIUnexpectedError
 from app.dockerclient import DockerClient
 from app.dockerclient import DockerException, DockerAPIError, DockerNotFound, DockerImageNotFound, DockerInvalidRepository, DockerBuildError
+from app.registry import RegistryClient, RegistryCopier, RegistryS3Exporter, ImageReference
 from app.helpers import S3Helpers, DBHelpers
 from app.status import StatusTypes
+from app.cancellation import CancellationToken, CancellableStream, ExecutionCancelled
+from app.transfer import TransferPipeline, S3Uploader
+from app.destinations import ExportDestination, ExportDestinationFailed
+from app.shards import ShardPacker
+from app.filefilter import ProjectFileFilter
+from app.throttle import ThrottledStream
 
 import json
+import io
+from datetime import datetime
+from hashlib import sha256
 from time import time
 from time import sleep
 import boto3
-import stopit
+from botocore.config import Config as BotoConfig
 from urllib.parse import urlparse
 from smart_open import open
 import logging
 
 class BaseExecution(object):
     def __init__(self, executionID, scheduler):
+        from app import app
         self._scheduler = scheduler
         self._dbSession = db.dbSession
         self._dbCommon = DBCommon(self._dbSession)
         self._execution = self._dbCommon.getExecution(executionID)
         self._jobRun = self._dbCommon.getJobRun(self._execution.job_id, self._execution.job_run_id, self._execution.execution_type)
+        self._cancellation = CancellationToken(app.config["JOB_TASK_TIMEOUT_IN_SECONDS"])
         self._logger = logging.getLogger(__name__)
 
+        # Another worker node holds a live lease on this execution
+        if not workerPool.claimExecution(executionID):
+            self._logger.info("Skipping execution {0} because another worker node holds its lease".format(self._execution.external_execution_id))
+            return
+
+        # Cancellation requests made after the execution was created do not apply to it
+        createdTimestamp = self._jobRun.job_run_started_timestamp if self._jobRun else DBHelpers.now()
+        cancellations.register(executionID, self._execution.job_id, createdTimestamp, self._cancellation)
         try:
+            # Cancelled while it was still waiting to run
+            for cancellation in self._dbCommon.getExportCancellationsForJobs([self._execution.job_id]):
+                cancellations.cancelJob(cancellation.job_id, cancellation.requested_timestamp)
+
             self.start()
             self.run()
         except Exception as e:
             raise(e)
         finally:
+            cancellations.unregister(executionID)
             self.stop()
+            workerPool.releaseExecution(executionID)
 
     def start(self):
         self.setStartTimestamp()
@@ -47,11 +78,19 @@ class BaseExecution(object):
             self.setExecutionStatus(StatusTypes.code["Running"])
 
             try:
-                taskStatus = self.defaultTask(timeout = app.config["JOB_TASK_TIMEOUT_IN_SECONDS"])
+                self._cancellation.check()
+                taskStatus = self.defaultTask()
                 if taskStatus:
                     self.setExecutionStatus(taskStatus)
                 else:
                     self.setExecutionStatus(StatusTypes.code["Completed"])
+            except ExecutionCancelled as e:
+                # Raised from a checkpoint between commits and uploads; drop anything the task had not committed
+                self._dbSession.rollback()
+                exceptionType = type(e).__name__
+                self.setExecutionStatus(StatusTypes.code[exceptionType])
+                self.saveExceptionDetails(exceptionType, str(e))
+                self._logger.info("Execution {0} stopped: {1}".format(self._execution.external_execution_id, str(e)))
             except Exception as e:
                 exceptionType = type(e).__name__
                 self.setExecutionStatus(StatusTypes.code.get(exceptionType, StatusTypes.code["UnknownError"]))
@@ -61,7 +100,6 @@ class BaseExecution(object):
     def stop(self):
         self.setEndTimestamp()
 
-    @stopit.threading_timeoutable(default=StatusTypes.code["ExecutionRunTimeout"])
     def defaultTask(self):
         pass
 
@@ -75,7 +113,10 @@ class BaseExecution(object):
         self._dbSession.commit()
 
     def updateJobTaskStates(self, taskStates):
-        jobDetails = json.loads(encrypter.decrypt(self._execution.jobs.job_details))
+        jobDetails = {}
+        # Service jobs are created without job details
+        if self._execution.jobs.job_details:
+            jobDetails = json.loads(encrypter.decrypt(self._execution.jobs.job_details))
 
         if "taskState" not in jobDetails:
              jobDetails["taskState"] = {}
@@ -110,8 +151,9 @@ class BaseExecution(object):
         })
 
     def setExecutionStatus(self, statusCode):
+        previousStatus = self._execution.execution_status
         self._execution.execution_status = statusCode
-        self._dbSession.commit()
+        statusCache.invalidateForExecution(self._dbSession, self._execution, previousStatus)
 
     def setStartTimestamp(self):
         self._execution.execution_started_timestamp = DBHelpers.now()
@@ -178,7 +220,6 @@ class BaseJob(object):
             self.addExecution(execution)
 
 class ProjectFilesExportTask(BaseExecution):
-    @stopit.threading_timeoutable(default=StatusTypes.code["ExecutionRunTimeout"])
     def defaultTask(self):
         from app import app
         taskStatus = None
@@ -203,84 +244,179 @@ class ProjectFilesExportTask(BaseExecution):
         dominoAPI = DominoAPISession(app.config["DOMINO_API_SERVER"], dominoAPIKey, verifySSL = app.config["DOMINO_API_SERVER_VERIFY_SSL"])
         projectInfo = dominoAPI.findProjectByOwnerAndName(dominoUsername, dominoProjectName)
         projectFiles = dominoAPI.projectListLatestFilesByProjectID(projectInfo["id"]).get("files", [])
+        # Files the job's filters leave out are never downloaded
+        fileFilter = ProjectFileFilter.fromJobDetails(jobDetails)
+        filteredFiles = [file for file in projectFiles if not fileFilter.matches(file["path"]["canonicalizedPathString"], file.get("size", None))]
+        projectFiles = [file for file in projectFiles if fileFilter.matches(file["path"]["canonicalizedPathString"], file.get("size", None))]
         projectCommits = dominoAPI.projectCommitIDs(dominoUsername, dominoProjectName).get("commits", [])
         projectLatestCommitID = sorted(projectCommits, key = lambda i: i["commitTime"], reverse = True)[0]["id"] if len(projectCommits) else None
-        priorExportedCommitID = jobDetails.get("taskState", {}).get("ProjectFilesExportTask", {}).get("commitID", None)
-
-        if app.config["EXPORTS_PROJECT_FILES_FORCE_RUN"] or (projectLatestCommitID != priorExportedCommitID):
-            exportsS3Path = app.config["EXPORTS_PROJECT_FILES_S3_PATH_FORMAT"].format(
-                S3_BUCKET = app.config["EXPORTS_PROJECT_FILES_S3_BUCKET"],
-                DOMINO_USERNAME = dominoUsername,
-                DOMINO_PROJECT_NAME = dominoProjectName,
-                EXPORT_GROUP_NAME = exportGroupName,
-                EXPORT_PROJECT_NAME = exportProjectName
-            )
-
-            exportS3PathLatest = app.config["EXPORTS_PROJECT_FILES_S3_LATEST_FORMAT"].format(
-                S3_BUCKET = app.config["EXPORTS_PROJECT_FILES_S3_BUCKET"],
-                DOMINO_USERNAME = dominoUsername,
-                DOMINO_PROJECT_NAME = dominoProjectName,
-                EXPORT_GROUP_NAME = exportGroupName,
-                EXPORT_PROJECT_NAME = exportProjectName,
-                EXPORTS_PROJECT_FILES_S3_PATH = exportsS3Path
-            )
-            exportS3PathLatestParsed = urlparse(exportS3PathLatest)
-            exportS3PathPrior = app.config["EXPORTS_PROJECT_FILES_S3_PRIOR_FORMAT"].format(
-                S3_BUCKET = app.config["EXPORTS_PROJECT_FILES_S3_BUCKET"],
-                DOMINO_USERNAME = dominoUsername,
-                DOMINO_PROJECT_NAME = dominoProjectName,
-                EXPORT_GROUP_NAME = exportGroupName,
-                EXPORT_PROJECT_NAME = exportProjectName,
-                EXPORTS_PROJECT_FILES_S3_PATH = exportsS3Path
-            )
-            exportS3PathPriorParsed = urlparse(exportS3PathPrior)
-
+        taskState = jobDetails.get("taskState", {}).get("ProjectFilesExportTask", {})
+
+        # Every destination tracks the commit it last received in full ("commitID") and the commit whose latest/prior
+        #  rotation has already happened ("resumeCommitID", cleared when that commit's export completes)
+        destinationBuckets = [(ExportDestination.primaryName, app.config["EXPORTS_PROJECT_FILES_S3_BUCKET"])] + [
+            (name, app.config["EXPORTS_PROJECT_FILES_S3_DESTINATIONS"][name])
+            for name in jobDetails.get("exportDestinations", [])
+            if name in app.config["EXPORTS_PROJECT_FILES_S3_DESTINATIONS"]
+        ]
+        pendingBuckets = [
+            (name, bucketURL) for (name, bucketURL) in destinationBuckets
+            if app.config["EXPORTS_PROJECT_FILES_FORCE_RUN"] or (projectLatestCommitID != self.__destinationState(taskState, name).get("commitID", None))
+        ]
+
+        if pendingBuckets:
             self.setExecutionStatus(StatusTypes.code["ProjectFileExportInitiated"])
-            s3 = boto3.resource("s3")
-            priorS3Path = exportS3PathPriorParsed.path.lstrip("/")
-            latestS3Path = exportS3PathLatestParsed.path.lstrip("/")
-            
-            #print("Deleting prior project files export {0}".format(exportS3PathPrior))
-            self.setExecutionStatus(StatusTypes.code["ProjectFileDeletePriorStarted"])
-            S3Helpers.delete(s3, exportS3PathLatestParsed.netloc, priorS3Path)
-            self.setExecutionStatus(StatusTypes.code["ProjectFileDeletePriorEnded"])
-
-            #print("Moving prior project files export to {0}".format(exportS3PathPrior))
-            self.setExecutionStatus(StatusTypes.code["ProjectFileMoveLatestToPriorStarted"])
-            S3Helpers.move(s3, exportS3PathLatestParsed.netloc, latestS3Path, priorS3Path)
-            self.setExecutionStatus(StatusTypes.code["ProjectFileMoveLatestToPriorEnded"])
+            # One client, and so one connection pool, for the whole task: the S3 helpers and every file upload share it
+            s3 = boto3.resource("s3", config = BotoConfig(max_pool_connections = max(10, len(pendingBuckets) * (app.config["EXPORTS_PROJECT_FILES_S3_PART_CONCURRENCY"] + 2))))
+            s3Uploader = S3Uploader(
+                s3.meta.client,
+                app.config["EXPORTS_PROJECT_FILES_S3_SINGLE_PUT_MAX_BYTES"],
+                app.config["EXPORTS_PROJECT_FILES_S3_PART_SIZE_BYTES"],
+                app.config["EXPORTS_PROJECT_FILES_S3_PART_CONCURRENCY"],
+                limiter = trafficGovernor.limiter("s3", self._execution.job_id, self._cancellation)
+            )
+            pathFormatArgs = {
+                "DOMINO_USERNAME": dominoUsername,
+                "DOMINO_PROJECT_NAME": dominoProjectName,
+                "EXPORT_GROUP_NAME": exportGroupName,
+                "EXPORT_PROJECT_NAME": exportProjectName
+            }
+            primaryDestination = ExportDestination.forURL(ExportDestination.primaryName, app.config["EXPORTS_PROJECT_FILES_S3_BUCKET"], s3, s3Uploader, pathFormatArgs)
+
+            exports = []
+            for (name, bucketURL) in pendingBuckets:
+                destination = ExportDestination.forURL(name, bucketURL, s3, s3Uploader, pathFormatArgs)
+                export = {
+                    "destination": destination,
+                    "resumeCommitID": self.__destinationState(taskState, name).get("resumeCommitID", None),
+                    "checkpoints": {},
+                    "latestETags": {},
+                    "blobStore": None,
+                    "manifestFiles": [],
+                    "shardPacker": None,
+                    "filesUploaded": 0,
+                    "filesResumed": 0,
+                    "filesDeduplicated": 0,
+                    "error": None
+                }
+                if app.config["EXPORTS_PROJECT_FILES_S3_BLOB_STORE_ENABLED"]:
+                    export["blobStore"] = destination.blobStore(self._dbSession)
+                elif app.config["EXPORTS_PROJECT_FILES_S3_SHARDS_ENABLED"]:
+                    export["shardPacker"] = ShardPacker(
+                        destination,
+                        app.config["EXPORTS_PROJECT_FILES_S3_SHARD_FOLDER"],
+                        app.config["EXPORTS_PROJECT_FILES_S3_SHARD_MAX_BYTES"],
+                        compression = app.config["EXPORTS_PROJECT_FILES_S3_SHARD_COMPRESSION"],
+                        cancellation = self._cancellation
+                    )
+                exports.append(export)
+
+            # Stopping is only safe before the prior/latest shuffle or between exported files
+            self._cancellation.check()
+
+            for export in exports:
+                self.__prepareDestination(export, projectLatestCommitID)
 
             #print("Starting project files export for {0}/{1} to {2}/{3}".format(dominoUsername, dominoProjectName, exportGroupName, exportProjectName))
-            self.setExecutionStatus(StatusTypes.code["ProjectFileTansferToS3Started"])
+            resuming = all([export["resumeCommitID"] is not None for export in exports])
+            self.setExecutionStatus(StatusTypes.code["ProjectFileTransferToS3Resumed" if resuming else "ProjectFileTansferToS3Started"])
+            shardFiles = []
             for file in projectFiles:
-                s3FilePath = "{0}/{1}".format(
-                    exportS3PathLatest,
-                    file["path"]["canonicalizedPathString"]
-                )
-
-                # print("Saving {0}/{1}/{2} ({3}) to {4}...".format(
-                #     dominoUsername,
-                #     dominoProjectName,
-                #     file["path"]["canonicalizedPathString"],
-                #     DBHelpers.human_readable_size(file["size"]),
-                #     s3FilePath
-                # ))
-
-                with open(s3FilePath, "wb") as s3FileSave:
-                    for chunk in dominoAPI.projectFileContentsByKeyID(dominoUsername, dominoProjectName, file["key"]):
-                        s3FileSave.write(chunk)
-                    #print("Saved {0}\n".format(s3FilePath))
+                filePath = file["path"]["canonicalizedPathString"]
+
+                # Small files are packed into shards once the standalone ones are exported
+                if app.config["EXPORTS_PROJECT_FILES_S3_SHARDS_ENABLED"] and (not app.config["EXPORTS_PROJECT_FILES_S3_BLOB_STORE_ENABLED"]) and \
+                    (file.get("size", None) is not None) and (file["size"] <= app.config["EXPORTS_PROJECT_FILES_S3_SHARD_FILE_MAX_BYTES"]):
+                    shardFiles.append(file)
+                    continue
+
+                # The destinations that still need this file; the file is downloaded once for all of them
+                targets = []
+                for export in exports:
+                    if export["error"] is not None:
+                        continue
+
+                    # Content-addressed exports upload each blob at most once across all projects and commits; latest
+                    #  only gets the manifest
+                    if export["blobStore"]:
+                        blobPath = export["blobStore"].blobPath(file["key"])
+                        manifestEntry = {
+                            "path": filePath,
+                            "blob": blobPath,
+                            "size": file.get("size", None),
+                            "etag": export["blobStore"].exportedETag(blobPath, file["key"])
+                        }
+                        export["manifestFiles"].append(manifestEntry)
+                        if manifestEntry["etag"] is None:
+                            targets.append((export, manifestEntry))
+                        else:
+                            export["filesDeduplicated"] += 1
+                        continue
+
+                    checkpoint = export["checkpoints"].get(filePath, None)
+                    if checkpoint and (checkpoint.blob_key == file["key"]) and (checkpoint.etag is not None) and (export["latestETags"].get(filePath, None) == checkpoint.etag):
+                        export["filesResumed"] += 1
+                    else:
+                        targets.append((export, None))
+
+                if targets:
+                    self._cancellation.check()
+                    self.__exportFile(dominoAPI, dominoUsername, dominoProjectName, file, targets, projectLatestCommitID)
+
+            if shardFiles:
+                self.__exportShards(dominoAPI, dominoUsername, dominoProjectName, projectFiles, shardFiles, exports)
+
+            for export in exports:
+                if export["error"] is None:
+                    self._cancellation.check()
+                    try:
+                        if export["blobStore"]:
+                            export["destination"].writeText(app.config["EXPORTS_PROJECT_FILES_S3_MANIFEST_NAME"], json.dumps({"commitID": projectLatestCommitID, "files": export["manifestFiles"]}))
+                        export["destination"].finish()
+                    except Exception as e:
+                        self.__failDestination(export, e)
             self.setExecutionStatus(StatusTypes.code["ProjectFileTansferToS3Ended"])
 
+            failedExports = [export for export in exports if export["error"] is not None]
+            for export in exports:
+                if export["error"] is None:
+                    self._dbCommon.getAllExportFileCheckpointsForJob(self._execution.job_id, export["destination"].name).delete(synchronize_session=False)
+                    self.__updateDestinationState(export["destination"].name, {"commitID": projectLatestCommitID, "resumeCommitID": None})
+
             self.updateExecutionDetails(
                 {
                     "commitID": projectLatestCommitID,
                     "S3Paths": {
-                        "latest": exportS3PathLatest,
-                        "prior": exportS3PathPrior
+                        "latest": primaryDestination.latestPath,
+                        "prior": primaryDestination.priorPath
+                    },
+                    "filesUploaded": sum([export["filesUploaded"] for export in exports]),
+                    "filesResumed": sum([export["filesResumed"] for export in exports]),
+                    "filesDeduplicated": sum([export["filesDeduplicated"] for export in exports]),
+                    "filesPacked": len(shardFiles),
+                    "filesFiltered": len(filteredFiles),
+                    "bytesFiltered": sum([file.get("size", None) or 0 for file in filteredFiles]),
+                    "shards": sum([len(export["shardPacker"].index()["shards"]) for export in exports if export["shardPacker"]]),
+                    "destinations": {
+                        export["destination"].name: {
+                            "latest": export["destination"].latestPath,
+                            "success": export["error"] is None,
+                            "error": repr(export["error"]) if export["error"] is not None else None,
+                            "filesUploaded": export["filesUploaded"],
+                            "filesResumed": export["filesResumed"],
+                            "filesDeduplicated": export["filesDeduplicated"]
+                        }
+                        for export in exports
                     }
                 }
             )
+
+            # Destinations that failed keep their checkpoints and resume on the next run
+            if failedExports:
+                if len(failedExports) < len(exports):
+                    self.updateJobTaskStates([{"task": "ProjectExportReportToS3Task", "taskInfo": {"statusSaved": False}}])
+                raise(ExportDestinationFailed(", ".join(["{0}: {1}".format(export["destination"].name, repr(export["error"])) for export in failedExports])))
+
             self.updateJobRun()
             # Ensure we don't push the same image again in the future
             self.updateJobTaskStates(
@@ -288,8 +424,7 @@ class ProjectFilesExportTask(BaseExecution):
                     {
                         "task": "ProjectFilesExportTask",
                         "taskInfo": {
-                            "lastCompletedExecutionID": self._execution.execution_id,
-                            "commitID": projectLatestCommitID
+                            "lastCompletedExecutionID": self._execution.execution_id
                         }
                     },
                     {
@@ -303,12 +438,183 @@ class ProjectFilesExportTask(BaseExecution):
         else:
             #print("Skipping project files export for {0}/{1} to {2}/{3}".format(dominoUsername, dominoProjectName, exportGroupName, exportProjectName))
             taskStatus = StatusTypes.code["Skipped"]
-            self.updateJobRun(jobDetails.get("taskState", {}).get("ProjectFilesExportTask", {}).get("lastCompletedExecutionID", None))
+            self.updateJobRun(taskState.get("lastCompletedExecutionID", None))
 
         return taskStatus
 
+    # The primary destination keeps its state at the top of the task state (as before there were several), the others
+    #  under "destinations"
+    def __destinationState(self, taskState, name):
+        if name == ExportDestination.primaryName:
+            return taskState
+
+        return taskState.get("destinations", {}).get(name, {})
+
+    def __updateDestinationState(self, name, taskInfo):
+        if name != ExportDestination.primaryName:
+            jobDetails = json.loads(encrypter.decrypt(self._execution.jobs.job_details))
+            destinations = jobDetails.get("taskState", {}).get("ProjectFilesExportTask", {}).get("destinations", {})
+            destinations.setdefault(name, {}).update(taskInfo)
+            taskInfo = {"destinations": destinations}
+
+        self.updateJobTaskStates([{"task": "ProjectFilesExportTask", "taskInfo": taskInfo}])
+
+    def __failDestination(self, export, error):
+        if export["error"] is None:
+            export["error"] = error
+            self._logger.warning("Execution {0} stopped exporting to destination {1}: {2}".format(self._execution.external_execution_id, export["destination"].name, repr(error)))
+
+    # A retry of an interrupted export of the same commit keeps latest as it is and skips the files it already
+    #  checkpointed, as long as their object in latest still has the ETag recorded for them. Otherwise latest is
+    #  rotated to prior, once per commit
+    def __prepareDestination(self, export, projectLatestCommitID):
+        destination = export["destination"]
+        if (projectLatestCommitID is not None) and (export["resumeCommitID"] == projectLatestCommitID):
+            # The blob store's own index already spares content-addressed exports the blobs they uploaded before
+            if not export["blobStore"]:
+                export["checkpoints"] = {
+                    checkpoint.file_path: checkpoint
+                    for checkpoint in self._dbCommon.getExportFileCheckpoints(self._execution.job_id, destination.name, projectLatestCommitID)
+                }
+                export["latestETags"] = destination.listETags()
+            return
+
+        export["resumeCommitID"] = None
+
+        #print("Deleting prior project files export {0}".format(destination.priorPath))
+        self.setExecutionStatus(StatusTypes.code["ProjectFileDeletePriorStarted"])
+        destination.deletePrior()
+        self.setExecutionStatus(StatusTypes.code["ProjectFileDeletePriorEnded"])
+
+        #print("Moving prior project files export to {0}".format(destination.priorPath))
+        self.setExecutionStatus(StatusTypes.code["ProjectFileMoveLatestToPriorStarted"])
+        destination.moveLatestToPrior()
+        self.setExecutionStatus(StatusTypes.code["ProjectFileMoveLatestToPriorEnded"])
+
+        self._dbCommon.getAllExportFileCheckpointsForJob(self._execution.job_id, destination.name).delete(synchronize_session=False)
+        self._dbSession.commit()
+        self.__updateDestinationState(destination.name, {"resumeCommitID": projectLatestCommitID})
+
+    # Blob downloads are paid for with this process's and this job's Domino traffic limits (see app/throttle.py)
+    def __projectFileStream(self, dominoAPI, dominoUsername, dominoProjectName, fileKey):
+        limiter = trafficGovernor.limiter("domino", self._execution.job_id, self._cancellation)
+        limiter.acquire(requests = 1)
+        return ThrottledStream(dominoAPI.projectFileStreamByKeyID(dominoUsername, dominoProjectName, fileKey), limiter)
+
+    # Downloads one project file once and streams it to every target destination at the same time. A destination that
+    #  fails or stalls (EXPORTS_PROJECT_FILES_DESTINATION_STALL_SECONDS) is dropped for the rest of the run
+    def __exportFile(self, dominoAPI, dominoUsername, dominoProjectName, file, targets, projectLatestCommitID):
+        from app import app
+        filePath = file["path"]["canonicalizedPathString"]
+
+        writers = []
+        for (export, manifestEntry) in targets:
+            try:
+                if manifestEntry:
+                    writers.append((export, manifestEntry, export["destination"].openPath(manifestEntry["blob"], file.get("size", None))))
+                else:
+                    writers.append((export, manifestEntry, export["destination"].open(filePath, file.get("size", None))))
+            except Exception as e:
+                self.__failDestination(export, e)
+        if not writers:
+            return
+
+        pipeline = TransferPipeline(
+            app.config["EXPORTS_PROJECT_FILES_CHUNK_SIZE_BYTES"],
+            app.config["EXPORTS_PROJECT_FILES_BUFFERS"],
+            cancellation = self._cancellation,
+            stallSeconds = app.config["EXPORTS_PROJECT_FILES_DESTINATION_STALL_SECONDS"]
+        )
+        try:
+            errors = pipeline.fanOut(self.__projectFileStream(dominoAPI, dominoUsername, dominoProjectName, file["key"]), [writer for (export, manifestEntry, writer) in writers], close = True)
+        except BaseException:
+            # Abort the multipart uploads rather than leave partial objects behind
+            for (export, manifestEntry, writer) in writers:
+                S3Helpers.abortWrite(writer)
+            raise
+
+        for ((export, manifestEntry, writer), error) in zip(writers, errors):
+            if error is not None:
+                S3Helpers.abortWrite(writer)
+                self.__failDestination(export, error)
+                continue
+
+            export["filesUploaded"] += 1
+            if manifestEntry:
+                manifestEntry["etag"] = writer.etag
+                export["blobStore"].record(manifestEntry["blob"], file["key"], file.get("size", None), writer.etag)
+            elif projectLatestCommitID is not None:
+                checkpoint = export["checkpoints"].get(filePath, None)
+                if checkpoint:
+                    checkpoint.blob_key = file["key"]
+                    checkpoint.etag = writer.etag
+                    checkpoint.completed_timestamp = DBHelpers.now()
+                else:
+                    self._dbSession.add(models.ExportFileCheckpoint(self._execution.job_id, export["destination"].name, projectLatestCommitID, filePath, file["key"], writer.etag))
+                self._dbSession.commit()
+
+    # Packs the small files into shards under latest, then writes the index of every path in the export. Shard files
+    #  are small, so each is read into memory once and added to every destination's shards. Shards are not
+    #  checkpointed: a resumed export packs them again
+    def __exportShards(self, dominoAPI, dominoUsername, dominoProjectName, projectFiles, shardFiles, exports):
+        from app import app
+
+        try:
+            for file in shardFiles:
+                activeExports = [export for export in exports if export["error"] is None]
+                if not activeExports:
+                    break
+
+                self._cancellation.check()
+                contents = CancellableStream(self.__projectFileStream(dominoAPI, dominoUsername, dominoProjectName, file["key"]), self._cancellation).read()
+                for export in activeExports:
+                    try:
+                        export["shardPacker"].add(file["path"]["canonicalizedPathString"], len(contents), io.BytesIO(contents))
+                    except Exception as e:
+                        export["shardPacker"].abort()
+                        self.__failDestination(export, e)
+        except BaseException:
+            # Abort the shards being uploaded rather than leave partial objects behind
+            for export in exports:
+                export["shardPacker"].abort()
+            raise
+
+        packedPaths = {file["path"]["canonicalizedPathString"] for file in shardFiles}
+        for export in exports:
+            if export["error"] is not None:
+                continue
+
+            try:
+                export["shardPacker"].close()
+                for file in projectFiles:
+                    filePath = file["path"]["canonicalizedPathString"]
+                    if filePath not in packedPaths:
+                        export["shardPacker"].addObject(filePath, filePath, file.get("size", None))
+
+                export["destination"].writeText(
+                    "{0}/{1}".format(app.config["EXPORTS_PROJECT_FILES_S3_SHARD_FOLDER"], app.config["EXPORTS_PROJECT_FILES_S3_SHARD_INDEX_NAME"]),
+                    json.dumps(export["shardPacker"].index())
+                )
+            except Exception as e:
+                export["shardPacker"].abort()
+                self.__failDestination(export, e)
+
 class ProjectDockerImageExportTask(BaseExecution):
-    @stopit.threading_timeoutable(default=StatusTypes.code["ExecutionRunTimeout"])
+    # boto3 clients are thread-safe, so every image S3 export shares one, with enough pooled connections for
+    #  EXPORTS_DOCKER_IMAGE_S3_MAX_CONCURRENCY part uploads per running export
+    sharedImageS3Client = None
+
+    @classmethod
+    def imageS3Client(cls):
+        from app import app
+
+        if cls.sharedImageS3Client is None:
+            cls.sharedImageS3Client = boto3.client("s3", config = BotoConfig(
+                max_pool_connections = max(10, app.config["EXPORTS_DOCKER_IMAGE_S3_MAX_CONCURRENCY"] * app.config["JOBS_MAX_CONCURRENT_WORKERS"])
+            ))
+
+        return cls.sharedImageS3Client
+
     def defaultTask(self):
         from app import app
         taskStatus = None
@@ -325,6 +631,8 @@ class ProjectDockerImageExportTask(BaseExecution):
         computeEnvironmentDetails = dominoAPI.environmentDetailByID(computeEnvironmentRevision["id"])
         priorExportedcomputeEnvironmentID = jobDetails.get("taskState", {}).get("ProjectDockerImageExportTask", {}).get("computeEnvironmentID", None)
         priorExportedcomputeEnvironmentRevision = jobDetails.get("taskState", {}).get("ProjectDockerImageExportTask", {}).get("computeEnvironmentRevision", None)
+        priorExportedImageDigest = jobDetails.get("taskState", {}).get("ProjectDockerImageExportTask", {}).get("imageDigest", None)
+        priorExportedImageDigestEnvironment = jobDetails.get("taskState", {}).get("ProjectDockerImageExportTask", {}).get("imageDigestEnvironment", None)
         computeEnvironmentURL = dominoAPI.environmentURLByRevision(computeEnvironmentRevision["id"], computeEnvironmentRevision["revision"])
 
         dockerFileTemplatePath = "{0}/{1}".format(
@@ -359,9 +667,20 @@ class ProjectDockerImageExportTask(BaseExecution):
             "username": app.config.get("EXPORTS_DOCKER_REGISTRY_USERNAME", None),
             "password": app.config.get("EXPORTS_DOCKER_REGISTRY_PASSWORD", None)
         }
-        dockerClient = DockerClient(dominoRegistry, externalRegistry)
-        dockerClient.raiseOnException(True)
+        dominoRegistryClient = RegistryClient(
+            dominoRegistry,
+            insecure = app.config["DOMINO_DOCKER_REGISTRY_INSECURE"],
+            verifySSL = app.config["DOCKER_REGISTRY_VERIFY_SSL"],
+            timeout = app.config["DOCKER_REGISTRY_TIMEOUT_SECONDS"]
+        )
+        externalRegistryClient = RegistryClient(
+            externalRegistry,
+            insecure = app.config["EXPORTS_DOCKER_REGISTRY_INSECURE"],
+            verifySSL = app.config["DOCKER_REGISTRY_VERIFY_SSL"],
+            timeout = app.config["DOCKER_REGISTRY_TIMEOUT_SECONDS"]
+        )
         self.setExecutionStatus(StatusTypes.code["DockerExportInitiated"])
+        self._cancellation.check()
 
         # Concat the Compute Env ID and Revision ID for easy comparison
         savedComputeEnvironment = "{ENV_ID}-{ENV_REVISION}".format(
@@ -382,12 +701,6 @@ class ProjectDockerImageExportTask(BaseExecution):
 
             #print("Starting Docker image export for {0}/{1} to {2}/{3}".format(dominoUsername, dominoProjectName, exportGroupName, exportProjectName))
 
-            # Pull Docker image
-            self.setExecutionStatus(StatusTypes.code["DockerExportImagePullStarted"])
-            pulledDominoDockerImage = dockerClient.pull(computeEnvironmentURL)
-            self.setExecutionStatus(StatusTypes.code["DockerExportImagePullEnded"])
-
-            # Build Docker image
             # Define the Docker latest image URI
             # Note that we convert most of the variables here to lowercase, as
             #  defined on https://docs.docker.com/engine/reference/commandline/tag/#extended-description
@@ -412,33 +725,162 @@ class ProjectDockerImageExportTask(BaseExecution):
                 DOMINO_COMPUTE_ENVIRONMENT_REVISION = computeEnvironmentRevision["revision"]
             )
 
-            self.setExecutionStatus(StatusTypes.code["DockerExportImageBuildStarted"])
-            exportDockerImageBuildLatest = dockerClient.build(dockerFileTemplatePath, computeEnvironmentURL, exportDockerImageLatestURL)
-            exportDockerImageBuildVersion = dockerClient.build(dockerFileTemplatePath, computeEnvironmentURL, exportDockerImageVersionURL)
-            self.setExecutionStatus(StatusTypes.code["DockerExportImageBuildEnded"])
-
-            # Clean up after build
-            dockerClient.cleanup()
-
-            # Push Docker Image to :latest :v{num}
-            self.setExecutionStatus(StatusTypes.code["DockerExportImagePushStarted"])
-            pushedDockerImageVersion = dockerClient.push(exportDockerImageVersionURL)
-            pushedDockerImageLatest = dockerClient.push(exportDockerImageLatestURL)
-            self.setExecutionStatus(StatusTypes.code["DockerExportImagePushEnded"])
-
-            self.updateExecutionDetails(
-                {
-                    "exportedComputeEnvironment": {
-                        "id": computeEnvironmentRevision["id"],
-                        "revision": computeEnvironmentRevision["revision"],
-                        "name": computeEnvironmentDetails["name"]
-                    },
-                    "exportedComputeEnvironmentURLs": {
-                        "latest": exportDockerImageLatestURL,
-                        "version": exportDockerImageVersionURL
+            pureFromTemplate = RegistryCopier.isPureFromTemplate(dockerFileTemplatePath)
+            exportedImageDigest = None
+            registryPreflight = None
+
+            if app.config["EXPORTS_DOCKER_REGISTRY_PREFLIGHT_ENABLED"] and not app.config["EXPORTS_PROJECT_FILES_FORCE_RUN"]:
+                # The version tag already in the export registry must match the digest we last pushed for this
+                #  revision, or (with no record, e.g. after a DB loss) the Domino image itself for pure FROM templates.
+                #  Other templates with no record are exported in full
+                expectedImageDigest = None
+                if priorExportedImageDigestEnvironment == currentComputeEnvironment:
+                    expectedImageDigest = priorExportedImageDigest
+                elif pureFromTemplate:
+                    try:
+                        expectedImageDigest = dominoRegistryClient.manifestDigest(ImageReference(computeEnvironmentURL))
+                    except Exception as e:
+                        self._logger.warning("Unable to read the Domino image digest for {0}: {1}".format(computeEnvironmentURL, repr(e)))
+
+                self.setExecutionStatus(StatusTypes.code["DockerExportRegistryPreflight"])
+                registryPreflight = self.registryPreflight(externalRegistryClient, exportDockerImageVersionURL, exportDockerImageLatestURL, expectedImageDigest)
+
+            if registryPreflight and registryPreflight["action"]:
+                exportedImageDigest = registryPreflight["versionDigest"]
+                exportDetails = {}
+                if registryPreflight["action"] == "skipped":
+                    taskStatus = StatusTypes.code["Skipped"]
+            elif app.config["EXPORTS_DOCKER_REGISTRY_COPY_ENABLED"] and pureFromTemplate:
+                # The Dockerfile template adds nothing on top of the Domino image, so copy the
+                #  manifest and blobs registry-to-registry instead of pull/build/push through the local daemon
+                registryCopier = RegistryCopier(dominoRegistryClient, externalRegistryClient, cancellation = self._cancellation)
+
+                self.setExecutionStatus(StatusTypes.code["DockerExportImageCopyStarted"])
+                copiedDockerImageVersion = registryCopier.copy(computeEnvironmentURL, exportDockerImageVersionURL)
+                copiedDockerImageLatest = registryCopier.copy(computeEnvironmentURL, exportDockerImageLatestURL)
+                self.setExecutionStatus(StatusTypes.code["DockerExportImageCopyEnded"])
+
+                exportedImageDigest = copiedDockerImageVersion["digest"]
+                exportDetails = {
+                    "registryCopy": {
+                        "latest": copiedDockerImageLatest,
+                        "version": copiedDockerImageVersion
                     }
                 }
-            )
+            else:
+                dockerClient = DockerClient(
+                    dominoRegistry,
+                    externalRegistry,
+                    logMaxLines = app.config["DOCKER_LOGS_MAX_LINES"],
+                    logMaxLayers = app.config["DOCKER_LOGS_MAX_LAYERS"],
+                    logSummaryLines = app.config["DOCKER_LOGS_SUMMARY_LINES"],
+                    cancellation = self._cancellation
+                )
+                dockerClient.raiseOnException(True)
+                imageCacheEnabled = app.config["DOCKER_IMAGE_CACHE_ENABLED"]
+
+                # Pin the Domino image so concurrent exports don't evict it while we use it
+                if imageCacheEnabled:
+                    imageCache.pin(currentComputeEnvironment, computeEnvironmentURL)
+
+                try:
+                    # Pull Docker image
+                    self.setExecutionStatus(StatusTypes.code["DockerExportImagePullStarted"])
+                    pulledDominoDockerImage = dockerClient.pull(computeEnvironmentURL, skipIfPresent = imageCacheEnabled)
+                    self.setExecutionStatus(StatusTypes.code["DockerExportImagePullEnded"])
+                    if imageCacheEnabled:
+                        imageCache.recordLookup(pulledDominoDockerImage["cached"])
+
+                    # Build Docker image
+                    self._cancellation.check()
+                    self.setExecutionStatus(StatusTypes.code["DockerExportImageBuildStarted"])
+                    # Both tags carry the same labels, so the second build still comes from the build cache as the same image
+                    imageLabels = imageCache.labels(currentComputeEnvironment, computeEnvironmentURL, exportDockerImageVersionURL) if imageCacheEnabled else None
+                    exportDockerImageBuildLatest = dockerClient.build(dockerFileTemplatePath, computeEnvironmentURL, exportDockerImageLatestURL, labels = imageLabels)
+                    exportDockerImageBuildVersion = dockerClient.build(dockerFileTemplatePath, computeEnvironmentURL, exportDockerImageVersionURL, labels = imageLabels)
+                    self.setExecutionStatus(StatusTypes.code["DockerExportImageBuildEnded"])
+                    # Only the immutable version tag belongs to this revision; latest moves on with the next one
+                    if imageCacheEnabled:
+                        imageCache.track(currentComputeEnvironment, [exportDockerImageVersionURL])
+
+                    # Push Docker Image to :latest :v{num}
+                    self._cancellation.check()
+                    self.setExecutionStatus(StatusTypes.code["DockerExportImagePushStarted"])
+                    pushedDockerImageVersion = dockerClient.push(exportDockerImageVersionURL)
+                    pushedDockerImageLatest = dockerClient.push(exportDockerImageLatestURL)
+                    self.setExecutionStatus(StatusTypes.code["DockerExportImagePushEnded"])
+
+                    # A local latest tag would keep the image around after its version tag is evicted
+                    if imageCacheEnabled:
+                        dockerClient.removeImage(exportDockerImageLatestURL)
+                finally:
+                    if imageCacheEnabled:
+                        imageCache.unpin(currentComputeEnvironment)
+
+                # Clean up after push
+                if imageCacheEnabled:
+                    dockerClient.cleanup(imageCache, app.config["DOCKER_IMAGE_CACHE_BUDGET_BYTES"])
+                else:
+                    dockerClient.cleanup()
+
+                exportedImageDigest = pushedDockerImageVersion["summary"]["digest"] if pushedDockerImageVersion["summary"] else None
+                exportDetails = {
+                    "dockerLogSummary": {
+                        "pull": pulledDominoDockerImage["summary"],
+                        "build": {
+                            "latest": exportDockerImageBuildLatest["summary"],
+                            "version": exportDockerImageBuildVersion["summary"]
+                        },
+                        "push": {
+                            "latest": pushedDockerImageLatest["summary"],
+                            "version": pushedDockerImageVersion["summary"]
+                        }
+                    }
+                }
+
+            imageS3Export = None
+            imageS3ExportDigests = None
+            if app.config["EXPORTS_DOCKER_IMAGE_S3_ENABLED"]:
+                self._cancellation.check()
+                imageS3Path = DBHelpers.imageExportS3Path(dominoUsername, dominoProjectName, exportGroupName, exportProjectName)
+                priorImageS3Path = jobDetails.get("taskState", {}).get("ProjectDockerImageExportTask", {}).get("imageS3Path", None)
+                priorImageS3Digests = jobDetails.get("taskState", {}).get("ProjectDockerImageExportTask", {}).get("imageS3Digests", None)
+
+                # Layers recorded by the prior export to the same path are not uploaded again
+                registryS3Exporter = RegistryS3Exporter(
+                    externalRegistryClient,
+                    self.imageS3Client(),
+                    partSizeBytes = app.config["EXPORTS_DOCKER_IMAGE_S3_PART_SIZE_BYTES"],
+                    maxConcurrency = app.config["EXPORTS_DOCKER_IMAGE_S3_MAX_CONCURRENCY"],
+                    exportedDigests = priorImageS3Digests if priorImageS3Path == imageS3Path else None,
+                    cancellation = self._cancellation,
+                    limiter = trafficGovernor.limiter("s3", self._execution.job_id, self._cancellation)
+                )
+
+                self.setExecutionStatus(StatusTypes.code["DockerExportImageS3Started"])
+                imageS3Export = registryS3Exporter.export(exportDockerImageVersionURL, imageS3Path)
+                self.setExecutionStatus(StatusTypes.code["DockerExportImageS3Ended"])
+
+                imageS3ExportDigests = imageS3Export.pop("digests")
+                if imageS3Export["blobsUploaded"]:
+                    taskStatus = None
+
+            executionDetails = {
+                "imageS3Export": imageS3Export,
+                "exportedComputeEnvironment": {
+                    "id": computeEnvironmentRevision["id"],
+                    "revision": computeEnvironmentRevision["revision"],
+                    "name": computeEnvironmentDetails["name"]
+                },
+                "exportedComputeEnvironmentURLs": {
+                    "latest": exportDockerImageLatestURL,
+                    "version": exportDockerImageVersionURL
+                },
+                "exportedImageDigest": exportedImageDigest,
+                "registryPreflight": registryPreflight
+            }
+            executionDetails.update(exportDetails)
+            self.updateExecutionDetails(executionDetails)
 
             # Ensure we don't push the same image again in the future
             self.updateJobTaskStates(
@@ -448,7 +890,11 @@ class ProjectDockerImageExportTask(BaseExecution):
                         "taskInfo": {
                             "lastCompletedExecutionID": self._execution.execution_id,
                             "computeEnvironmentID": computeEnvironmentRevision["id"],
-                            "computeEnvironmentRevision": computeEnvironmentRevision["revision"]
+                            "computeEnvironmentRevision": computeEnvironmentRevision["revision"],
+                            "imageDigest": exportedImageDigest,
+                            "imageDigestEnvironment": currentComputeEnvironment,
+                            "imageS3Path": imageS3Export["path"] if imageS3Export else None,
+                            "imageS3Digests": imageS3ExportDigests
                         }
                     },
                     {
@@ -480,23 +926,110 @@ class ProjectDockerImageExportTask(BaseExecution):
 
         return taskStatus
 
+    # Skips the export (or only re-points latest) when the version tag in the export registry holds the digest expected
+    #  for this revision. The tag alone says nothing about the Dockerfile template or base image it was built from, so
+    #  without an expected digest the export always runs in full
+    def registryPreflight(self, externalRegistryClient, versionImageURL, latestImageURL, expectedDigest):
+        preflight = {
+            "expectedDigest": expectedDigest,
+            "versionDigest": None,
+            "latestDigest": None,
+            "action": None,
+            "error": None
+        }
+        if not expectedDigest:
+            return preflight
+
+        try:
+            preflight["versionDigest"] = externalRegistryClient.manifestDigest(ImageReference(versionImageURL))
+
+            if preflight["versionDigest"] and (expectedDigest == preflight["versionDigest"]):
+                preflight["latestDigest"] = externalRegistryClient.manifestDigest(ImageReference(latestImageURL))
+
+                if preflight["latestDigest"] == preflight["versionDigest"]:
+                    preflight["action"] = "skipped"
+                else:
+                    # Only the latest tag is stale, so re-point it at the existing version manifest
+                    RegistryCopier(externalRegistryClient, externalRegistryClient).copy(versionImageURL, latestImageURL)
+                    preflight["latestDigest"] = preflight["versionDigest"]
+                    preflight["action"] = "repointedLatest"
+        except Exception as e:
+            # Fall back to a full export if the export registry can't be queried
+            self._logger.warning("Export registry preflight check failed for {0}: {1}".format(versionImageURL, repr(e)))
+            preflight["error"] = repr(e)
+
+        return preflight
+
 
 class UpdateAllExportStatusS3Task(BaseExecution):
-    @stopit.threading_timeoutable(default=StatusTypes.code["ExecutionRunTimeout"])
+    # job_id -> (signature, export group, status record) from the previous run. Only the leader runs this task, so after
+    #  a restart or a leader change the first run simply rebuilds every record
+    _statusRecords = {}
+
     def defaultTask(self):
         from app import app
-        statusRecords = self._dbCommon.allProjectExportJobsStatus()
-        exportsLogFilePath = DBHelpers.exportsLogFilePath()
-
-        #print("Writing to {0}".format(exportsLogFilePath))
+        taskStatus = None
 
-        with open(exportsLogFilePath, "w") as exportsLogFile:
-            exportsLogFile.write(app.config["EXPORTS_PROJECT_FILES_S3_TOP_LEVEL_LOG_FORMATTER"](statusRecords))
+        # Only jobs whose runs, executions or settings changed since the last run are recomputed
+        statusRecords = {}
+        for (job, signature) in self._dbCommon.getProjectExportJobSignatures():
+            priorRecord = UpdateAllExportStatusS3Task._statusRecords.get(job.job_id, None)
+            if priorRecord and priorRecord[0] == signature:
+                statusRecords[job.job_id] = priorRecord
+            else:
+                statusRecords[job.job_id] = (signature, job.job_export_group, self._dbCommon.projectExportJobStatusSubset(job.job_id))
+        UpdateAllExportStatusS3Task._statusRecords = statusRecords
+
+        formatter = app.config["EXPORTS_PROJECT_FILES_S3_TOP_LEVEL_LOG_FORMATTER"]
+        exportsLogFilePath = DBHelpers.exportsLogFilePath()
+        logFiles = {}
+
+        if app.config["EXPORTS_PROJECT_FILES_S3_TOP_LEVEL_LOG_SHARDED"]:
+            groupRecords = {}
+            for (signature, exportGroup, record) in statusRecords.values():
+                groupRecords.setdefault(exportGroup, []).append(record)
+
+            for exportGroup in groupRecords:
+                logFiles[DBHelpers.exportsLogShardFilePath(exportGroup)] = formatter(groupRecords[exportGroup])
+            logFiles[exportsLogFilePath] = formatter([
+                {"export_group_name": exportGroup, "status_log_path": DBHelpers.exportsLogShardFilePath(exportGroup)}
+                for exportGroup in sorted(groupRecords)
+            ])
+        else:
+            logFiles[exportsLogFilePath] = formatter([record for (signature, exportGroup, record) in statusRecords.values()])
+
+        # The hash of what was last written to each log is kept with the job so unchanged logs are never re-uploaded
+        jobDetails = {}
+        if self._execution.jobs.job_details:
+            jobDetails = json.loads(encrypter.decrypt(self._execution.jobs.job_details))
+        priorLogHashes = jobDetails.get("taskState", {}).get("UpdateAllExportStatusS3Task", {}).get("logHashes", {})
+
+        # Logs of export groups that are gone (or of a layout no longer in use) are emptied
+        for logFilePath in priorLogHashes:
+            if logFilePath not in logFiles:
+                with open(logFilePath, "w") as exportsLogFile:
+                    exportsLogFile.write(formatter([]))
+
+        logHashes = {}
+        for (logFilePath, content) in logFiles.items():
+            logHashes[logFilePath] = sha256(content.encode("utf-8")).hexdigest()
+            if priorLogHashes.get(logFilePath, None) != logHashes[logFilePath]:
+                with open(logFilePath, "w") as exportsLogFile:
+                    exportsLogFile.write(content)
+
+        if logHashes != priorLogHashes:
+            self.updateJobTaskStates([{
+                "task": "UpdateAllExportStatusS3Task",
+                "taskInfo": {
+                    "logHashes": logHashes
+                }
+            }])
+        else:
+            taskStatus = StatusTypes.code["Skipped"]
 
-        #print("Done writing to log file...")
+        return taskStatus
 
 class ProjectExportReportToS3Task(BaseExecution):
-    @stopit.threading_timeoutable(default=StatusTypes.code["ExecutionRunTimeout"])
     def defaultTask(self):
         from app import app
         taskStatus = None
@@ -542,29 +1075,63 @@ class ProjectExportReportToS3Task(BaseExecution):
         return taskStatus
 
 class HealthMetricsCollectionTask(BaseExecution):
-    @stopit.threading_timeoutable(default=StatusTypes.code["ExecutionRunTimeout"])
     def defaultTask(self):
-        from app.admin import HealthMetrics
+        from app.admin import healthMetrics, AdministrationAPI
         from app import app
 
         taskStatus = None
 
-        healthMetrics = HealthMetrics()
+        # All probes run at once, so the whole collection is bounded by a single HEALTHCHECK_TIMEOUT_IN_SECONDS
+        probes = healthMetrics.collect(app.config["HEALTHCHECK_TIMEOUT_IN_SECONDS"])
 
         metrics = models.Metric(
-            domino_api_healthy = healthMetrics.isDominoAPIHealthy(timeout = app.config["HEALTHCHECK_TIMEOUT_IN_SECONDS"]),
-            domino_docker_registry_healthy = healthMetrics.isDominoDockerRegistryHealthy(timeout = app.config["HEALTHCHECK_TIMEOUT_IN_SECONDS"]),
-            external_docker_registry_healthy = healthMetrics.isExternalDockerRegistryHealthy(timeout = app.config["HEALTHCHECK_TIMEOUT_IN_SECONDS"]),
-            external_s3_bucket_healthy = healthMetrics.isS3BucketHealthy(timeout = app.config["HEALTHCHECK_TIMEOUT_IN_SECONDS"])
+            domino_api_healthy = probes["domino_api"]["healthy"],
+            domino_docker_registry_healthy = probes["domino_registry"]["healthy"],
+            external_docker_registry_healthy = probes["external_registry"]["healthy"],
+            external_s3_bucket_healthy = probes["s3_bucket"]["healthy"]
         )
 
         self._dbSession.add(metrics)
+        # Need to commit to generate metric_key to use below
+        self._dbSession.commit()
+
+        for (name, probe) in probes.items():
+            self._dbSession.add(models.MetricProbe(metrics.metric_key, name, probe["healthy"], probe["latency_ms"], probe["error_class"]))
         self._dbSession.commit()
 
+        AdministrationAPI(self._dbSession).publishHealthSnapshot(metrics)
+
+        return taskStatus
+
+class MetricsRollupTask(BaseExecution):
+    def defaultTask(self):
+        from app.admin import Cleanup
+        from app.metrics import MetricsRollup
+
+        taskStatus = None
+
+        jobDetails = {}
+        if self._execution.jobs.job_details:
+            jobDetails = json.loads(encrypter.decrypt(self._execution.jobs.job_details))
+
+        # Raw health checks before the watermark have already been added to the rollups
+        watermark = jobDetails.get("taskState", {}).get("MetricsRollupTask", {}).get("rolledUpUntil", None)
+        if watermark:
+            watermark = datetime.strptime(watermark, "%Y-%m-%dT%H:%M:%S")
+
+        rolledUpUntil = MetricsRollup(self._dbSession).rollup(watermark)
+        self.updateJobTaskStates([{
+            "task": "MetricsRollupTask",
+            "taskInfo": {
+                "rolledUpUntil": rolledUpUntil.strftime("%Y-%m-%dT%H:%M:%S")
+            }
+        }])
+
+        Cleanup(self._dbSession).pruneMetrics(rolledUpUntil)
+
         return taskStatus
 
 class DatabasePruneTask(BaseExecution):
-    @stopit.threading_timeoutable(default=StatusTypes.code["ExecutionRunTimeout"])
     def defaultTask(self):
         from app.admin import Cleanup
         from app import app
@@ -574,6 +1141,9 @@ class DatabasePruneTask(BaseExecution):
         cleanup = Cleanup(self._dbSession)
         cleanup.pruneMetrics()
         cleanup.pruneExecutions()
+        cleanup.pruneCancellations()
+        cleanup.pruneWorkerNodes()
+        cleanup.pruneNodeStats()
 
         return taskStatus
 
@@ -619,6 +1189,18 @@ class UpdateAllExportStatusS3Job(BaseJob):
         else:
             self._logger.info("Skipping UpdateAllExportStatusS3 job ({0}) because it is already running".format(self._job.export_id))
 
+class MetricsRollupJob(BaseJob):
+    def __init__(self, jobID, scheduler):
+        super().__init__(jobID, scheduler)
+
+        if not self.isJobAlreadyRunning():
+            runTasks = ["MetricsRollupTask"]
+            self.addSubTasks(runTasks)
+            self.run()
+            self.wait()
+        else:
+            self._logger.info("Skipping MetricsRollup job ({0}) because it is already running".format(self._job.export_id))
+
 class DatabasePruneJob(BaseJob):
     def __init__(self, jobID, scheduler):
         super().__init__(jobID, scheduler)
@@ -0,0 +1,179 @@
+import app.models as models
+from app.dbcommon import DBCommon
+from app.helpers import DBHelpers
+
+from datetime import datetime, timedelta
+from math import ceil, log
+import json
+
+class LatencyHistogram(object):
+    # Log-spaced latency buckets: bucket i counts the samples in (growth^(i-1), growth^i] ms. Histograms merge by adding
+    #  counts, so minute buckets add up to hours exactly, and a percentile read back is at most (growth - 1) too high
+    growth = 1.1
+
+    def __init__(self, counts = None):
+        self.counts = {int(index): count for (index, count) in (counts or {}).items()}
+
+    @classmethod
+    def fromJSON(cls, value):
+        return cls(json.loads(value) if value else {})
+
+    def toJSON(self):
+        return json.dumps({str(index): self.counts[index] for index in sorted(self.counts)})
+
+    @classmethod
+    def bucketIndex(cls, latencyMS):
+        if latencyMS <= 1:
+            return 0
+
+        return int(ceil(log(latencyMS) / log(cls.growth)))
+
+    def add(self, latencyMS, count = 1):
+        index = self.bucketIndex(latencyMS)
+        self.counts[index] = self.counts.get(index, 0) + count
+
+    def merge(self, other):
+        for (index, count) in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+
+        return self
+
+    def samples(self):
+        return sum(self.counts.values())
+
+    # Nearest-rank percentile, reported as the upper bound of the bucket it falls in
+    def percentile(self, percent):
+        total = self.samples()
+        if not total:
+            return None
+
+        rank = max(1, int(ceil(percent / 100 * total)))
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return round(self.growth ** index, 2)
+
+class MetricsRollup(object):
+    # Raw metrics/metric_probes rows are folded into per-minute and per-hour rollups per dependency (plus "overall"):
+    #  sample and healthy counts, error classes and a LatencyHistogram. Rollups are only ever added to, so each run
+    #  reads just the raw rows collected since the previous run's watermark and raw rows can be dropped soon after
+    overallName = "overall"
+    minuteSeconds = 60
+    hourSeconds = 3600
+
+    def __init__(self, dbSession):
+        self.dbSession = dbSession
+        self.dbCommon = DBCommon(self.dbSession)
+
+    @staticmethod
+    def bucketStart(timestamp, bucketSeconds):
+        elapsed = int((timestamp.replace(tzinfo = None) - datetime.min).total_seconds())
+        return datetime.min + timedelta(seconds = elapsed - (elapsed % bucketSeconds))
+
+    @staticmethod
+    def __newAggregate():
+        return {"samples": 0, "healthy_samples": 0, "histogram": LatencyHistogram(), "errors": {}}
+
+    @staticmethod
+    def __mergeErrors(errors, newErrors):
+        for (errorClass, count) in newErrors.items():
+            errors[errorClass] = errors.get(errorClass, 0) + count
+
+        return errors
+
+    def __accumulate(self, aggregates, bucketSeconds, timestamp, name, healthy, latencyMS, errorClass):
+        key = (self.bucketStart(timestamp, bucketSeconds), name)
+        aggregate = aggregates.get(key, None)
+        if aggregate is None:
+            aggregate = aggregates[key] = self.__newAggregate()
+
+        aggregate["samples"] += 1
+        aggregate["healthy_samples"] += 1 if healthy else 0
+        if latencyMS is not None:
+            aggregate["histogram"].add(latencyMS)
+        if errorClass:
+            self.__mergeErrors(aggregate["errors"], {errorClass: 1})
+
+    def __store(self, bucketSeconds, start, end, aggregates):
+        rollups = {
+            (rollup.bucket_start_timestamp, rollup.probe_name): rollup
+            for rollup in self.dbCommon.getMetricRollupsBetween(bucketSeconds, self.bucketStart(start, bucketSeconds), end)
+        }
+
+        for ((bucketStart, name), aggregate) in aggregates.items():
+            rollup = rollups.get((bucketStart, name), None)
+            if rollup is None:
+                rollup = rollups[(bucketStart, name)] = models.MetricRollup(bucketSeconds, bucketStart, name)
+                self.dbSession.add(rollup)
+
+            rollup.samples += aggregate["samples"]
+            rollup.healthy_samples += aggregate["healthy_samples"]
+            rollup.latency_histogram = LatencyHistogram.fromJSON(rollup.latency_histogram).merge(aggregate["histogram"]).toJSON()
+            rollup.error_counts = json.dumps(self.__mergeErrors(json.loads(rollup.error_counts or "{}"), aggregate["errors"]))
+
+    # Rolls up the raw rows collected in [watermark, now - METRICS_ROLLUP_SETTLE_SECONDS), whole minutes only, and returns
+    #  the new watermark. Without a watermark it starts from the oldest raw row
+    def rollup(self, watermark = None):
+        from app import app
+
+        until = self.bucketStart(DBHelpers.now() - timedelta(seconds = app.config["METRICS_ROLLUP_SETTLE_SECONDS"]), self.minuteSeconds)
+        if watermark is None:
+            earliest = self.dbCommon.getEarliestMetric()
+            if earliest is None:
+                return until
+            watermark = self.bucketStart(earliest.collection_timestamp, self.minuteSeconds)
+
+        # A long backlog (first run, or the leader was down) is worked off over several runs
+        until = min(until, watermark + timedelta(seconds = app.config["METRICS_ROLLUP_MAX_CATCHUP_SECONDS"]))
+        if until <= watermark:
+            return watermark
+
+        metrics = self.dbCommon.getMetricsBetween(watermark, until)
+        probes = self.dbCommon.getMetricProbesBetween(watermark, until)
+
+        for bucketSeconds in (self.minuteSeconds, self.hourSeconds):
+            aggregates = {}
+            for metric in metrics:
+                healthy = metric.domino_api_healthy and metric.domino_docker_registry_healthy and metric.external_docker_registry_healthy and metric.external_s3_bucket_healthy
+                self.__accumulate(aggregates, bucketSeconds, metric.collection_timestamp, self.overallName, healthy, None, None)
+            for probe in probes:
+                self.__accumulate(aggregates, bucketSeconds, probe.collection_timestamp, probe.probe_name, probe.probe_healthy, probe.probe_latency_ms, probe.probe_error_class)
+
+            self.__store(bucketSeconds, watermark, until, aggregates)
+
+        self.dbSession.commit()
+
+        return until
+
+    # Percent of healthy samples per name over the hour rollups of the last windowSeconds (rounded down to whole hours)
+    def availability(self, windowSeconds):
+        since = self.bucketStart(DBHelpers.now() - timedelta(seconds = windowSeconds), self.hourSeconds)
+
+        return {
+            name: (round(100.0 * healthySamples / samples, 3) if samples else None)
+            for (name, samples, healthySamples) in self.dbCommon.getMetricAvailabilitySince(self.hourSeconds, since)
+        }
+
+    # Latency histogram and error counts per probe name over the last windowSeconds: minute rollups for the rolled up
+    #  part of the window plus the raw probes collected since
+    def latency(self, windowSeconds):
+        windowStart = DBHelpers.now() - timedelta(seconds = windowSeconds)
+        aggregates = {}
+        rolledUntil = windowStart
+
+        for rollup in self.dbCommon.getMetricRollupsBetween(self.minuteSeconds, self.bucketStart(windowStart, self.minuteSeconds), datetime.max):
+            aggregate = aggregates.setdefault(rollup.probe_name, {"histogram": LatencyHistogram(), "errors": {}})
+            aggregate["histogram"].merge(LatencyHistogram.fromJSON(rollup.latency_histogram))
+            self.__mergeErrors(aggregate["errors"], json.loads(rollup.error_counts or "{}"))
+            rolledUntil = max(rolledUntil, rollup.bucket_start_timestamp + timedelta(seconds = self.minuteSeconds))
+
+        for probe in self.dbCommon.getMetricProbesSince(rolledUntil):
+            aggregate = aggregates.setdefault(probe.probe_name, {"histogram": LatencyHistogram(), "errors": {}})
+            if probe.probe_latency_ms is not None:
+                aggregate["histogram"].add(probe.probe_latency_ms)
+            if probe.probe_error_class:
+                self.__mergeErrors(aggregate["errors"], {probe.probe_error_class: 1})
+
+        return aggregates
+
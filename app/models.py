@@ -3,7 +3,7 @@ from app.helpers import DBHelpers
 from app.status import StatusTypes
 
 from time import time
-from sqlalchemy import Column, Integer, Boolean, String, JSON, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, Boolean, String, JSON, DateTime, ForeignKey, Float, UniqueConstraint
 from sqlalchemy.ext.mutable import MutableDict
 from sqlalchemy.orm import relationship, backref
 from sqlalchemy.sql import func
@@ -131,4 +131,222 @@ class Metric(db.Base):
             self.domino_docker_registry_healthy,
             self.external_docker_registry_healthy,
             self.external_s3_bucket_healthy
-        )
\ No newline at end of file
+        )
+
+class MetricProbe(db.Base):
+    __tablename__ = "metric_probes"
+    probe_key = Column(Integer, primary_key=True)
+    metric_key = Column(Integer, ForeignKey("metrics.metric_key"), nullable=False)
+    collection_timestamp = Column(DateTime(timezone=True), nullable=False, default=DBHelpers.now, index=True)
+    probe_name = Column(String, nullable=False)
+    probe_healthy = Column(Boolean, nullable=False)
+    probe_latency_ms = Column(Float, nullable=True)
+    probe_error_class = Column(String, nullable=True)
+
+    def __init__(self, metric_key, probe_name, probe_healthy, probe_latency_ms, probe_error_class):
+        self.metric_key = metric_key
+        self.probe_name = probe_name
+        self.probe_healthy = probe_healthy
+        self.probe_latency_ms = probe_latency_ms
+        self.probe_error_class = probe_error_class
+
+    def __repr__(self):
+        return "<MetricProbe {0} collected at {1} (healthy: {2}, latency_ms: {3}, error_class: {4})>".format(
+            self.probe_name,
+            self.collection_timestamp,
+            self.probe_healthy,
+            self.probe_latency_ms,
+            self.probe_error_class
+        )
+
+class MetricRollup(db.Base):
+    __tablename__ = "metric_rollups"
+    __table_args__ = (UniqueConstraint("bucket_seconds", "bucket_start_timestamp", "probe_name"),)
+    rollup_key = Column(Integer, primary_key=True)
+    bucket_seconds = Column(Integer, nullable=False)
+    bucket_start_timestamp = Column(DateTime(timezone=True), nullable=False, index=True)
+    probe_name = Column(String, nullable=False)
+    samples = Column(Integer, nullable=False, default=0)
+    healthy_samples = Column(Integer, nullable=False, default=0)
+    latency_histogram = Column(String, nullable=False, default="{}")
+    error_counts = Column(String, nullable=False, default="{}")
+
+    def __init__(self, bucket_seconds, bucket_start_timestamp, probe_name):
+        self.bucket_seconds = bucket_seconds
+        self.bucket_start_timestamp = bucket_start_timestamp
+        self.probe_name = probe_name
+        self.samples = 0
+        self.healthy_samples = 0
+        self.latency_histogram = "{}"
+        self.error_counts = "{}"
+
+    def __repr__(self):
+        return "<MetricRollup {0} for {1}s from {2} (samples: {3}, healthy_samples: {4})>".format(
+            self.probe_name,
+            self.bucket_seconds,
+            self.bucket_start_timestamp,
+            self.samples,
+            self.healthy_samples
+        )
+
+class ExportedBlob(db.Base):
+    __tablename__ = "exported_blobs"
+    blob_path = Column(String, primary_key=True)
+    blob_key = Column(String, nullable=False, index=True)
+    file_size = Column(Integer, nullable=True)
+    etag = Column(String, nullable=True)
+    exported_timestamp = Column(DateTime(timezone=True), nullable=False, default=DBHelpers.now)
+
+    def __init__(self, blob_path, blob_key, file_size, etag):
+        self.blob_path = blob_path
+        self.blob_key = blob_key
+        self.file_size = file_size
+        self.etag = etag
+
+    def __repr__(self):
+        return "<ExportedBlob {0} at {1} (file_size: {2}, etag: {3})>".format(
+            self.blob_key,
+            self.blob_path,
+            self.file_size,
+            self.etag
+        )
+
+class ExportFileCheckpoint(db.Base):
+    __tablename__ = "export_file_checkpoints"
+    __table_args__ = (UniqueConstraint("job_id", "destination_name", "commit_id", "file_path"),)
+    checkpoint_key = Column(Integer, primary_key=True)
+    job_id = Column(Integer, ForeignKey("jobs.job_id"), nullable=False, index=True)
+    destination_name = Column(String, nullable=False)
+    commit_id = Column(String, nullable=False)
+    file_path = Column(String, nullable=False)
+    blob_key = Column(String, nullable=False)
+    etag = Column(String, nullable=True)
+    completed_timestamp = Column(DateTime(timezone=True), nullable=False, default=DBHelpers.now)
+
+    def __init__(self, job_id, destination_name, commit_id, file_path, blob_key, etag):
+        self.job_id = job_id
+        self.destination_name = destination_name
+        self.commit_id = commit_id
+        self.file_path = file_path
+        self.blob_key = blob_key
+        self.etag = etag
+
+    def __repr__(self):
+        return "<ExportFileCheckpoint {0} of commit {1} for job {2} to {3} (blob_key: {4}, etag: {5})>".format(
+            self.file_path,
+            self.commit_id,
+            self.job_id,
+            self.destination_name,
+            self.blob_key,
+            self.etag
+        )
+
+class ExportCancellation(db.Base):
+    __tablename__ = "export_cancellations"
+    cancellation_key = Column(Integer, primary_key=True)
+    job_id = Column(Integer, ForeignKey("jobs.job_id"), nullable=False, index=True)
+    requested_timestamp = Column(DateTime(timezone=True), nullable=False, default=DBHelpers.now)
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+
+    def __repr__(self):
+        return "<ExportCancellation for job {0} requested at {1}>".format(
+            self.job_id,
+            self.requested_timestamp
+        )
+
+class NodeStats(db.Base):
+    __tablename__ = "node_stats"
+    node_id = Column(String, primary_key=True)
+    node_hostname = Column(String, nullable=True)
+    stats_timestamp = Column(DateTime(timezone=True), nullable=False, default=DBHelpers.now)
+    node_stats = Column(String, nullable=False)
+
+    def __init__(self, node_id, node_hostname, node_stats):
+        self.node_id = node_id
+        self.node_hostname = node_hostname
+        self.node_stats = node_stats
+
+    def __repr__(self):
+        return "<NodeStats of {0} ({1}) saved at {2}>".format(
+            self.node_id,
+            self.node_hostname,
+            self.stats_timestamp
+        )
+
+class CacheGeneration(db.Base):
+    __tablename__ = "cache_generations"
+    cache_name = Column(String, primary_key=True)
+    generation = Column(Integer, nullable=False, default=0)
+
+    def __init__(self, cache_name, generation):
+        self.cache_name = cache_name
+        self.generation = generation
+
+    def __repr__(self):
+        return "<CacheGeneration {0} at {1}>".format(
+            self.cache_name,
+            self.generation
+        )
+
+class WorkerNode(db.Base):
+    __tablename__ = "worker_nodes"
+    node_id = Column(String, primary_key=True)
+    node_hostname = Column(String, nullable=True)
+    node_pid = Column(Integer, nullable=True)
+    node_started_timestamp = Column(DateTime(timezone=True), nullable=False, default=DBHelpers.now)
+    heartbeat_timestamp = Column(DateTime(timezone=True), nullable=False, default=DBHelpers.now)
+
+    def __init__(self, node_id, node_hostname, node_pid):
+        self.node_id = node_id
+        self.node_hostname = node_hostname
+        self.node_pid = node_pid
+
+    def __repr__(self):
+        return "<WorkerNode {0} ({1}:{2}) last seen at {3}>".format(
+            self.node_id,
+            self.node_hostname,
+            self.node_pid,
+            self.heartbeat_timestamp
+        )
+
+class ExecutionLease(db.Base):
+    __tablename__ = "execution_leases"
+    execution_id = Column(Integer, ForeignKey("executions.execution_id"), primary_key=True)
+    node_id = Column(String, nullable=False)
+    lease_acquired_timestamp = Column(DateTime(timezone=True), nullable=False, default=DBHelpers.now)
+    lease_expires_timestamp = Column(DateTime(timezone=True), nullable=False)
+    lease_attempts = Column(Integer, nullable=False, default=1)
+
+    def __init__(self, execution_id, node_id, lease_expires_timestamp):
+        self.execution_id = execution_id
+        self.node_id = node_id
+        self.lease_expires_timestamp = lease_expires_timestamp
+        self.lease_attempts = 1
+
+    def __repr__(self):
+        return "<ExecutionLease for execution_id {0} held by {1} until {2} (attempt {3})>".format(
+            self.execution_id,
+            self.node_id,
+            self.lease_expires_timestamp,
+            self.lease_attempts
+        )
+
+class LeaderLease(db.Base):
+    __tablename__ = "leader_leases"
+    lease_name = Column(String, primary_key=True)
+    node_id = Column(String, nullable=False)
+    lease_expires_timestamp = Column(DateTime(timezone=True), nullable=False)
+
+    def __init__(self, lease_name, node_id, lease_expires_timestamp):
+        self.lease_name = lease_name
+        self.node_id = node_id
+        self.lease_expires_timestamp = lease_expires_timestamp
+
+    def __repr__(self):
+        return "<LeaderLease {0} held by {1} until {2}>".format(
+            self.lease_name,
+            self.node_id,
+            self.lease_expires_timestamp
+        )
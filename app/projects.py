@@ -5,10 +5,14 @@ import app.models as models
 from app.dbcommon import DBCommon
 from app.dbcommon import DBExportJobExists, DBExportJobDoesNotExist, DBProjectJobExists
 from app.status import StatusTypes
+from app.helpers import DBHelpers
+from app.cache import TTLCache
+from app.filefilter import ProjectFileFilter
 from domino import DominoAPISession
 from domino import DominoAPIKeyInvalid, DominoAPIUnauthorized, DominoAPINotFound, DominoAPIBadRequest, DominoAPIComputeEnvironmentRevisionNotAvailable, DominoAPIUnexpectedError
 
 from werkzeug.exceptions import BadRequest
+from concurrent.futures import ThreadPoolExecutor
 import json
 import re
 
@@ -21,6 +25,39 @@ class ExportAPIInvalidExportGroupName(ExportAPIError):
 class ExportAPIInvalidExportProjectName(ExportAPIError):
     pass
 
+class ExportAPIInvalidExportDestination(ExportAPIError):
+    pass
+
+class ExportAPIInvalidFileFilter(ExportAPIError):
+    pass
+
+class ProjectAccessIndex(object):
+    # Maps (owner, project name) to the project's allowedOperations from a single paginated
+    #  listing of every project visible to the API key
+    def __init__(self, dominoAPI):
+        self.dominoAPI = dominoAPI
+        self.__allowedOperations = {}
+
+        for project in self.dominoAPI.listAllProjects(app.config["PROJECT_ACCESS_LIST_PAGE_SIZE"]):
+            self.__allowedOperations[(project.get("ownerUsername", "").lower(), project.get("name", ""))] = project.get("allowedOperations", None)
+
+    def hasAccess(self, userName, projectName):
+        key = (userName.lower(), projectName)
+        if key not in self.__allowedOperations:
+            return False
+
+        # Older listings do not include allowedOperations; fall back to a per-project lookup and remember the result
+        if self.__allowedOperations[key] is None:
+            try:
+                self.__allowedOperations[key] = self.dominoAPI.findProjectByOwnerAndName(userName, projectName, validateAPIKey = False).get("allowedOperations", [])
+            except:
+                self.__allowedOperations[key] = []
+
+        return "ChangeProjectSettings" in self.__allowedOperations[key]
+
+projectAccessCache = TTLCache(app.config["PROJECT_ACCESS_CACHE_TTL_SECONDS"])
+apiKeyValidityCache = TTLCache(app.config["API_KEY_VALIDITY_CACHE_TTL_SECONDS"])
+
 class ProjectsAPI(object):
     def __init__(self, dominoAPIKey, dbSession):
         self.dominoAPIKey = dominoAPIKey
@@ -29,7 +66,103 @@ class ProjectsAPI(object):
         self.dominoAPI = DominoAPISession(app.config["DOMINO_API_SERVER"], self.dominoAPIKey, verifySSL = app.config["DOMINO_API_SERVER_VERIFY_SSL"])
         self.reDockerRegistryName = re.compile("^[a-z0-9]+(?:[._-]{1,2}[a-z0-9]+)*$")
 
-    def create(self, username, projectName, exportGroupName, exportProjectName):
+    # Checks a new export against Domino and the Docker Registry naming rules; returns the (possibly lower cased)
+    #  export names and any warning message. Makes no DB calls, so it is safe to run from worker threads
+    def validateProjectExport(self, username, projectName, exportGroupName, exportProjectName):
+        message = None
+
+        # Expect to get Exceptions here if the Domino API Key does not provide access to the Project
+        projectInfo = self.dominoAPI.findProjectByOwnerAndName(username, projectName, validateAPIKey = False)
+        if "ChangeProjectSettings" not in projectInfo.get("allowedOperations", []):
+            raise(DominoAPIUnauthorized)
+
+        # Check export group and project names for compliance with Docker Registry naming requirements
+        if not self.reDockerRegistryName.match(exportGroupName):
+            if self.reDockerRegistryName.match(exportGroupName.lower()):
+                exportGroupName = exportGroupName.lower()
+
+                jobMessageFormat = "{MESSAGE}"
+                if message:
+                    jobMessageFormat = "{ORIGINAL};  {MESSAGE}"
+
+                message = jobMessageFormat.format(
+                    ORIGINAL = message,
+                    MESSAGE = "Warning: request has been processed, but the Export Group Name has been automatically converted to lower case to comply with Docker Registry standards"
+                )
+            else:
+                raise(ExportAPIInvalidExportGroupName)
+
+        if not self.reDockerRegistryName.match(exportProjectName):
+            if self.reDockerRegistryName.match(exportProjectName.lower()):
+                exportProjectName = exportProjectName.lower()
+
+                jobMessageFormat = "{MESSAGE}"
+                if message:
+                    jobMessageFormat = "{ORIGINAL};  {MESSAGE}"
+
+                message = jobMessageFormat.format(
+                    ORIGINAL = message,
+                    MESSAGE = "Warning: request has been processed, but the Export Project Name has been automatically converted to lower case to comply with Docker Registry standards"
+                )
+            else:
+                raise(ExportAPIInvalidExportProjectName)
+
+        return (exportGroupName, exportProjectName, message)
+
+    # Export destinations are named in EXPORTS_PROJECT_FILES_S3_DESTINATIONS; the primary bucket is always exported to
+    def validateExportDestinations(self, exportDestinations):
+        if exportDestinations is None:
+            return []
+
+        if (not isinstance(exportDestinations, list)) or any([(not isinstance(name, str)) or (name not in app.config["EXPORTS_PROJECT_FILES_S3_DESTINATIONS"]) for name in exportDestinations]):
+            raise(ExportAPIInvalidExportDestination)
+
+        return list(dict.fromkeys(exportDestinations))
+
+    def validateFileFilter(self, includeFiles, excludeFiles, maxFileSizeBytes):
+        if not ProjectFileFilter.isValid(includeFiles, excludeFiles, maxFileSizeBytes):
+            raise(ExportAPIInvalidFileFilter)
+
+        return ProjectFileFilter(includeFiles, excludeFiles, maxFileSizeBytes or None)
+
+    def newProjectExportJob(self, username, projectName, exportGroupName, exportProjectName, jobRunFrequencyInSeconds, exportDestinations = None, fileFilter = None):
+        fileFilter = fileFilter or ProjectFileFilter()
+        jobDetails = {
+                "taskState": {
+                    "ProjectFilesExportTask": {
+                        "lastCompletedExecutionID": None,
+                        "commitID": None
+                    },
+                    "ProjectDockerImageExportTask": {
+                        "lastCompletedExecutionID": None,
+                        "computeEnvironmentID": None,
+                        "computeEnvironmentRevision": None
+                    },
+                    "ProjectExportReportToS3Task": {
+                        "lastCompletedExecutionID": None,
+                        "statusSaved": False
+                    }
+                },
+                "dockerBuildTemplateFile": "Standard.Dockerfile",
+                "exportDestinations": exportDestinations or [],
+                "fileIncludePatterns": fileFilter.include,
+                "fileExcludePatterns": fileFilter.exclude,
+                "fileMaxSizeBytes": fileFilter.maxFileSizeBytes
+        }
+        job = models.Job(
+            job_type = "ProjectExport",
+            job_user = username.lower(),
+            job_project = projectName,
+            job_export_group = exportGroupName,
+            job_export_project = exportProjectName,
+            run_frequency_seconds = jobRunFrequencyInSeconds,
+            job_secrets = encrypter.encrypt(self.dominoAPIKey),
+            job_details = encrypter.encrypt(json.dumps(jobDetails))
+        )
+
+        return job
+
+    def create(self, username, projectName, exportGroupName, exportProjectName, exportDestinations = None, includeFiles = None, excludeFiles = None, maxFileSizeBytes = None):
         respCode = 201
         jobData = {
             "success": None,
@@ -42,77 +175,20 @@ class ProjectsAPI(object):
             if not self.dominoAPI.isValidAPIKey():
                 raise(DominoAPIKeyInvalid)
 
-            jobType = "ProjectExport"
             jobRunFrequencyInSeconds = app.config["EXPORT_JOB_SCHEDULE_DEFAULT_FREQUENCY_SECONDS"]
 
-            # Expect to get Exceptions here if the Domino API Key does not provide access to the Project
-            projectInfo = self.dominoAPI.findProjectByOwnerAndName(username, projectName)
-            if not self.dominoAPI.hasAccessToProject(username, projectName):
-                raise(DominoAPIUnauthorized)
+            exportDestinations = self.validateExportDestinations(exportDestinations)
+            fileFilter = self.validateFileFilter(includeFiles, excludeFiles, maxFileSizeBytes)
+            (exportGroupName, exportProjectName, jobData["message"]) = self.validateProjectExport(username, projectName, exportGroupName, exportProjectName)
 
-            # Check export group and project names for compliance with Docker Registry naming requirements
-            if not self.reDockerRegistryName.match(exportGroupName):
-                if self.reDockerRegistryName.match(exportGroupName.lower()):
-                    exportGroupName = exportGroupName.lower()
-
-                    jobMessageFormat = "{MESSAGE}"
-                    if jobData["message"]:
-                        jobMessageFormat = "{ORIGINAL};  {MESSAGE}"
-
-                    jobData["message"] = jobMessageFormat.format(
-                        ORIGINAL = jobData["message"],
-                        MESSAGE = "Warning: request has been processed, but the Export Group Name has been automatically converted to lower case to comply with Docker Registry standards"
-                    )
-                else:
-                    raise(ExportAPIInvalidExportGroupName)
-
-            if not self.reDockerRegistryName.match(exportProjectName):
-                if self.reDockerRegistryName.match(exportProjectName.lower()):
-                    exportProjectName = exportProjectName.lower()
-
-                    jobMessageFormat = "{MESSAGE}"
-                    if jobData["message"]:
-                        jobMessageFormat = "{ORIGINAL};  {MESSAGE}"
-
-                    jobData["message"] = jobMessageFormat.format(
-                        ORIGINAL = jobData["message"],
-                        MESSAGE = "Warning: request has been processed, but the Export Project Name has been automatically converted to lower case to comply with Docker Registry standards"
-                    )
-                else:
-                    raise(ExportAPIInvalidExportProjectName)
+            # The project may be newer than this API key's cached access index
+            projectAccessCache.invalidate(DBHelpers.hashEncode(self.dominoAPIKey))
 
             # Expect to get Exceptions here if the job already exists
             self.dbCommon.raiseOnJobExists(username, projectName, exportGroupName, exportProjectName, app.config.get("ALLOW_SAME_PROJECT_EXPORTS", False))
 
             # Do the actual work here
-            jobDetails = {
-                    "taskState": {
-                        "ProjectFilesExportTask": {
-                            "lastCompletedExecutionID": None,
-                            "commitID": None
-                        },
-                        "ProjectDockerImageExportTask": {
-                            "lastCompletedExecutionID": None,
-                            "computeEnvironmentID": None,
-                            "computeEnvironmentRevision": None
-                        },
-                        "ProjectExportReportToS3Task": {
-                            "lastCompletedExecutionID": None,
-                            "statusSaved": False
-                        }
-                    },
-                    "dockerBuildTemplateFile": "Standard.Dockerfile"
-            }
-            job = models.Job(
-                job_type = jobType,
-                job_user = username.lower(),
-                job_project = projectName,
-                job_export_group = exportGroupName,
-                job_export_project = exportProjectName,
-                run_frequency_seconds = jobRunFrequencyInSeconds,
-                job_secrets = encrypter.encrypt(self.dominoAPIKey),
-                job_details = encrypter.encrypt(json.dumps(jobDetails))
-            )
+            job = self.newProjectExportJob(username, projectName, exportGroupName, exportProjectName, jobRunFrequencyInSeconds, exportDestinations, fileFilter)
 
             self.dbSession.add(job)
             self.dbSession.commit()
@@ -152,6 +228,14 @@ class ProjectsAPI(object):
             respCode = 422
             jobData["success"] = False
             jobData["message"] = StatusTypes.messageFromType["ExportAPIInvalidExportProjectName"]
+        except ExportAPIInvalidExportDestination:
+            respCode = 422
+            jobData["success"] = False
+            jobData["message"] = StatusTypes.messageFromType["ExportAPIInvalidExportDestination"]
+        except ExportAPIInvalidFileFilter:
+            respCode = 422
+            jobData["success"] = False
+            jobData["message"] = StatusTypes.messageFromType["ExportAPIInvalidFileFilter"]
         except (DominoAPIUnexpectedError, Exception) as e:
             respCode = 503
             jobData["success"] = False
@@ -160,7 +244,130 @@ class ProjectsAPI(object):
 
         return (respCode, jobData)
     
-    def update(self, identity, updateAPIKey, exportGroupName, exportProjectName, disabled):
+    def createBatch(self, items):
+        respCode = 201
+        batchData = {
+            "success": None,
+            "message": None,
+            "results": []
+        }
+
+        # Per-item response codes and messages, matching create()
+        itemErrors = [
+            (BadRequest, 400, "ExportAPIMalformedJSON"),
+            (DominoAPINotFound, 400, "ExportAPIProjectNotExist"),
+            ((DominoAPIKeyInvalid, DominoAPIUnauthorized), 401, "ExportAPIProjectNoAccess"),
+            (DBExportJobExists, 409, "ExportAPIExportNameConflict"),
+            (DBProjectJobExists, 409, "ExportAPIDominoNameConflict"),
+            (ExportAPIInvalidExportGroupName, 422, "ExportAPIInvalidExportGroupName"),
+            (ExportAPIInvalidExportProjectName, 422, "ExportAPIInvalidExportProjectName"),
+            (ExportAPIInvalidExportDestination, 422, "ExportAPIInvalidExportDestination"),
+            (ExportAPIInvalidFileFilter, 422, "ExportAPIInvalidFileFilter")
+        ]
+
+        def itemError(e):
+            for (exceptionTypes, errorCode, statusType) in itemErrors:
+                if isinstance(e, exceptionTypes):
+                    return (errorCode, StatusTypes.messageFromType[statusType])
+            return (503, StatusTypes.messageFromType["UnknownError"].format(repr(e)))
+
+        def validateItem(item):
+            try:
+                if not isinstance(item, dict):
+                    raise(BadRequest)
+                for field in ("username", "project_name", "export_group_name", "export_project_name"):
+                    if not isinstance(item.get(field, None), str):
+                        raise(BadRequest)
+
+                exportDestinations = self.validateExportDestinations(item.get("export_destinations", None))
+                fileFilter = self.validateFileFilter(item.get("include_files", None), item.get("exclude_files", None), item.get("max_file_size_bytes", None))
+                return self.validateProjectExport(item["username"], item["project_name"], item["export_group_name"], item["export_project_name"]) + (exportDestinations, fileFilter)
+            except Exception as e:
+                return e
+
+        try:
+            if (not isinstance(items, list)) or (len(items) == 0) or (len(items) > app.config["EXPORT_JOB_BATCH_MAX_SIZE"]):
+                raise(BadRequest)
+
+            if not self.dominoAPI.isValidAPIKey():
+                raise(DominoAPIKeyInvalid)
+
+            jobRunFrequencyInSeconds = app.config["EXPORT_JOB_SCHEDULE_DEFAULT_FREQUENCY_SECONDS"]
+
+            # Domino lookups dominate the cost of a create, so they run concurrently; DB checks stay on this thread
+            with ThreadPoolExecutor(max_workers = app.config["EXPORT_JOB_BATCH_VALIDATION_WORKERS"]) as executor:
+                validations = list(executor.map(validateItem, items))
+
+            projectAccessCache.invalidate(DBHelpers.hashEncode(self.dominoAPIKey))
+
+            results = []
+            jobs = []
+            batchProjects = set()
+            batchExports = set()
+            for (item, validation) in zip(items, validations):
+                itemData = {
+                    "status_code": 201,
+                    "success": None,
+                    "message": None,
+                    "export_id": None,
+                    "export_frequency_seconds": None
+                }
+                results.append(itemData)
+
+                try:
+                    if isinstance(validation, Exception):
+                        raise(validation)
+                    (exportGroupName, exportProjectName, itemData["message"], exportDestinations, fileFilter) = validation
+
+                    # Expect to get Exceptions here if the job already exists, either in the DB or earlier in this batch
+                    self.dbCommon.raiseOnJobExists(item["username"], item["project_name"], exportGroupName, exportProjectName, app.config.get("ALLOW_SAME_PROJECT_EXPORTS", False))
+                    if (not app.config.get("ALLOW_SAME_PROJECT_EXPORTS", False)) and ((item["username"].lower(), item["project_name"]) in batchProjects):
+                        raise(DBProjectJobExists)
+                    if (exportGroupName, exportProjectName) in batchExports:
+                        raise(DBExportJobExists)
+                    batchProjects.add((item["username"].lower(), item["project_name"]))
+                    batchExports.add((exportGroupName, exportProjectName))
+
+                    jobs.append((itemData, self.newProjectExportJob(item["username"], item["project_name"], exportGroupName, exportProjectName, jobRunFrequencyInSeconds, exportDestinations, fileFilter)))
+
+                except Exception as e:
+                    (itemData["status_code"], itemData["message"]) = itemError(e)
+                    itemData["success"] = False
+
+            # All accepted jobs are written in a single transaction
+            self.dbSession.add_all([job for (itemData, job) in jobs])
+            self.dbSession.commit()
+
+            # Spread the initial runs out rather than starting every export at once
+            for (jobIndex, (itemData, job)) in enumerate(jobs):
+                itemData["success"] = True
+                itemData["export_id"] = job.export_id
+                itemData["export_frequency_seconds"] = job.run_frequency_seconds
+                scheduler.addJob(job.job_id, True, jobIndex * app.config["EXPORT_JOB_BATCH_STAGGER_SECONDS"])
+
+            batchData["results"] = results
+            batchData["success"] = all([itemData["success"] for itemData in results])
+            if not batchData["success"]:
+                respCode = 207
+
+        except BadRequest:
+            respCode = 400
+            batchData["success"] = False
+            batchData["message"] = StatusTypes.messageFromType["ExportAPIMalformedJSON"]
+        except DominoAPIKeyInvalid:
+            respCode = 401
+            batchData["success"] = False
+            batchData["message"] = StatusTypes.messageFromType["ExportAPIProjectNoAccess"]
+        except (DominoAPIUnexpectedError, Exception) as e:
+            self.dbSession.rollback()
+            respCode = 503
+            batchData["success"] = False
+            batchData["message"] = StatusTypes.messageFromType["UnknownError"].format(repr(e))
+            raise(e)
+
+        return (respCode, batchData)
+
+    def update(self, identity, updateAPIKey, exportGroupName, exportProjectName, disabled, includeFiles = None, excludeFiles = None, maxFileSizeBytes = None):
         respCode = 200
         jobData = {
             "success": None,
@@ -173,6 +380,8 @@ class ProjectsAPI(object):
             if not self.dominoAPI.isValidAPIKey():
                 raise(DominoAPIKeyInvalid)
 
+            self.validateFileFilter(includeFiles, excludeFiles, maxFileSizeBytes)
+
             job = self.dbCommon.getJobByExportID(identity)
 
             if not job:
@@ -224,13 +433,34 @@ class ProjectsAPI(object):
             if type(disabled) == bool:
                 job.job_active = (not disabled)
 
+            jobDetails = json.loads(encrypter.decrypt(job.job_details))
+            taskState = jobDetails.get("taskState", {})
+            fileFilterDetails = {}
+            if includeFiles is not None:
+                fileFilterDetails["fileIncludePatterns"] = includeFiles
+            if excludeFiles is not None:
+                fileFilterDetails["fileExcludePatterns"] = excludeFiles
+            if maxFileSizeBytes is not None:
+                # A size limit of 0 removes it
+                fileFilterDetails["fileMaxSizeBytes"] = maxFileSizeBytes or None
+
+            fileFilterChanged = any([jobDetails.get(detail, None) != value for (detail, value) in fileFilterDetails.items()])
+            if fileFilterChanged:
+                # Export every destination again from scratch, so files the new filters leave out are dropped from latest
+                jobDetails.update(fileFilterDetails)
+                for filesState in [taskState["ProjectFilesExportTask"]] + list(taskState["ProjectFilesExportTask"].get("destinations", {}).values()):
+                    filesState["commitID"] = None
+                    filesState["resumeCommitID"] = None
+
             if exportGroupName or exportProjectName:
                 # Force project file and Docker image export tasks to run during next schedule
-                jobDetails = json.loads(encrypter.decrypt(job.job_details))
-                taskState = jobDetails.get("taskState", {})
                 taskState["ProjectFilesExportTask"]["commitID"] = None
+                for destinationState in taskState["ProjectFilesExportTask"].get("destinations", {}).values():
+                    destinationState["commitID"] = None
                 taskState["ProjectDockerImageExportTask"]["computeEnvironmentID"] = None
                 taskState["ProjectDockerImageExportTask"]["computeEnvironmentRevision"] = None
+
+            if exportGroupName or exportProjectName or fileFilterChanged:
                 jobDetails["taskState"] = taskState
                 job.job_details = encrypter.encrypt(json.dumps(jobDetails))
 
@@ -264,6 +494,10 @@ class ProjectsAPI(object):
             respCode = 422
             jobData["success"] = False
             jobData["message"] = StatusTypes.messageFromType["ExportAPIInvalidExportProjectName"]
+        except ExportAPIInvalidFileFilter:
+            respCode = 422
+            jobData["success"] = False
+            jobData["message"] = StatusTypes.messageFromType["ExportAPIInvalidFileFilter"]
         except (DominoAPIUnexpectedError, Exception) as e:
             respCode = 503
             jobData["success"] = False
@@ -271,42 +505,141 @@ class ProjectsAPI(object):
 
         return (respCode, jobData)
 
+    # Only valid keys are remembered, so a revoked key is turned away within API_KEY_VALIDITY_CACHE_TTL_SECONDS
+    @staticmethod
+    def isValidAPIKey(dominoAPIKey):
+        keyHash = DBHelpers.hashEncode(dominoAPIKey or "")
+        if apiKeyValidityCache.get(keyHash):
+            return True
 
-    def status(self, identity = None, projectName = None):
-        respCode = 200
-        jobData = []
+        try:
+            valid = DominoAPISession(app.config["DOMINO_API_SERVER"], dominoAPIKey, verifySSL = app.config["DOMINO_API_SERVER_VERIFY_SSL"]).isValidAPIKey()
+        except Exception:
+            return False
+        if valid:
+            apiKeyValidityCache.set(keyHash, True)
+
+        return valid
+
+
+    # Records a cancellation for the export's scheduled and running tasks. Worker processes pick it up within
+    #  EXPORT_CANCELLATION_POLL_SECONDS and stop the tasks at their next checkpoint
+    def cancel(self, exportID):
+        from app import cancellations
+        respCode = 202
+        jobData = {
+            "success": None,
+            "message": None,
+            "export_id": None,
+            "cancelled_tasks": 0
+        }
 
         try:
             if not self.dominoAPI.isValidAPIKey():
                 raise(DominoAPIKeyInvalid)
 
-            userJobs = []
-            jobs = self.dbCommon.getAllProjectExportJobs()
-            for job in jobs:
-                if self.dominoAPI.hasAccessToProject(job.job_user, job.job_project):
-                    userJobs.append(job)
-
-            for userJob in userJobs:
-                if identity:
-                    if projectName:
-                        # Status by userName and projectName
-                        if (userJob.job_user == identity.lower()) and (userJob.job_project == projectName):
-                            jobData = self.dbCommon.projectExportStatusHistory(userJob.job_id, app.config.get("API_STATUS_LOG_MAX_RECORDS", 10), True)
-                    else:
-                        # Status by export_id
-                        if userJob.export_id == identity.lower():
-                            jobData = self.dbCommon.projectExportStatusHistory(userJob.job_id, app.config.get("API_STATUS_LOG_MAX_RECORDS", 10), True)
-                            break
-                        # Status by userName
-                        elif userJob.job_user == identity.lower():
-                            status = self.dbCommon.projectExportStatusLastHistory(userJob.job_id)
-                            if status:
-                                jobData.append(status)
-                # Status for all jobs
-                else:
-                    status = self.dbCommon.projectExportStatusLastHistory(userJob.job_id)
-                    if status:
-                        jobData.append(status)
+            job = self.dbCommon.getJobByExportID(exportID)
+
+            if not job:
+                raise(DBExportJobDoesNotExist)
+            # Expect to get Exceptions here if the Domino API Key does not provide access to the Project
+            projectInfo = self.dominoAPI.findProjectByOwnerAndName(job.job_user, job.job_project)
+            if not self.dominoAPI.hasAccessToProject(job.job_user, job.job_project):
+                raise(DominoAPIUnauthorized)
+
+            jobData["export_id"] = job.export_id
+            activeExecutions = self.dbCommon.getActiveExecutionsForJob(job.job_id)
+            if not activeExecutions:
+                respCode = 409
+                jobData["success"] = False
+                jobData["message"] = StatusTypes.messageFromType["ExportAPINothingToCancel"]
+            else:
+                cancellation = models.ExportCancellation(job.job_id)
+                self.dbSession.add(cancellation)
+                self.dbSession.commit()
+
+                # Stop tasks running in this process (SERVICE_ROLE "all") right away
+                cancellations.cancelJob(job.job_id, cancellation.requested_timestamp)
+
+                jobData["success"] = True
+                jobData["cancelled_tasks"] = len(activeExecutions)
+
+        except DominoAPINotFound:
+            respCode = 400
+            jobData["success"] = False
+            jobData["message"] = StatusTypes.messageFromType["ExportAPIProjectNotExist"]
+        except (DominoAPIKeyInvalid, DominoAPIUnauthorized):
+            respCode = 401
+            jobData["success"] = False
+            jobData["message"] = StatusTypes.messageFromType["ExportAPIProjectNoAccess"]
+        except DBExportJobDoesNotExist:
+            respCode = 404
+            jobData["success"] = False
+            jobData["message"] = StatusTypes.messageFromType["ExportAPIExportIDNotExist"]
+        except (DominoAPIUnexpectedError, Exception) as e:
+            respCode = 503
+            jobData["success"] = False
+            jobData["message"] = StatusTypes.messageFromType["UnknownError"].format(repr(e))
+
+        return (respCode, jobData)
+
+    def projectAccessIndex(self):
+        if not self.dominoAPI.isValidAPIKey():
+            raise(DominoAPIKeyInvalid)
+
+        accessIndexKey = DBHelpers.hashEncode(self.dominoAPIKey)
+        accessIndex = projectAccessCache.get(accessIndexKey)
+        if accessIndex is None:
+            accessIndex = ProjectAccessIndex(self.dominoAPI)
+            projectAccessCache.set(accessIndexKey, accessIndex)
+
+        return accessIndex
+
+    # Yields (job_id, status record) one at a time. The job_id is None for history records of a single
+    #  export, which are bounded by API_STATUS_LOG_MAX_RECORDS and are not paginated
+    def statusRecords(self, accessIndex, identity = None, projectName = None, cursor = None):
+        maxRecords = app.config.get("API_STATUS_LOG_MAX_RECORDS", 10)
+        batchSize = app.config["API_STATUS_QUERY_BATCH_SIZE"]
+
+        if identity and projectName:
+            # Status by userName and projectName
+            for job in self.dbCommon.iterProjectExportJobs(username = identity.lower(), projectName = projectName, batchSize = batchSize):
+                if accessIndex.hasAccess(job.job_user, job.job_project):
+                    for status in self.dbCommon.projectExportStatusHistory(job.job_id, maxRecords, True):
+                        yield (None, status)
+            return
+
+        if identity:
+            # Status by export_id
+            job = self.dbCommon.getJobByExportID(identity.lower())
+            if job and (job.job_type == "ProjectExport"):
+                if accessIndex.hasAccess(job.job_user, job.job_project):
+                    for status in self.dbCommon.projectExportStatusHistory(job.job_id, maxRecords, True):
+                        yield (None, status)
+                return
+
+        # Status by userName, or for all jobs
+        for job in self.dbCommon.iterProjectExportJobs(afterJobID = cursor, username = identity.lower() if identity else None, batchSize = batchSize):
+            if accessIndex.hasAccess(job.job_user, job.job_project):
+                status = self.dbCommon.projectExportStatusLastHistory(job.job_id)
+                if status:
+                    yield (job.job_id, status)
+
+    def status(self, identity = None, projectName = None, cursor = None, limit = None):
+        respCode = 200
+        jobData = []
+        nextCursor = None
+
+        try:
+            accessIndex = self.projectAccessIndex()
+
+            lastJobID = None
+            for (jobID, status) in self.statusRecords(accessIndex, identity, projectName, cursor):
+                if limit and jobID and (len(jobData) == limit):
+                    nextCursor = lastJobID
+                    break
+                jobData.append(status)
+                lastJobID = jobID
 
         except DominoAPIKeyInvalid:
             respCode = 401
@@ -314,4 +647,34 @@ class ProjectsAPI(object):
             respCode = 503
             raise(e)
 
-        return (respCode, jobData)
+        return (respCode, jobData, nextCursor)
+
+    # Same records as status(), but handed back as a generator so the caller can stream them as they are computed.
+    #  The headers are sent before the page is read, so a page with more after it ends with a {"next_cursor": ...} record
+    def statusStream(self, identity = None, projectName = None, cursor = None, limit = None):
+        respCode = 200
+        records = iter(())
+
+        try:
+            accessIndex = self.projectAccessIndex()
+            records = self.__statusStreamPage(self.statusRecords(accessIndex, identity, projectName, cursor), limit)
+
+        except DominoAPIKeyInvalid:
+            respCode = 401
+        except (DominoAPIUnexpectedError, Exception) as e:
+            respCode = 503
+            raise(e)
+
+        return (respCode, records)
+
+    @staticmethod
+    def __statusStreamPage(records, limit):
+        count = 0
+        lastJobID = None
+        for (jobID, status) in records:
+            if limit and jobID and (count == limit):
+                yield {"next_cursor": lastJobID}
+                return
+            yield status
+            count += 1
+            lastJobID = jobID
@@ -0,0 +1,527 @@
+from app.dockerclient import DockerException
+from app.cancellation import CancellableStream
+from app.throttle import ThrottledStream
+
+import requests
+import urllib3
+import json
+import re
+import logging
+from time import monotonic
+from boto3.s3.transfer import TransferConfig
+from hashlib import sha256
+from urllib.parse import urlparse
+
+class DockerRegistryError(DockerException):
+    pass
+
+class DockerRegistryAuthError(DockerRegistryError):
+    pass
+
+class DockerRegistryManifestUnsupported(DockerRegistryError):
+    pass
+
+class DockerImageS3ExportUnsupported(DockerRegistryError):
+    pass
+
+class ImageReference(object):
+    # Splits "<registry host>/<repository>:<tag>" (or "@<digest>") following the same rules as the
+    #  Docker CLI: the first component is a registry host only if it looks like one
+    defaultRegistry = "registry-1.docker.io"
+
+    def __init__(self, imageURL):
+        name = re.sub("^[a-z]+://", "", imageURL)
+        self.digest = None
+        self.tag = "latest"
+
+        if "@" in name:
+            (name, self.digest) = name.split("@", 1)
+        lastComponent = name.rsplit("/", 1)[-1]
+        if ":" in lastComponent:
+            (name, self.tag) = name.rsplit(":", 1)
+
+        components = name.split("/", 1)
+        if len(components) > 1 and (("." in components[0]) or (":" in components[0]) or (components[0] == "localhost")):
+            self.host = components[0]
+            self.repository = components[1]
+        else:
+            self.host = self.defaultRegistry
+            self.repository = name if "/" in name else "library/{0}".format(name)
+
+    @property
+    def reference(self):
+        return self.digest if self.digest else self.tag
+
+    def __repr__(self):
+        return "{0}/{1}{2}{3}".format(
+            self.host,
+            self.repository,
+            "@" if self.digest else ":",
+            self.reference
+        )
+
+
+class RegistryClient(object):
+    manifestMediaTypes = [
+        "application/vnd.docker.distribution.manifest.v2+json",
+        "application/vnd.docker.distribution.manifest.list.v2+json",
+        "application/vnd.oci.image.manifest.v1+json",
+        "application/vnd.oci.image.index.v1+json"
+    ]
+    indexMediaTypes = [
+        "application/vnd.docker.distribution.manifest.list.v2+json",
+        "application/vnd.oci.image.index.v1+json"
+    ]
+
+    # Token lifetime when the token server gives no expires_in, and how long before expiry a cached token is
+    #  dropped so a request never starts with one about to lapse
+    defaultTokenSeconds = 60
+    tokenExpiryMarginSeconds = 10
+
+    def __init__(self, registry, insecure = False, verifySSL = True, timeout = 60):
+        self.__session = requests.Session()
+        self.__registry = registry
+        self.__scheme = "http" if insecure else "https"
+        self.__timeout = timeout
+        self.__tokens = {}
+        self.__basicAuth = False
+        self.__logger = logging.getLogger(__name__)
+
+        if verifySSL == False:
+            self.__session.verify = False
+            urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+    def __credentials(self):
+        username = self.__registry.get("username", None)
+        password = self.__registry.get("password", None)
+        return (username, password) if (username and password) else None
+
+    def __authorize(self, challenge, scopes):
+        (authType, _, params) = challenge.partition(" ")
+        authType = authType.lower()
+
+        if authType == "basic":
+            if not self.__credentials():
+                raise(DockerRegistryAuthError("Registry requires credentials"))
+            self.__basicAuth = True
+        elif authType == "bearer":
+            challengeParams = dict(re.findall('(\\w+)="([^"]*)"', params))
+            requestedScopes = sorted(set(scopes + ([challengeParams["scope"]] if challengeParams.get("scope") else [])))
+            response = self.__session.get(
+                challengeParams["realm"],
+                params = {
+                    "service": challengeParams.get("service", ""),
+                    "scope": requestedScopes
+                },
+                auth = self.__credentials(),
+                timeout = self.__timeout
+            )
+            if response.status_code != requests.codes.ok:
+                raise(DockerRegistryAuthError("Registry token request failed with HTTP response status code {0}".format(response.status_code)))
+            tokenData = response.json()
+            # Token servers leave out expires_in when it is the 60 second default
+            expiresIn = tokenData.get("expires_in", None) or self.defaultTokenSeconds
+            self.__tokens[" ".join(requestedScopes)] = (
+                tokenData.get("token", tokenData.get("access_token", None)),
+                monotonic() + expiresIn - min(self.tokenExpiryMarginSeconds, expiresIn / 2)
+            )
+        else:
+            raise(DockerRegistryAuthError("Unsupported registry authentication scheme '{0}'".format(authType)))
+
+    def __token(self, scopes):
+        # Any unexpired cached token granted for a superset of the requested scopes will do
+        now = monotonic()
+        for (tokenScopes, (token, expires)) in list(self.__tokens.items()):
+            if expires <= now:
+                del self.__tokens[tokenScopes]
+            elif set(scopes).issubset(tokenScopes.split(" ")):
+                return token
+
+        return None
+
+    def __request(self, method, host, path, scopes, headers = None, **kwargs):
+        uri = "{0}://{1}/v2/{2}".format(self.__scheme, host, path.lstrip("/")) if not path.startswith("http") else path
+        headers = dict(headers or {})
+        # A streamed body is partly read by the time a 401 comes back, so it is never sent again; callers streaming
+        #  one authorize first (see finishBlobUpload)
+        replayable = not hasattr(kwargs.get("data", None), "read")
+
+        for attempt in range(2):
+            requestHeaders = dict(headers)
+            auth = None
+            token = self.__token(scopes)
+            if token:
+                requestHeaders["Authorization"] = "Bearer {0}".format(token)
+            elif self.__basicAuth:
+                auth = self.__credentials()
+
+            response = self.__session.request(method, uri, headers = requestHeaders, auth = auth, timeout = self.__timeout, **kwargs)
+            if response.status_code == requests.codes.unauthorized and attempt == 0 and replayable and "WWW-Authenticate" in response.headers:
+                response.close()
+                self.__authorize(response.headers["WWW-Authenticate"], scopes)
+                continue
+            break
+
+        if response.status_code == requests.codes.unauthorized:
+            raise(DockerRegistryAuthError("Registry denied access to {0}".format(uri)))
+
+        return response
+
+    def __raiseOnStatus(self, response, expected):
+        if response.status_code not in expected:
+            raise(DockerRegistryError("Registry gave HTTP response status code {0} for {1} {2}: {3}".format(
+                response.status_code,
+                response.request.method,
+                response.url,
+                response.text[:512]
+            )))
+
+    # GET /v2/ - API version check, authenticated like any other request
+    def ping(self):
+        host = self.__registry["url"].split("://")[-1].split("/")[0]
+        response = self.__request("GET", host, "", [])
+        response.close()
+        self.__raiseOnStatus(response, [requests.codes.ok])
+
+        return True
+
+    def manifestDigest(self, image):
+        response = self.__request(
+            "HEAD",
+            image.host,
+            "{0}/manifests/{1}".format(image.repository, image.reference),
+            ["repository:{0}:pull".format(image.repository)],
+            headers = {"Accept": ", ".join(self.manifestMediaTypes)}
+        )
+
+        if response.status_code == requests.codes.not_found:
+            return None
+        self.__raiseOnStatus(response, [requests.codes.ok])
+
+        return response.headers.get("Docker-Content-Digest", None)
+
+    def getManifest(self, image):
+        response = self.__request(
+            "GET",
+            image.host,
+            "{0}/manifests/{1}".format(image.repository, image.reference),
+            ["repository:{0}:pull".format(image.repository)],
+            headers = {"Accept": ", ".join(self.manifestMediaTypes)}
+        )
+        self.__raiseOnStatus(response, [requests.codes.ok])
+
+        mediaType = response.headers.get("Content-Type", "").split(";")[0].strip()
+        if mediaType not in self.manifestMediaTypes:
+            mediaType = json.loads(response.content).get("mediaType", mediaType)
+        if mediaType not in self.manifestMediaTypes:
+            raise(DockerRegistryManifestUnsupported("Unsupported manifest media type '{0}' for {1}".format(mediaType, image)))
+
+        return (mediaType, response.content, response.headers.get("Docker-Content-Digest", None))
+
+    def putManifest(self, image, mediaType, manifest):
+        response = self.__request(
+            "PUT",
+            image.host,
+            "{0}/manifests/{1}".format(image.repository, image.reference),
+            ["repository:{0}:pull,push".format(image.repository)],
+            headers = {"Content-Type": mediaType},
+            data = manifest
+        )
+        self.__raiseOnStatus(response, [requests.codes.created, requests.codes.ok])
+
+        return response.headers.get("Docker-Content-Digest", None)
+
+    def blobExists(self, host, repository, digest):
+        response = self.__request(
+            "HEAD",
+            host,
+            "{0}/blobs/{1}".format(repository, digest),
+            ["repository:{0}:pull".format(repository)]
+        )
+
+        return response.status_code == requests.codes.ok
+
+    def openBlob(self, host, repository, digest):
+        response = self.__request(
+            "GET",
+            host,
+            "{0}/blobs/{1}".format(repository, digest),
+            ["repository:{0}:pull".format(repository)],
+            stream = True
+        )
+        self.__raiseOnStatus(response, [requests.codes.ok])
+        response.raw.decode_content = False
+
+        return response
+
+    def startBlobUpload(self, host, repository, digest = None, mountFrom = None):
+        # Returns (True, None) if the blob was mounted from another repository, otherwise (False, <upload URL>)
+        scopes = ["repository:{0}:pull,push".format(repository)]
+        params = {}
+        if digest and mountFrom:
+            scopes.append("repository:{0}:pull".format(mountFrom))
+            params = {"mount": digest, "from": mountFrom}
+
+        response = self.__request(
+            "POST",
+            host,
+            "{0}/blobs/uploads/".format(repository),
+            scopes,
+            params = params
+        )
+        self.__raiseOnStatus(response, [requests.codes.created, requests.codes.accepted])
+
+        if response.status_code == requests.codes.created:
+            return (True, None)
+
+        location = response.headers["Location"]
+        if not location.startswith("http"):
+            location = "{0}://{1}{2}".format(self.__scheme, host, location)
+
+        return (False, location)
+
+    def finishBlobUpload(self, host, repository, location, digest, stream, size):
+        scopes = ["repository:{0}:pull,push".format(repository)]
+        # Without an unexpired token for the push scope, draw the 401 with a request for the upload's status
+        #  rather than with the PUT, whose streamed body can only be sent once
+        if (self.__token(scopes) is None) and not self.__basicAuth:
+            self.__request("GET", host, location, scopes).close()
+
+        separator = "&" if "?" in location else "?"
+        response = self.__request(
+            "PUT",
+            host,
+            "{0}{1}digest={2}".format(location, separator, digest),
+            scopes,
+            headers = {"Content-Type": "application/octet-stream"},
+            data = SizedStream(stream, size)
+        )
+        self.__raiseOnStatus(response, [requests.codes.created])
+
+
+class SizedStream(object):
+    # Gives requests a Content-Length for a streamed body so it is not sent chunked
+    def __init__(self, stream, size):
+        self.__stream = stream
+        self.__size = size
+
+    def __len__(self):
+        return self.__size
+
+    def read(self, size = -1):
+        return self.__stream.read(size)
+
+
+class RegistryCopier(object):
+    # Copies an image between two registries over the Registry HTTP API v2 without the local Docker daemon.
+    # Blobs the target already has are skipped and blobs on the same registry host are cross-repository mounted.
+    def __init__(self, sourceClient, targetClient, cancellation = None):
+        self.__source = sourceClient
+        self.__target = targetClient
+        self.__cancellation = cancellation
+        # Blobs known to exist on the target, by digest -> (host, repository)
+        self.__knownBlobs = {}
+        self.__logger = logging.getLogger(__name__)
+
+    @staticmethod
+    def isPureFromTemplate(dockerFileTemplatePath):
+        with open(dockerFileTemplatePath, "r") as dockerFileTemplate:
+            instructions = [line.strip() for line in dockerFileTemplate if line.strip() and not line.strip().startswith("#")]
+
+        return (len(instructions) == 1) and (re.match("^FROM\\s+\\{DOMINO_DOCKER_IMAGE\\}$", instructions[0], re.IGNORECASE) is not None)
+
+    def copy(self, sourceImageURL, targetImageURL):
+        source = ImageReference(sourceImageURL)
+        target = ImageReference(targetImageURL)
+        stats = {
+            "digest": None,
+            "blobsCopied": 0,
+            "blobsMounted": 0,
+            "blobsSkipped": 0,
+            "bytesCopied": 0
+        }
+
+        (mediaType, manifest, digest) = self.__source.getManifest(source)
+        manifestData = json.loads(manifest)
+
+        if mediaType in RegistryClient.indexMediaTypes:
+            # Multi-platform images: copy every child manifest by digest before the index referencing them
+            for child in manifestData.get("manifests", []):
+                childSource = ImageReference("{0}/{1}@{2}".format(source.host, source.repository, child["digest"]))
+                childTarget = ImageReference("{0}/{1}@{2}".format(target.host, target.repository, child["digest"]))
+                (childMediaType, childManifest, _) = self.__source.getManifest(childSource)
+                self.__copyBlobs(source, target, json.loads(childManifest), stats)
+                self.__target.putManifest(childTarget, childMediaType, childManifest)
+        else:
+            self.__copyBlobs(source, target, manifestData, stats)
+
+        # The manifest bytes are pushed unchanged, so the digest is the same on both sides
+        stats["digest"] = self.__target.putManifest(target, mediaType, manifest) or digest
+
+        return stats
+
+    def __copyBlobs(self, source, target, manifestData, stats):
+        descriptors = [manifestData["config"]] + manifestData.get("layers", [])
+
+        for descriptor in descriptors:
+            # Foreign layers are not stored in the registry
+            if descriptor.get("urls"):
+                continue
+            self.__copyBlob(source, target, descriptor, stats)
+
+    def __copyBlob(self, source, target, descriptor, stats):
+        digest = descriptor["digest"]
+        if self.__cancellation:
+            self.__cancellation.check()
+
+        if self.__knownBlobs.get(digest, None) == (target.host, target.repository) or self.__target.blobExists(target.host, target.repository, digest):
+            stats["blobsSkipped"] += 1
+            self.__knownBlobs[digest] = (target.host, target.repository)
+            return
+
+        # Cross-repository mounts only work within the same registry
+        mountFrom = None
+        if source.host == target.host:
+            mountFrom = source.repository
+        elif digest in self.__knownBlobs and self.__knownBlobs[digest][0] == target.host:
+            mountFrom = self.__knownBlobs[digest][1]
+
+        (mounted, location) = self.__target.startBlobUpload(target.host, target.repository, digest, mountFrom)
+        if mounted:
+            stats["blobsMounted"] += 1
+        else:
+            blob = self.__source.openBlob(source.host, source.repository, digest)
+            try:
+                self.__target.finishBlobUpload(target.host, target.repository, location, digest, CancellableStream(blob.raw, self.__cancellation), descriptor["size"])
+            finally:
+                blob.close()
+            stats["blobsCopied"] += 1
+            stats["bytesCopied"] += descriptor["size"]
+
+        self.__knownBlobs[digest] = (target.host, target.repository)
+
+
+class RegistryS3Exporter(object):
+    # Writes an image as an OCI image layout (oci-layout, index.json, blobs/sha256/<digest>) under an S3 prefix.
+    # Blobs are streamed from the registry straight into concurrent multipart uploads, and digests already
+    #  exported (or already present under the prefix) are skipped. Uploads go through the limiter's S3 traffic limits
+    #  (see app/throttle.py) when there is one.
+    ociLayout = json.dumps({"imageLayoutVersion": "1.0.0"})
+
+    def __init__(self, registryClient, s3Client, partSizeBytes = 64 * 1024 ** 2, maxConcurrency = 8, exportedDigests = None, cancellation = None, limiter = None):
+        self.__registry = registryClient
+        self.__cancellation = cancellation
+        self.__limiter = limiter
+        self.__s3 = s3Client
+        self.__transferConfig = TransferConfig(
+            multipart_threshold = partSizeBytes,
+            multipart_chunksize = partSizeBytes,
+            max_concurrency = maxConcurrency
+        )
+        self.__exportedDigests = set(exportedDigests or [])
+
+    def export(self, imageURL, s3Path):
+        image = ImageReference(imageURL)
+        s3PathParsed = urlparse(s3Path)
+        # Blobs go straight to S3 through the client, so export buckets with any other scheme are refused
+        if s3PathParsed.scheme != "s3":
+            raise(DockerImageS3ExportUnsupported("Docker image S3 exports need an s3:// export bucket, not {0}".format(s3Path)))
+        bucket = s3PathParsed.netloc
+        prefix = s3PathParsed.path.strip("/")
+        stats = {
+            "path": s3Path,
+            "digest": None,
+            "blobsUploaded": 0,
+            "blobsSkipped": 0,
+            "bytesUploaded": 0,
+            "digests": []
+        }
+
+        (mediaType, manifest, digest) = self.__registry.getManifest(image)
+        digest = digest or "sha256:{0}".format(sha256(manifest).hexdigest())
+        manifestData = json.loads(manifest)
+
+        if mediaType in RegistryClient.indexMediaTypes:
+            for child in manifestData.get("manifests", []):
+                childImage = ImageReference("{0}/{1}@{2}".format(image.host, image.repository, child["digest"]))
+                (childMediaType, childManifest, _) = self.__registry.getManifest(childImage)
+                self.__exportBlobs(image, json.loads(childManifest), bucket, prefix, stats)
+                self.__putBlob(bucket, prefix, child["digest"], childManifest, stats)
+        else:
+            self.__exportBlobs(image, manifestData, bucket, prefix, stats)
+
+        self.__putBlob(bucket, prefix, digest, manifest, stats)
+
+        index = {
+            "schemaVersion": 2,
+            "manifests": [
+                {
+                    "mediaType": mediaType,
+                    "digest": digest,
+                    "size": len(manifest),
+                    "annotations": {
+                        "org.opencontainers.image.ref.name": image.tag
+                    }
+                }
+            ]
+        }
+        self.__s3.put_object(Bucket = bucket, Key = "{0}/oci-layout".format(prefix), Body = self.ociLayout.encode())
+        self.__s3.put_object(Bucket = bucket, Key = "{0}/index.json".format(prefix), Body = json.dumps(index).encode())
+
+        stats["digest"] = digest
+        stats["digests"] = sorted(self.__exportedDigests)
+
+        return stats
+
+    def __blobKey(self, prefix, digest):
+        (algorithm, encoded) = digest.split(":", 1)
+        return "{0}/blobs/{1}/{2}".format(prefix, algorithm, encoded)
+
+    def __blobExists(self, bucket, key):
+        try:
+            self.__s3.head_object(Bucket = bucket, Key = key)
+            return True
+        except self.__s3.exceptions.ClientError as e:
+            if e.response.get("Error", {}).get("Code", None) in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+    def __exportBlobs(self, image, manifestData, bucket, prefix, stats):
+        for descriptor in [manifestData["config"]] + manifestData.get("layers", []):
+            if descriptor.get("urls"):
+                continue
+
+            digest = descriptor["digest"]
+            key = self.__blobKey(prefix, digest)
+            if digest in self.__exportedDigests or self.__blobExists(bucket, key):
+                stats["blobsSkipped"] += 1
+                self.__exportedDigests.add(digest)
+                continue
+
+            if self.__cancellation:
+                self.__cancellation.check()
+
+            # A cancellation raised while reading makes boto3 abort the multipart upload
+            blob = self.__registry.openBlob(image.host, image.repository, digest)
+            try:
+                blobStream = blob.raw
+                if self.__limiter:
+                    self.__limiter.acquire(requests = 1)
+                    blobStream = ThrottledStream(blobStream, self.__limiter)
+                self.__s3.upload_fileobj(CancellableStream(blobStream, self.__cancellation), bucket, key, Config = self.__transferConfig)
+            finally:
+                blob.close()
+
+            stats["blobsUploaded"] += 1
+            stats["bytesUploaded"] += descriptor["size"]
+            self.__exportedDigests.add(digest)
+
+    def __putBlob(self, bucket, prefix, digest, data, stats):
+        if digest in self.__exportedDigests:
+            stats["blobsSkipped"] += 1
+            return
+
+        self.__s3.put_object(Bucket = bucket, Key = self.__blobKey(prefix, digest), Body = data)
+        stats["blobsUploaded"] += 1
+        stats["bytesUploaded"] += len(data)
+        self.__exportedDigests.add(digest)
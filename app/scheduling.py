@@ -7,8 +7,10 @@ from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.executors.pool import ProcessPoolExecutor
 from apscheduler.triggers.interval import IntervalTrigger
 from apscheduler.triggers.date import DateTrigger
+from apscheduler.jobstores.base import ConflictingIdError
 from pytz import utc
 from datetime import datetime, timedelta, timezone
+import threading
 
 class Scheduler(object):
     def __init__(self,):
@@ -16,10 +18,13 @@ class Scheduler(object):
         self.__dbSession = None
         self.__dbCommon = None
         self.__runningJobs = []
+        self.__jobFrequencies = {}
+        self.__jobsLock = threading.RLock()
         self.__jobTypes = {
             "ProjectExport": Jobs.ProjectExportJob,
             "AllExportJobsS3Status": Jobs.UpdateAllExportStatusS3Job,
             "HealthMetricsCollection": Jobs.HealthMetricsCollectionJob,
+            "MetricsRollup": Jobs.MetricsRollupJob,
             "DatabasePrune": Jobs.DatabasePruneJob
         }
         self.__executionTypes = {
@@ -28,10 +33,13 @@ class Scheduler(object):
             "ProjectExportReportToS3Task": Jobs.ProjectExportReportToS3Task,
             "UpdateAllExportStatusS3Task": Jobs.UpdateAllExportStatusS3Task,
             "HealthMetricsCollectionTask": Jobs.HealthMetricsCollectionTask,
+            "MetricsRollupTask": Jobs.MetricsRollupTask,
             "DatabasePruneTask": Jobs.DatabasePruneTask
         }
 
-    def start(self, workerType = "thread", maxWorkers = 10, timezone = utc):
+    def start(self, workerType = "thread", maxWorkers = 10, timezone = utc, syncFrequencySeconds = None, heartbeatSeconds = None, cancellationPollSeconds = None):
+        from app import workerPool
+
         self.__dbSession = db.dbSession
         self.__dbCommon = DBCommon(self.__dbSession)
 
@@ -60,43 +68,131 @@ class Scheduler(object):
 
         self.__scheduler.configure(executors=executors, job_defaults=job_defaults, timezone=timezone)
         self.__scheduler.start()
+        workerPool.start()
         self.refreshJobs()
 
+        if heartbeatSeconds:
+            self.__scheduler.add_job(
+                func = self.heartbeat,
+                id = "heartbeat",
+                executor = "default",
+                trigger = IntervalTrigger(seconds = heartbeatSeconds)
+            )
+
+        if cancellationPollSeconds:
+            self.__scheduler.add_job(
+                func = self.pollCancellations,
+                id = "pollCancellations",
+                executor = "default",
+                trigger = IntervalTrigger(seconds = cancellationPollSeconds)
+            )
+
+        if syncFrequencySeconds:
+            self.__scheduler.add_job(
+                func = self.syncJobs,
+                id = "syncJobs",
+                executor = "default",
+                trigger = IntervalTrigger(seconds = syncFrequencySeconds)
+            )
+
         #self.__scheduler.print_jobs()
 
+    def isRunning(self):
+        return self.__scheduler.running
+
+    def shutdown(self, wait = True):
+        from app import workerPool
+        if self.__scheduler.running:
+            self.__scheduler.shutdown(wait = wait)
+            workerPool.stop()
+
+    def heartbeat(self):
+        from app import workerPool
+        try:
+            workerPool.heartbeat()
+            workerPool.reclaimExecutions(self)
+        finally:
+            db.dbSession.remove()
+
+    # Cancellations requested through the API (possibly by another process) reach running executions here
+    def pollCancellations(self):
+        from app import cancellations
+        try:
+            cancellations.poll()
+        finally:
+            db.dbSession.remove()
+
+    # Every node schedules every job; at run time only the node that owns it (by export_id hash, or leadership
+    #  for service jobs) actually runs it, so ownership follows the live node set without rescheduling
+    def runJob(self, jobID):
+        from app import workerPool
+        job = self.__dbCommon.getJob(jobID)
+        if job and workerPool.ownsJob(job):
+            self.__jobTypes.get(job.job_type, Jobs.BaseJob)(job.job_id, self)
+
     def refreshJobs(self):
         self.__scheduler.remove_all_jobs();
+        with self.__jobsLock:
+            self.__runningJobs = []
+            self.__jobFrequencies = {}
 
         for job in self.__dbCommon.getAllJobs():
             self.addJob(jobID=job.job_id, runNow=False)
 
+    # Picks up jobs that API processes (SERVICE_ROLE "api") created or changed, since they only write to the database
+    def syncJobs(self):
+        from app import app
+        try:
+            newJobs = 0
+            for job in self.__dbCommon.getAllJobs():
+                if job.export_id not in self.__runningJobs:
+                    # New exports get their first run right away, staggered like a batch create
+                    self.addJob(job.job_id, job.job_type == "ProjectExport", newJobs * app.config["EXPORT_JOB_BATCH_STAGGER_SECONDS"])
+                    newJobs += 1
+                elif self.__jobFrequencies.get(job.export_id, None) != job.run_frequency_seconds:
+                    self.updateJob(job.job_id)
+        finally:
+            # Drop this thread's session so the next pass reads fresh rows
+            db.dbSession.remove()
+
 
     def updateJob(self, jobID):
         job = self.__dbCommon.getJob(jobID)
 
-        if job.export_id in self.__runningJobs:
-            # This should allow us to refresh the job
-            # APScheduler will allow any prior, running jobs to complete without
-            #  killing them when we remove the job from the scheduler
-            self.__scheduler.remove_job(job.export_id)
-            # Newly add the job with the new details
-            self.addJob(job.job_id)
+        with self.__jobsLock:
+            if job.export_id in self.__runningJobs:
+                # This should allow us to refresh the job
+                # APScheduler will allow any prior, running jobs to complete without
+                #  killing them when we remove the job from the scheduler
+                self.__scheduler.remove_job(job.export_id)
+                self.__runningJobs.remove(job.export_id)
+                # Newly add the job with the new details
+                self.addJob(job.job_id)
 
 
-    def addJob(self, jobID, runNow = True):
+    def addJob(self, jobID, runNow = True, runDelaySeconds = 0):
+        # API-only processes do not run a scheduler; the worker picks the job up from the database in syncJobs
+        if not self.__scheduler.running:
+            return None
+
+        with self.__jobsLock:
+            return self.__addJob(jobID, runNow, runDelaySeconds)
+
+    def __addJob(self, jobID, runNow, runDelaySeconds):
 # Think about adding a try; except clause here to not crash the server if there is an issue
         job = self.__dbCommon.getJob(jobID)
-        nowTrigger = DateTrigger(run_date = datetime.now(tz=timezone.utc))
+        if job.export_id in self.__runningJobs:
+            return None
+
+        nowTrigger = DateTrigger(run_date = datetime.now(tz=timezone.utc) + timedelta(seconds = runDelaySeconds))
         scheduledTrigger = IntervalTrigger(seconds = job.run_frequency_seconds)
 
         scheduledJob = None
 
-        jobRunner = self.__jobTypes.get(job.job_type, Jobs.BaseJob)
-
         if runNow:
             nowJob = self.__scheduler.add_job(
-                func = jobRunner,
-                args = [job.job_id, self],
+                func = self.runJob,
+                args = [job.job_id],
                 id = None,
                 executor = "jobs",
                 misfire_grace_time = 60,
@@ -105,8 +201,8 @@ class Scheduler(object):
             #print("Added Project Export Job {0} with export_id {1} as now {2} trigger".format(job, job.export_id, type(nowTrigger)))
 
         scheduledJob = self.__scheduler.add_job(
-            func = jobRunner,
-            args = [job.job_id, self],
+            func = self.runJob,
+            args = [job.job_id],
             id = job.export_id,
             executor = "jobs",
             misfire_grace_time = 60,
@@ -117,6 +213,7 @@ class Scheduler(object):
         #print("Added Job {0} with export_id {1} as interval {2} trigger".format(job, job.export_id, type(scheduledTrigger)))
 
         self.__runningJobs.append(job.export_id)
+        self.__jobFrequencies[job.export_id] = job.run_frequency_seconds
 
         return scheduledJob
 
@@ -129,11 +226,14 @@ class Scheduler(object):
             pass
 
     def removeExecution(self, executionID, statusCode = None):
+        from app import statusCache
         try:
             execution = self.__dbCommon.getExecution(executionID)
             if execution:
                 if statusCode:
+                    previousStatus = execution.execution_status
                     execution.execution_status = statusCode
+                    statusCache.invalidateForExecution(self.__dbSession, execution, previousStatus)
                 self.__scheduler.remove_job(execution.external_execution_id)
         except:
             pass
@@ -145,13 +245,17 @@ class Scheduler(object):
         now = datetime.now(tz=timezone.utc)
         nowTrigger = DateTrigger(run_date = now)
 
-        scheduledJob = self.__scheduler.add_job(
-            func = self.__executionTypes.get(execution.execution_type, Jobs.BaseExecution),
-            args = [execution.execution_id, self],
-            id = execution.external_execution_id,
-            executor = "executions",
-            trigger = nowTrigger
-        )
+        try:
+            scheduledJob = self.__scheduler.add_job(
+                func = self.__executionTypes.get(execution.execution_type, Jobs.BaseExecution),
+                args = [execution.execution_id, self],
+                id = execution.external_execution_id,
+                executor = "executions",
+                trigger = nowTrigger
+            )
+        except ConflictingIdError:
+            # Already queued on this node (e.g. reclaimed again before it started)
+            return None
 
         #print("Added Execution with export_id {0} as '{1}' trigger".format(execution.external_execution_id, now))
 
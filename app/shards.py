@@ -0,0 +1,106 @@
+from app.cancellation import CancellableStream
+
+import tarfile
+
+# zstd shards need the optional zstandard package
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+class ShardPacker(object):
+    # Packs small project files into tar shards of about maxShardBytes (before compression) that are streamed to an
+    #  export destination as they fill up. index() maps every packed path to its shard and to the offset and size of its
+    #  data in the uncompressed tar, so consumers can fetch one file without reading every shard (with a ranged GET when
+    #  the shards are not compressed)
+    compressions = {
+        None: ("", "w|"),
+        "gzip": (".gz", "w|gz"),
+        "zstd": (".zst", "w|")
+    }
+
+    def __init__(self, destination, folder, maxShardBytes, compression = None, cancellation = None):
+        if compression not in self.compressions:
+            raise(ValueError("Shard compression must be one of {0}, not '{1}'".format(", ".join([str(c) for c in self.compressions]), compression)))
+        if (compression == "zstd") and (zstandard is None):
+            raise(ValueError("zstd shard compression needs the zstandard package"))
+
+        self.__destination = destination
+        self.__folder = folder.rstrip("/")
+        self.__maxShardBytes = maxShardBytes
+        self.__compression = compression
+        self.__cancellation = cancellation
+        self.__shards = []
+        self.__files = {}
+        self.__writer = None
+        self.__compressor = None
+        self.__tar = None
+        self.__shardBytes = 0
+
+    def __shardName(self):
+        return "shard-{0:05d}.tar{1}".format(len(self.__shards), self.compressions[self.__compression][0])
+
+    def __openShard(self):
+        name = self.__shardName()
+        self.__writer = self.__destination.open("{0}/{1}".format(self.__folder, name))
+        target = self.__writer
+        if self.__compression == "zstd":
+            self.__compressor = zstandard.ZstdCompressor().stream_writer(self.__writer)
+            target = self.__compressor
+
+        self.__tar = tarfile.open(fileobj = target, mode = self.compressions[self.__compression][1], format = tarfile.PAX_FORMAT)
+        self.__shards.append(name)
+        self.__shardBytes = 0
+
+    def __closeShard(self):
+        self.__tar.close()
+        if self.__compressor is not None:
+            self.__compressor.flush(zstandard.FLUSH_FRAME)
+        self.__writer.close()
+        self.__tar = None
+        self.__compressor = None
+        self.__writer = None
+
+    def add(self, path, size, stream):
+        if (self.__tar is not None) and self.__shardBytes and (self.__shardBytes + size > self.__maxShardBytes):
+            self.__closeShard()
+        if self.__tar is None:
+            self.__openShard()
+
+        info = tarfile.TarInfo(name = path)
+        info.size = size
+        self.__tar.addfile(info, CancellableStream(stream, self.__cancellation))
+
+        # The data ends where the tar now stands, before its padding to the next 512 byte block
+        dataOffset = self.__tar.offset - (-(-size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE)
+        self.__files[path] = {
+            "shard": self.__shards[-1],
+            "offset": dataOffset,
+            "size": size
+        }
+        self.__shardBytes += size
+
+    # Files exported as objects of their own are listed in the index too, so it covers every path of the export
+    def addObject(self, path, key, size):
+        self.__files[path] = {
+            "object": key,
+            "size": size
+        }
+
+    def close(self):
+        if self.__tar is not None:
+            self.__closeShard()
+
+    def abort(self):
+        if self.__writer is not None:
+            self.__writer.terminate()
+        self.__tar = None
+        self.__compressor = None
+        self.__writer = None
+
+    def index(self):
+        return {
+            "compression": self.__compression,
+            "shards": list(self.__shards),
+            "files": self.__files
+        }
@@ -6,6 +6,7 @@ __codes = {
     101: ("ExecutionScheduleTimeout", "Task could not be scheduled to run (either because it is already running or there are not enough execution slots available)"),
     102: ("ExecutionNotComplete", "Task could not complete (likely due to export service shutdown or crash)"),
     103: ("ExecutionRunTimeout", "Task ran over the allotted time and was cancelled"),
+    104: ("ExecutionCancelled", "Task was cancelled on request"),
 
     # Docker errors
     110: ("DockerError", "An unexpected Docker error has occurred"),
@@ -14,6 +15,10 @@ __codes = {
     113: ("DockerImageNotFound", "The Docker client was not able to find the requested image"),
     115: ("DockerInvalidRepository", "The Docker client requested access to an invalid repository"),
     116: ("DockerBuildError", "There was an error with the Docker build"),
+    117: ("DockerRegistryError", "A Docker Registry HTTP API error has occurred"),
+    118: ("DockerRegistryAuthError", "The Docker Registry rejected the supplied credentials"),
+    119: ("DockerRegistryManifestUnsupported", "The Docker image manifest format is not supported for registry-to-registry copies"),
+    120: ("DockerImageS3ExportUnsupported", "Docker image S3 exports need an s3:// EXPORTS_PROJECT_FILES_S3_BUCKET"),
 
     # Export API errors
     130: ("ExportAPIMalformedJSON", "The input supplied is invalid: malformed JSON"),
@@ -24,6 +29,12 @@ __codes = {
     135: ("ExportAPIExportIDNotExist", "Specified Export ID does not exist"),
     136: ("ExportAPIInvalidExportGroupName", "Export Group Name is invalid: name components may contain lowercase letters, digits and separators. A separator is defined as a period, one or two underscores, or one or more dashes. A name component may not start or end with a separator."),
     137: ("ExportAPIInvalidExportProjectName", "Export Project Name is invalid: name components may contain lowercase letters, digits and separators. A separator is defined as a period, one or two underscores, or one or more dashes. A name component may not start or end with a separator."),
+    138: ("ExportAPINothingToCancel", "Specified export has no scheduled or running tasks to cancel"),
+    139: ("ExportAPIInvalidExportDestination", "Export destinations must be a list of the destination names configured in EXPORTS_PROJECT_FILES_S3_DESTINATIONS"),
+    140: ("ExportAPIInvalidFileFilter", "File filters are invalid: include_files and exclude_files must be lists of glob patterns and max_file_size_bytes a whole number of bytes (0 for no limit)"),
+
+    # Export destination errors
+    150: ("ExportDestinationFailed", "The project files could not be exported to one or more of the export destinations"),
 
     # Database Errors
     170: ("InvalidJobRunID", "Specified Job Run ID is invalid"),
@@ -49,6 +60,7 @@ __codes = {
     314: ("ProjectFileMoveLatestToPriorEnded", "Finished moving the old project file export latest folder to the prior folder"),
     315: ("ProjectFileTansferToS3Started", "Started to export the project files to the latest folder"),
     316: ("ProjectFileTansferToS3Ended", "Finished exporting the project files to the latest folder"),
+    317: ("ProjectFileTransferToS3Resumed", "Resumed an interrupted export of the same commit to the latest folder"),
 
     # 330 - 349 Docker Image Export stages
     330: ("DockerExportInitiated", "Docker image export has initiated"),
@@ -57,12 +69,19 @@ __codes = {
     333: ("DockerExportImageBuildStarted", "Docker image for export is being built"),
     334: ("DockerExportImageBuildEnded", "Docker image for export has been built"),
     335: ("DockerExportImagePushStarted", "Docker image for export is being pushed"),
-    336: ("DockerExportImagePushEnded", "Docker image for export has been pushed")
+    336: ("DockerExportImagePushEnded", "Docker image for export has been pushed"),
+    337: ("DockerExportImageCopyStarted", "Docker image for export is being copied between registries"),
+    338: ("DockerExportImageCopyEnded", "Docker image for export has been copied between registries"),
+    339: ("DockerExportRegistryPreflight", "Checking the export registry for an existing copy of the Docker image"),
+    340: ("DockerExportImageS3Started", "Docker image for export is being written to S3"),
+    341: ("DockerExportImageS3Ended", "Docker image for export has been written to S3")
 }
 
 StatusTypes = SimpleNamespace(**{
     "type": {k:v[0] for (k, v) in __codes.items()},
     "messageFromType": {v[0]:v[1] for (k, v) in __codes.items()},
     "message": {k:v[1] for (k, v) in __codes.items()},
-    "code": {v[0]:k for (k, v) in __codes.items()}
+    "code": {v[0]:k for (k, v) in __codes.items()},
+    # Errors plus the generic status codes an execution does not move on from
+    "terminal": {k for k in __codes.keys() if (k < 300) and (k not in (210, 220))}
 })
\ No newline at end of file
@@ -0,0 +1,223 @@
+from datetime import datetime
+from time import monotonic, sleep
+from math import exp
+import threading
+
+class TokenBucket(object):
+    # Lets rate units per second through on average, and up to burstSeconds worth at once. Callers reserve what they
+    #  are about to use and wait the delay returned, so a chunk larger than the burst still goes through, just later.
+    #  A rate of None means no limit; usage is tracked either way as a moving average over about averageSeconds
+    averageSeconds = 10.0
+
+    def __init__(self, rate = None, burstSeconds = 1.0):
+        self.__lock = threading.Lock()
+        self.__burstSeconds = burstSeconds
+        self.__updated = monotonic()
+        self.__tokens = 0.0
+        self.__averageRate = 0.0
+        self.rate = None
+        self.total = 0
+        self.waitedSeconds = 0.0
+        self.setRate(rate)
+
+    def __refill(self, now):
+        elapsed = now - self.__updated
+        if self.rate:
+            self.__tokens = min(self.rate * self.__burstSeconds, self.__tokens + elapsed * self.rate)
+        self.__averageRate *= exp(-elapsed / self.averageSeconds)
+        self.__updated = now
+
+    def setRate(self, rate):
+        with self.__lock:
+            self.__refill(monotonic())
+            if (rate or None) != self.rate:
+                self.rate = rate or None
+                self.__tokens = (self.rate * self.__burstSeconds) if self.rate else 0.0
+
+    def reserve(self, amount):
+        with self.__lock:
+            self.__refill(monotonic())
+            self.__averageRate += amount / self.averageSeconds
+            self.total += amount
+            if not self.rate:
+                return 0.0
+
+            self.__tokens -= amount
+            delay = max(0.0, -self.__tokens / self.rate)
+            self.waitedSeconds += delay
+            return delay
+
+    def stats(self):
+        with self.__lock:
+            self.__refill(monotonic())
+            return {
+                "limit_per_second": self.rate,
+                "current_per_second": round(self.__averageRate, 2),
+                "utilization": round(self.__averageRate / self.rate, 4) if self.rate else None,
+                "total": self.total,
+                "throttled_seconds": round(self.waitedSeconds, 2)
+            }
+
+class TrafficLimiter(object):
+    # The buckets one job's transfers on one channel go through: the channel's own and the job's share of it
+    __waitSeconds = 1.0
+
+    def __init__(self, governor, channel, buckets, jobEntry, cancellation = None):
+        self.__governor = governor
+        self.channel = channel
+        self.__buckets = buckets
+        self.__jobEntry = jobEntry
+        self.__cancellation = cancellation
+
+    def acquire(self, requests = 0, bytes = 0):
+        # Keeps the job's buckets from being dropped as idle
+        self.__jobEntry["lastUsed"] = monotonic()
+        self.__governor.refresh()
+
+        delay = 0.0
+        for (bytesBucket, requestsBucket) in self.__buckets:
+            if requests:
+                delay = max(delay, requestsBucket.reserve(requests))
+            if bytes:
+                delay = max(delay, bytesBucket.reserve(bytes))
+
+        # Wait in short steps so a cancelled execution does not sit out a long delay
+        while delay > 0:
+            if self.__cancellation:
+                self.__cancellation.check()
+            step = min(delay, self.__waitSeconds)
+            sleep(step)
+            delay -= step
+
+class ThrottledStream(object):
+    # Wraps a download so every chunk read is paid for with the limiter's byte buckets
+    def __init__(self, stream, limiter):
+        self.__stream = stream
+        self.__limiter = limiter
+
+    def readinto(self, buffer):
+        length = self.__stream.readinto(buffer)
+        if length:
+            self.__limiter.acquire(bytes = length)
+        return length
+
+    def read(self, size = -1):
+        data = self.__stream.read(size)
+        if data:
+            self.__limiter.acquire(bytes = len(data))
+        return data
+
+class TrafficGovernor(object):
+    # Token bucket limits, in bytes and requests per second, on export traffic: per channel ("domino" blob downloads
+    #  and "s3" uploads) and, within those, per job. The limits are read from EXPORTS_TRAFFIC_LIMITS and
+    #  EXPORTS_TRAFFIC_JOB_LIMITS, replaced by the first EXPORTS_TRAFFIC_LIMIT_SCHEDULE window that covers the current
+    #  local time, and applied again every refreshSeconds or as soon as the number of live worker nodes changes.
+    #  Channel limits are for the whole service, so each node enforces an equal share of them (see app/cluster.py);
+    #  a job only runs on one node at a time, so job limits apply as they are
+    channels = ("domino", "s3")
+    refreshSeconds = 30
+    jobIdleSeconds = 600
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__buckets = {channel: (TokenBucket(), TokenBucket()) for channel in self.channels}
+        self.__jobBuckets = {}
+        self.__jobLimits = self.__mergeLimits({}, {})
+        self.__refreshed = None
+        self.__window = None
+        self.__nodes = 1
+
+    @staticmethod
+    def __inWindow(window, now):
+        (start, end) = [datetime.strptime(window[bound], "%H:%M").time() for bound in ("start", "end")]
+        current = now.time()
+        if start <= end:
+            return start <= current < end
+        # Windows such as 22:00 - 06:00 run past midnight
+        return (current >= start) or (current < end)
+
+    @staticmethod
+    def __mergeLimits(limits, overrides):
+        return {
+            channel: dict(limits.get(channel, {}), **overrides.get(channel, {}))
+            for channel in TrafficGovernor.channels
+        }
+
+    def __limits(self, now):
+        from app import app
+
+        limits = app.config["EXPORTS_TRAFFIC_LIMITS"]
+        jobLimits = app.config["EXPORTS_TRAFFIC_JOB_LIMITS"]
+        for window in app.config["EXPORTS_TRAFFIC_LIMIT_SCHEDULE"]:
+            if self.__inWindow(window, now):
+                return (
+                    self.__mergeLimits(limits, window.get("limits", {})),
+                    self.__mergeLimits(jobLimits, window.get("jobLimits", {})),
+                    "{0}-{1}".format(window["start"], window["end"])
+                )
+
+        return (self.__mergeLimits(limits, {}), self.__mergeLimits(jobLimits, {}), None)
+
+    @staticmethod
+    def __nodeShare(limits, nodes):
+        return {key: (value / nodes if value else value) for (key, value) in limits.items()}
+
+    @staticmethod
+    def __applyLimits(buckets, limits):
+        (bytesBucket, requestsBucket) = buckets
+        bytesBucket.setRate(limits.get("bytesPerSecond", None))
+        requestsBucket.setRate(limits.get("requestsPerSecond", None))
+
+    def refresh(self):
+        from app import workerPool
+
+        now = monotonic()
+        # Outside a worker (before it starts, or in an API process) this process counts as the only node
+        nodes = max(1, len(workerPool.liveNodes()))
+        with self.__lock:
+            if (self.__refreshed is not None) and (now - self.__refreshed < self.refreshSeconds) and (nodes == self.__nodes):
+                return
+            self.__refreshed = now
+            self.__nodes = nodes
+
+            (limits, self.__jobLimits, self.__window) = self.__limits(datetime.now())
+            for channel in self.channels:
+                self.__applyLimits(self.__buckets[channel], self.__nodeShare(limits[channel], nodes))
+            for ((channel, jobID), entry) in list(self.__jobBuckets.items()):
+                if now - entry["lastUsed"] > self.jobIdleSeconds:
+                    del self.__jobBuckets[(channel, jobID)]
+                else:
+                    self.__applyLimits(entry["buckets"], self.__jobLimits[channel])
+
+    def limiter(self, channel, jobID, cancellation = None):
+        self.refresh()
+
+        with self.__lock:
+            entry = self.__jobBuckets.get((channel, jobID), None)
+            if entry is None:
+                entry = {"buckets": (TokenBucket(), TokenBucket()), "lastUsed": None}
+                self.__applyLimits(entry["buckets"], self.__jobLimits[channel])
+                self.__jobBuckets[(channel, jobID)] = entry
+            entry["lastUsed"] = monotonic()
+
+        return TrafficLimiter(self, channel, [self.__buckets[channel], entry["buckets"]], entry, cancellation)
+
+    def stats(self):
+        self.refresh()
+        with self.__lock:
+            jobs = {channel: len([key for key in self.__jobBuckets if key[0] == channel]) for channel in self.channels}
+            window = self.__window
+            nodes = self.__nodes
+
+        return {
+            "schedule_window": window,
+            "nodes": nodes,
+            "channels": {
+                channel: {
+                    "bytes": self.__buckets[channel][0].stats(),
+                    "requests": self.__buckets[channel][1].stats(),
+                    "jobs": jobs[channel]
+                }
+                for channel in self.channels
+            }
+        }
@@ -0,0 +1,530 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from queue import Queue, Empty
+from time import monotonic
+import threading
+import tempfile
+import logging
+import os
+
+class BufferPool(object):
+    # Fixed set of reusable bytearray buffers. acquire() blocks while all of them are in flight, which is what bounds
+    #  how far the reader of a TransferPipeline can get ahead of its writer
+    def __init__(self, bufferSize, count):
+        self.bufferSize = bufferSize
+        self.__free = Queue()
+        for i in range(count):
+            self.__free.put(bytearray(bufferSize))
+
+    def acquire(self, timeout = None):
+        return self.__free.get(timeout = timeout)
+
+    def release(self, buffer):
+        self.__free.put(buffer)
+
+class TransferStalled(Exception):
+    pass
+
+class UploadTerminated(Exception):
+    pass
+
+class TransferWriter(object):
+    # One destination of a TransferPipeline and the thread writing to it (and closing it, with closeOnFinish)
+    def __init__(self, destination, release, closeOnFinish = False):
+        self.destination = destination
+        self.closeOnFinish = closeOnFinish
+        self.queue = Queue()
+        self.error = None
+        self.aborted = False
+        self.writingSince = None
+        self.__release = release
+        self.thread = threading.Thread(target = self.__write, daemon = True)
+        self.thread.start()
+
+    def __write(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.__close()
+                return
+
+            (buffer, length) = item
+            try:
+                # Once this destination or the read has failed the remaining chunks are only handed back to the pool
+                if (self.error is None) and not self.aborted:
+                    self.writingSince = monotonic()
+                    with memoryview(buffer) as view:
+                        self.destination.write(view[:length])
+            except BaseException as e:
+                if self.error is None:
+                    self.error = e
+            finally:
+                self.writingSince = None
+                self.__release(buffer)
+
+    def __close(self):
+        if (not self.closeOnFinish) or (self.error is not None) or self.aborted:
+            return
+
+        try:
+            self.writingSince = monotonic()
+            self.destination.close()
+        except BaseException as e:
+            if self.error is None:
+                self.error = e
+        finally:
+            self.writingSince = None
+
+    def isStalled(self, stallSeconds):
+        writingSince = self.writingSince
+        return (stallSeconds is not None) and (writingSince is not None) and (monotonic() - writingSince > stallSeconds)
+
+    # Gives up on a destination that stopped making progress: its queued chunks go back to the pool so the reader and
+    #  the other destinations carry on. The thread stuck in write() is left behind, so terminating the destination must
+    #  not wait for it (see S3MultipartWriter.terminate)
+    def drop(self, error):
+        if self.error is None:
+            self.error = error
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except Empty:
+                return
+            if item is not None:
+                self.__release(item[0])
+
+class TransferPipeline(object):
+    # Copies a stream to one or more files in two stages: the calling thread reads chunks into pooled buffers while a
+    #  writer thread per destination writes the filled ones, so the download keeps going while a destination blocks
+    #  (e.g. uploading an S3 multipart part). A chunk goes back to the pool once every destination has written it, so
+    #  the slowest destination holds the reader back; one that spends more than stallSeconds in a single write is
+    #  dropped instead. Sources with readinto() are read without allocating per chunk; iterators of bytes (such as
+    #  requests' iter_content) are copied into the buffers instead
+    __waitSeconds = 1
+
+    def __init__(self, chunkSize, buffers, cancellation = None, stallSeconds = None):
+        self.__pool = BufferPool(chunkSize, max(2, buffers))
+        self.__cancellation = cancellation
+        self.__stallSeconds = stallSeconds
+        self.__references = {}
+        self.__referencesLock = threading.Lock()
+        self.bytesTransferred = 0
+
+    def __release(self, buffer):
+        with self.__referencesLock:
+            self.__references[id(buffer)] -= 1
+            if self.__references[id(buffer)]:
+                return
+            del self.__references[id(buffer)]
+        self.__pool.release(buffer)
+
+    def __dropStalled(self, writers):
+        for writer in writers:
+            if (writer.error is None) and writer.isStalled(self.__stallSeconds):
+                writer.drop(TransferStalled("No progress writing to the destination for over {0} seconds".format(self.__stallSeconds)))
+
+    # A free buffer, or None once every destination has failed
+    def __acquire(self, writers):
+        while True:
+            if self.__cancellation:
+                self.__cancellation.check()
+            self.__dropStalled(writers)
+            if all([writer.error is not None for writer in writers]):
+                return None
+            try:
+                return self.__pool.acquire(timeout = self.__waitSeconds)
+            except Empty:
+                pass
+
+    def __readInto(self, source, buffer):
+        if hasattr(source, "readinto"):
+            return source.readinto(buffer)
+
+        # Iterators hand over chunks of their own size; fill the buffer from as many of them as fit
+        length = 0
+        while length < len(buffer):
+            if self.__pending is None:
+                self.__pending = next(self.__chunks, None)
+                if self.__pending is None:
+                    break
+                self.__pendingOffset = 0
+
+            take = min(len(buffer) - length, len(self.__pending) - self.__pendingOffset)
+            buffer[length:length + take] = self.__pending[self.__pendingOffset:self.__pendingOffset + take]
+            length += take
+            self.__pendingOffset += take
+            if self.__pendingOffset == len(self.__pending):
+                self.__pending = None
+
+        return length
+
+    def __finish(self, writers):
+        for writer in writers:
+            writer.queue.put(None)
+
+        for writer in writers:
+            while writer.thread.is_alive() and (writer.error is None or not isinstance(writer.error, TransferStalled)):
+                writer.thread.join(self.__waitSeconds)
+                self.__dropStalled([writer])
+
+    def run(self, source, destination):
+        error = self.fanOut(source, [destination])[0]
+        if error is not None:
+            raise(error)
+
+        return self.bytesTransferred
+
+    # Copies source to every destination, closing each one once written when close is set, and returns per destination
+    #  None or the error that made it fail. Errors reading the source (cancellation included) are raised
+    def fanOut(self, source, destinations, close = False):
+        self.__chunks = iter(source) if not hasattr(source, "readinto") else None
+        self.__pending = None
+        writers = [TransferWriter(destination, self.__release, closeOnFinish = close) for destination in destinations]
+
+        try:
+            while True:
+                buffer = self.__acquire(writers)
+                if buffer is None:
+                    break
+
+                length = self.__readInto(source, buffer)
+                activeWriters = [writer for writer in writers if writer.error is None]
+                if (not length) or (not activeWriters):
+                    self.__pool.release(buffer)
+                    break
+
+                with self.__referencesLock:
+                    self.__references[id(buffer)] = len(activeWriters)
+                for writer in activeWriters:
+                    writer.queue.put((buffer, length))
+                self.bytesTransferred += length
+        except BaseException:
+            for writer in writers:
+                writer.aborted = True
+            raise
+        finally:
+            self.__finish(writers)
+
+        return [writer.error for writer in writers]
+
+class S3Uploader(object):
+    # Routes uploads by their expected size over one shared S3 client: files up to singlePutMaxBytes are sent with one
+    #  put_object, larger ones as multipart uploads whose parts go up partConcurrency at a time. The writers returned by
+    #  open() are file-like (write/close/terminate); after close() their etag attribute holds the object's ETag. Every
+    #  request and the bytes it sends are paid for with the limiter's acquire(requests, bytes) first, when there is one
+    maxParts = 10000
+
+    def __init__(self, client, singlePutMaxBytes, partSizeBytes, partConcurrency, limiter = None):
+        self.client = client
+        self.singlePutMaxBytes = singlePutMaxBytes
+        self.partSizeBytes = partSizeBytes
+        self.partConcurrency = max(1, partConcurrency)
+        self.limiter = limiter
+
+    def open(self, bucket, key, size = None):
+        if (size is not None) and (size <= self.singlePutMaxBytes):
+            return S3SinglePutWriter(self.client, bucket, key, self.limiter)
+
+        # S3 allows at most maxParts parts, so very large files get larger parts
+        partSize = self.partSizeBytes
+        if size is not None:
+            partSize = max(partSize, -(-size // self.maxParts))
+
+        return S3MultipartWriter(self.client, bucket, key, partSize, self.partConcurrency, self.limiter)
+
+class S3SinglePutWriter(object):
+    def __init__(self, client, bucket, key, limiter = None):
+        self.__client = client
+        self.__bucket = bucket
+        self.__key = key
+        self.__limiter = limiter
+        self.__buffer = bytearray()
+        self.__terminated = False
+        self.etag = None
+
+    def write(self, data):
+        if not self.__terminated:
+            self.__buffer += data
+        return len(data)
+
+    def close(self):
+        if self.__terminated:
+            raise(UploadTerminated("The upload of {0} was terminated".format(self.__key)))
+
+        if self.__limiter:
+            self.__limiter.acquire(requests = 1, bytes = len(self.__buffer))
+        response = self.__client.put_object(Bucket = self.__bucket, Key = self.__key, Body = bytes(self.__buffer))
+        self.etag = response.get("ETag", None)
+        self.__buffer = bytearray()
+
+    def terminate(self):
+        self.__terminated = True
+        self.__buffer = bytearray()
+
+class S3MultipartWriter(object):
+    # terminate() may be called from another thread while write() or close() is stuck on a part (a dropped
+    #  destination): it does not wait for the part, later writes do nothing, and the upload is only aborted once no
+    #  call is in progress and no part is still being sent, in the background if need be, so no part lands after it
+    def __init__(self, client, bucket, key, partSize, partConcurrency, limiter = None):
+        self.__client = client
+        self.__bucket = bucket
+        self.__key = key
+        self.__partSize = partSize
+        self.__partConcurrency = partConcurrency
+        self.__limiter = limiter
+        self.__executor = ThreadPoolExecutor(max_workers = partConcurrency)
+        self.__buffer = bytearray()
+        self.__futures = []
+        self.__pending = set()
+        self.__state = threading.Condition()
+        self.__calls = 0
+        self.__terminated = False
+        if self.__limiter:
+            self.__limiter.acquire(requests = 1)
+        self.__uploadID = self.__client.create_multipart_upload(Bucket = self.__bucket, Key = self.__key)["UploadId"]
+        self.etag = None
+
+    def __uploadPart(self, partNumber, body):
+        if self.__limiter:
+            self.__limiter.acquire(requests = 1, bytes = len(body))
+        response = self.__client.upload_part(
+            Bucket = self.__bucket,
+            Key = self.__key,
+            UploadId = self.__uploadID,
+            PartNumber = partNumber,
+            Body = body
+        )
+
+        return {"PartNumber": partNumber, "ETag": response["ETag"]}
+
+    def __submit(self, body):
+        # Only partConcurrency parts are held in memory at once; wait for one to finish before queueing another
+        while len(self.__pending) >= self.__partConcurrency:
+            (done, self.__pending) = wait(self.__pending, return_when = FIRST_COMPLETED)
+            [future.result() for future in done if not future.cancelled()]
+
+        with self.__state:
+            # Terminated while waiting for a part
+            if self.__terminated:
+                return
+            future = self.__executor.submit(self.__uploadPart, len(self.__futures) + 1, body)
+            self.__futures.append(future)
+        self.__pending.add(future)
+
+    # write() and close() are counted while in progress so the abort can wait for them
+    def __enter(self):
+        with self.__state:
+            if self.__terminated:
+                return False
+            self.__calls += 1
+            return True
+
+    def __exit(self):
+        with self.__state:
+            self.__calls -= 1
+            self.__state.notify_all()
+
+    def write(self, data):
+        if not self.__enter():
+            return len(data)
+
+        try:
+            self.__buffer += data
+            while len(self.__buffer) >= self.__partSize:
+                self.__submit(bytes(self.__buffer[:self.__partSize]))
+                del self.__buffer[:self.__partSize]
+        finally:
+            self.__exit()
+
+        return len(data)
+
+    def close(self):
+        if not self.__enter():
+            raise(UploadTerminated("The upload of {0} was terminated".format(self.__key)))
+
+        try:
+            # S3 needs at least one part, even an empty one
+            if self.__buffer or not self.__futures:
+                self.__submit(bytes(self.__buffer))
+                self.__buffer = bytearray()
+
+            try:
+                parts = [future.result() for future in self.__futures]
+            finally:
+                self.__executor.shutdown(wait = True)
+
+            with self.__state:
+                if self.__terminated:
+                    raise(UploadTerminated("The upload of {0} was terminated".format(self.__key)))
+            if self.__limiter:
+                self.__limiter.acquire(requests = 1)
+            response = self.__client.complete_multipart_upload(
+                Bucket = self.__bucket,
+                Key = self.__key,
+                UploadId = self.__uploadID,
+                MultipartUpload = {"Parts": parts}
+            )
+            self.etag = response.get("ETag", None)
+        finally:
+            self.__exit()
+
+    def terminate(self):
+        with self.__state:
+            if self.__terminated:
+                return
+            self.__terminated = True
+            for future in self.__futures:
+                future.cancel()
+            idle = (self.__calls == 0) and all([future.done() for future in self.__futures])
+        self.__executor.shutdown(wait = False)
+
+        if idle:
+            self.__abort()
+        else:
+            threading.Thread(target = self.__abortWhenIdle, daemon = True).start()
+
+    def __abortWhenIdle(self):
+        with self.__state:
+            self.__state.wait_for(lambda: self.__calls == 0)
+            futures = list(self.__futures)
+        wait(futures)
+
+        try:
+            self.__abort()
+        except Exception as e:
+            logging.getLogger(__name__).warning("Unable to abort the multipart upload of {0}: {1}".format(self.__key, repr(e)))
+
+    def __abort(self):
+        self.__buffer = bytearray()
+        self.__client.abort_multipart_upload(Bucket = self.__bucket, Key = self.__key, UploadId = self.__uploadID)
+
+class FsyncBatcher(object):
+    # Makes local files durable in batches instead of one fsync per file, which is what makes many small files slow on
+    #  NFS. Closed writers hand over their temporary file; flush() fsyncs every pending file, renames each into place
+    #  and then fsyncs the directories, so a crash leaves either the complete file or only its temporary file
+    def __init__(self, maxFiles, maxBytes):
+        self.maxFiles = max(1, maxFiles)
+        self.maxBytes = maxBytes
+        self.__pending = []
+        self.__pendingBytes = 0
+        self.__lock = threading.Lock()
+
+    def add(self, tempPath, path, size):
+        with self.__lock:
+            self.__pending.append((tempPath, path))
+            self.__pendingBytes += size
+            full = (len(self.__pending) >= self.maxFiles) or (self.__pendingBytes >= self.maxBytes)
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self.__lock:
+            (pending, self.__pending, self.__pendingBytes) = (self.__pending, [], 0)
+
+        for (tempPath, path) in pending:
+            FsyncBatcher.sync(tempPath)
+        for (tempPath, path) in pending:
+            os.replace(tempPath, path)
+        for directory in {os.path.dirname(path) for (tempPath, path) in pending}:
+            FsyncBatcher.sync(directory)
+
+    @staticmethod
+    def sync(path):
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+class LocalFileWriter(object):
+    # Writes a file on a local or NFS file system through a temporary file next to it that only replaces the file once
+    #  complete. Chunks go straight to os.write from the caller's buffer (no copy into a Python file buffer), and the
+    #  space is reserved up front when the size is known. Without a batcher the file is fsynced and renamed on close.
+    #  etag (size and modification time, see etagFromStat) identifies the content written, like an S3 ETag
+    tempSuffix = ".part"
+    fileMode = 0o644
+
+    def __init__(self, path, size = None, batcher = None):
+        self.__path = path
+        self.__batcher = batcher
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok = True)
+        (self.__fd, self.__tempPath) = tempfile.mkstemp(prefix = ".{0}.".format(os.path.basename(path)), suffix = self.tempSuffix, dir = directory)
+        # mkstemp only lets the owner read the file
+        os.fchmod(self.__fd, self.fileMode)
+        self.__size = 0
+        self.__lock = threading.Lock()
+        self.__writing = False
+        self.__terminated = False
+        self.etag = None
+
+        if size:
+            try:
+                os.posix_fallocate(self.__fd, 0, size)
+            except (AttributeError, OSError):
+                # Not every file system (NFS among them) or platform supports it
+                pass
+
+    @staticmethod
+    def etagFromStat(stat):
+        return "\"{0}-{1}\"".format(stat.st_size, stat.st_mtime_ns)
+
+    def write(self, data):
+        # A write left behind by a dropped destination must not touch a descriptor terminate() closed (and the number
+        #  may since have been reused), so terminate() leaves the clean up to the write in progress
+        with self.__lock:
+            if self.__terminated:
+                return len(data)
+            self.__writing = True
+
+        try:
+            with memoryview(data) as view:
+                written = 0
+                while written < len(view):
+                    written += os.write(self.__fd, view[written:])
+        finally:
+            with self.__lock:
+                self.__writing = False
+                terminated = self.__terminated
+            if terminated:
+                self.__discard()
+
+        self.__size += written
+        return written
+
+    def close(self):
+        # A size reserved up front that was not used is given back
+        os.ftruncate(self.__fd, self.__size)
+        self.etag = self.etagFromStat(os.fstat(self.__fd))
+
+        if not self.__batcher:
+            os.fsync(self.__fd)
+        os.close(self.__fd)
+        self.__fd = None
+
+        if self.__batcher:
+            self.__batcher.add(self.__tempPath, self.__path, self.__size)
+        else:
+            os.replace(self.__tempPath, self.__path)
+            FsyncBatcher.sync(os.path.dirname(self.__path))
+        self.__tempPath = None
+
+    def terminate(self):
+        with self.__lock:
+            self.__terminated = True
+            if self.__writing:
+                return
+        self.__discard()
+
+    def __discard(self):
+        # Nothing to discard once closed
+        if self.__tempPath is None:
+            return
+
+        if self.__fd is not None:
+            os.close(self.__fd)
+            self.__fd = None
+        try:
+            os.unlink(self.__tempPath)
+        except FileNotFoundError:
+            pass
+        self.__tempPath = None
@@ -0,0 +1,131 @@
+"""Project file transfer throughput benchmark
+
+Compares the sequential chunk-by-chunk copy the exports used before with
+app/transfer.py's TransferPipeline, over a simulated download (a bandwidth
+limited source) and a simulated multipart upload (a destination that blocks
+for a fixed time per part), or against a real destination such as an S3 path.
+S3 destinations are also written through S3Uploader, and local or NFS paths
+through LocalFileWriter, as the exports do now:
+
+    python3 benchmark.py --size-mb 512 --chunk-mb 8 --buffers 4
+    python3 benchmark.py --size-mb 512 --destination s3://bucket/benchmark.bin
+    python3 benchmark.py --size-mb 512 --download-mbps 0 --destination file:///mnt/nfs/benchmark.bin
+"""
+
+import argparse
+import importlib.util
+import io
+import os
+import time
+
+import smart_open
+
+# Load app/transfer.py on its own; importing the app package would start the whole service
+spec = importlib.util.spec_from_file_location("transfer", os.path.join(os.path.dirname(os.path.abspath(__file__)), "app", "transfer.py"))
+transfer = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(transfer)
+
+MiB = 1024 * 1024
+
+class ThrottledSource(object):
+    def __init__(self, size, bytesPerSecond):
+        self.__remaining = size
+        self.__secondsPerByte = (1.0 / bytesPerSecond) if bytesPerSecond else 0
+
+    def readinto(self, buffer):
+        length = min(len(buffer), self.__remaining)
+        self.__remaining -= length
+        time.sleep(length * self.__secondsPerByte)
+        return length
+
+    # Chunks of the size requests' iter_content used to be called with
+    def __iter__(self):
+        chunk = bytearray(io.DEFAULT_BUFFER_SIZE)
+        while True:
+            length = self.readinto(chunk)
+            if not length:
+                return
+            yield bytes(chunk[:length])
+
+class PartUploadSink(object):
+    # Buffers writes like smart_open's S3 writer and blocks for partSeconds whenever a part is "uploaded"
+    def __init__(self, partSize, partSeconds):
+        self.__partSize = partSize
+        self.__partSeconds = partSeconds
+        self.__buffered = 0
+
+    def write(self, data):
+        self.__buffered += len(data)
+        while self.__buffered >= self.__partSize:
+            self.__buffered -= self.__partSize
+            time.sleep(self.__partSeconds)
+
+    def close(self):
+        if self.__buffered:
+            time.sleep(self.__partSeconds)
+
+def openDestination(args):
+    if args.destination:
+        return smart_open.open(args.destination, "wb", transport_params = {"min_part_size": args.part_mb * MiB})
+
+    return PartUploadSink(args.part_mb * MiB, args.part_seconds)
+
+def sequential(args):
+    destination = openDestination(args)
+    for chunk in ThrottledSource(args.size_mb * MiB, args.download_mbps * MiB):
+        destination.write(chunk)
+    destination.close()
+
+def pipelined(args):
+    destination = openDestination(args)
+    transfer.TransferPipeline(args.chunk_mb * MiB, args.buffers).run(ThrottledSource(args.size_mb * MiB, args.download_mbps * MiB), destination)
+    destination.close()
+
+# S3 destinations only: the pipeline writing through S3Uploader (single PUT or parallel multipart) instead of smart_open
+def routed(args):
+    import boto3
+    from botocore.config import Config
+    from urllib.parse import urlparse
+
+    destinationParsed = urlparse(args.destination)
+    client = boto3.client("s3", config = Config(max_pool_connections = max(10, args.part_concurrency + 2)))
+    uploader = transfer.S3Uploader(client, args.single_put_mb * MiB, args.part_mb * MiB, args.part_concurrency)
+    destination = uploader.open(destinationParsed.netloc, destinationParsed.path.lstrip("/"), args.size_mb * MiB)
+    transfer.TransferPipeline(args.chunk_mb * MiB, args.buffers).run(ThrottledSource(args.size_mb * MiB, args.download_mbps * MiB), destination)
+    destination.close()
+
+# Local and NFS destinations only: the pipeline writing through LocalFileWriter (temporary file, fsync and rename)
+def local(args):
+    from urllib.parse import urlparse
+
+    destination = transfer.LocalFileWriter(os.path.abspath(urlparse(args.destination).path), args.size_mb * MiB)
+    transfer.TransferPipeline(args.chunk_mb * MiB, args.buffers).run(ThrottledSource(args.size_mb * MiB, args.download_mbps * MiB), destination)
+    destination.close()
+
+def main():
+    parser = argparse.ArgumentParser(description = "Project file transfer throughput benchmark")
+    parser.add_argument("--size-mb", type = int, default = 256, help = "size of the simulated file")
+    parser.add_argument("--chunk-mb", type = int, default = 8, help = "pipeline chunk size (EXPORTS_PROJECT_FILES_CHUNK_SIZE_BYTES)")
+    parser.add_argument("--buffers", type = int, default = 4, help = "pipeline buffers (EXPORTS_PROJECT_FILES_BUFFERS)")
+    parser.add_argument("--part-mb", type = int, default = 50, help = "multipart part size (EXPORTS_PROJECT_FILES_S3_PART_SIZE_BYTES)")
+    parser.add_argument("--part-concurrency", type = int, default = 4, help = "parallel part uploads for S3 destinations (EXPORTS_PROJECT_FILES_S3_PART_CONCURRENCY)")
+    parser.add_argument("--single-put-mb", type = int, default = 16, help = "single PUT threshold for S3 destinations (EXPORTS_PROJECT_FILES_S3_SINGLE_PUT_MAX_BYTES)")
+    parser.add_argument("--download-mbps", type = float, default = 200, help = "simulated download bandwidth in MiB/s, 0 for unlimited")
+    parser.add_argument("--part-seconds", type = float, default = 0.25, help = "simulated upload time per part")
+    parser.add_argument("--destination", default = None, help = "write to this smart_open path instead of the simulated upload")
+    args = parser.parse_args()
+
+    runs = [("sequential", sequential), ("pipelined", pipelined)]
+    if args.destination and args.destination.startswith("s3://"):
+        runs.append(("routed", routed))
+    elif args.destination and ("://" not in args.destination or args.destination.startswith("file://")):
+        runs.append(("local", local))
+
+    for (name, run) in runs:
+        start = time.monotonic()
+        run(args)
+        elapsed = time.monotonic() - start
+        print("{0:<12} {1:8.2f}s {2:10.1f} MiB/s".format(name, elapsed, args.size_mb / elapsed))
+
+if __name__ == "__main__":
+    main()
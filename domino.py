@@ -104,11 +104,42 @@ class DominoAPISession(object):
         return api.makeRequest()
 
 # KEEP
-    # GET /v4/gateway/projects/findProjectByOwnerAndName?ownerName={userName}&projectName={projectName}
-    def findProjectByOwnerAndName(self, userName, projectName):
+    # GET /v4/projects?offset={offset}&pageSize={pageSize}
+    def listAllProjects(self, pageSize = 500):
         if not self.isValidAPIKey():
             raise(DominoAPIKeyInvalid)
 
+        api = self.__dominoListProjectsPage(self.__session, self.__dominoHost)
+        projects = []
+        projectIDs = set()
+        offset = 0
+
+        while True:
+            response = api.makeRequest(offset, pageSize)
+
+            if response.get("status_code", requests.codes.ok) == requests.codes.forbidden:
+                raise(DominoAPIUnauthorized)
+            elif response.get("status_code", requests.codes.ok) != requests.codes.ok:
+                raise(DominoAPIUnexpectedError(response.get("status_code", 0), response.get("message", '')))
+
+            page = response["projects"]
+            # Guard against servers that ignore the paging parameters and return the full list every time
+            newProjects = [project for project in page if project.get("id") not in projectIDs]
+            projects.extend(newProjects)
+            projectIDs.update([project.get("id") for project in newProjects])
+
+            if (len(newProjects) < pageSize) or (len(page) < pageSize):
+                break
+            offset += len(page)
+
+        return projects
+
+# KEEP
+    # GET /v4/gateway/projects/findProjectByOwnerAndName?ownerName={userName}&projectName={projectName}
+    def findProjectByOwnerAndName(self, userName, projectName, validateAPIKey = True):
+        if validateAPIKey and not self.isValidAPIKey():
+            raise(DominoAPIKeyInvalid)
+
         api = self.__dominoFindProjectByOwnerAndName(self.__session, self.__dominoHost)
         response = api.makeRequest(userName, projectName)
 
@@ -177,14 +208,23 @@ class DominoAPISession(object):
 
 # KEEP
     # GET /v1/projects/{userName}/{projectName}/blobs/{blobID}
-    def projectFileContentsByKeyID(self, userName, projectName, blobID):
+    def projectFileContentsByKeyID(self, userName, projectName, blobID, chunkSize = None):
+        return self.__projectFileContents(userName, projectName, blobID, chunkSize = chunkSize)
+
+    # GET /v1/projects/{userName}/{projectName}/blobs/{blobID}
+    #  Same call as projectFileContentsByKeyID but returns the file-like response body, which supports readinto() so
+    #  callers can read straight into buffers they reuse
+    def projectFileStreamByKeyID(self, userName, projectName, blobID):
+        return self.__projectFileContents(userName, projectName, blobID, raw = True)
+
+    def __projectFileContents(self, userName, projectName, blobID, chunkSize = None, raw = False):
         if not self.isValidAPIKey():
             raise(DominoAPIKeyInvalid)
 
         # Use this verify project access
         projectInfo = self.findProjectByOwnerAndName(userName, projectName)
     
-        api = self.__dominoProjectFileContentsByKeyID(self.__session, self.__dominoHost)
+        api = self.__dominoProjectFileContentsByKeyID(self.__session, self.__dominoHost, chunkSize = chunkSize, raw = raw)
         response = api.makeRequest(userName, projectName, blobID)
 
         if type(response) is dict:
@@ -423,6 +463,31 @@ class DominoAPISession(object):
         def _postProcess(self, respCode, respData):
             return json.loads(respData)
 
+    class __dominoListProjectsPage(__dominoRequestBase):
+        def __init__(self, session, dominoHost):
+            super().__init__(session, dominoHost)
+            self.uriBase = "{dominoHost}/v4/projects?offset={offset}&pageSize={pageSize}"
+            self.requestsHandler = session.get
+
+        def makeRequest(self, offset, pageSize):
+            self.uriParams["offset"] = offset
+            self.uriParams["pageSize"] = pageSize
+            return super().makeRequest()
+
+        def _postProcess(self, respCode, respData):
+            # Default error response
+            resp = {
+                "message": "unexpected error",
+                "status_code": respCode
+            }
+
+            if respCode == requests.codes.ok:
+                resp = {"projects": json.loads(respData)}
+            elif respCode == requests.codes.forbidden:
+                resp["message"] = "not authorized to list projects"
+
+            return resp
+
     class __dominoFindProjectByOwnerAndName(__dominoRequestBase):
         def __init__(self, session, dominoHost):
             super().__init__(session, dominoHost)
@@ -602,13 +667,14 @@ class DominoAPISession(object):
             return resp
 
     class __dominoProjectFileContentsByKeyID(__dominoRequestBase):
-        def __init__(self, session, dominoHost):
+        def __init__(self, session, dominoHost, chunkSize = None, raw = False):
             super().__init__(session, dominoHost)
             self.uriBase = "{dominoHost}/v1/projects/{userName}/{projectName}/blobs/{blobID}"
             self.requestsHandler = session.get
             self.__requestObj = None
             self.iterator = None
-            self.__streamChunkSize = io.DEFAULT_BUFFER_SIZE
+            self.__streamChunkSize = chunkSize or io.DEFAULT_BUFFER_SIZE
+            self.__raw = raw
 
         def makeRequest(self, userName, projectName, blobID):
             self.uriParams["userName"] = userName
@@ -620,7 +686,12 @@ class DominoAPISession(object):
         def _request(self, uri, data, json):
             response = self.requestsHandler(uri, data = data, json = json, stream = True)
             respCode = response.status_code
-            self.iterator = response.iter_content(chunk_size = self.__streamChunkSize)
+            if self.__raw:
+                # Undo any Content-Encoding the same way iter_content would
+                response.raw.decode_content = True
+                self.iterator = response.raw
+            else:
+                self.iterator = response.iter_content(chunk_size = self.__streamChunkSize)
 
             return (respCode, self.iterator)
 
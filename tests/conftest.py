@@ -0,0 +1,12 @@
+import tempfile
+import sys
+import os
+
+# Importing the app package loads instance/config.py and opens the database, so point the instance data at a scratch
+#  folder and run as an "api" process, which never starts the scheduler. instance/config.py reads ECR_KEY
+os.environ.setdefault("APP_INSTANCE_PATH", tempfile.mkdtemp(prefix = "domino-export-tests-"))
+os.environ.setdefault("SERVICE_ROLE", "api")
+os.environ.setdefault("ECR_KEY", "")
+
+# domino.py sits next to the app package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
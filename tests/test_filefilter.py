@@ -0,0 +1,57 @@
+from app.filefilter import ProjectFileFilter
+
+
+class TestProjectFileFilter(object):
+    def test_exportsEverythingByDefault(self):
+        fileFilter = ProjectFileFilter()
+
+        assert fileFilter.matches("README.md")
+        assert fileFilter.matches("data/large.bin", 10 ** 12)
+
+    def test_includePatterns(self):
+        fileFilter = ProjectFileFilter(include = ["*.py", "notebooks/*"])
+
+        assert fileFilter.matches("train.py")
+        # "*" matches across folders
+        assert fileFilter.matches("src/models/train.py")
+        assert fileFilter.matches("notebooks/eda/explore.ipynb")
+        assert not fileFilter.matches("data/train.csv")
+        # Matching is case sensitive on every platform
+        assert not fileFilter.matches("TRAIN.PY")
+
+    def test_excludeWinsOverInclude(self):
+        fileFilter = ProjectFileFilter(include = ["*.py", "*.ckpt"], exclude = ["*.ckpt", "scratch/*"])
+
+        assert fileFilter.matches("model.py")
+        assert not fileFilter.matches("runs/epoch-10.ckpt")
+        assert not fileFilter.matches("scratch/try.py")
+
+    def test_maxFileSize(self):
+        fileFilter = ProjectFileFilter(maxFileSizeBytes = 100)
+
+        assert fileFilter.matches("small.csv", 100)
+        assert not fileFilter.matches("large.csv", 101)
+        # Files Domino reports no size for are kept
+        assert fileFilter.matches("unknown.csv", None)
+
+    def test_fromJobDetails(self):
+        fileFilter = ProjectFileFilter.fromJobDetails({
+            "fileIncludePatterns": ["*.py"],
+            "fileExcludePatterns": ["tests/*"],
+            "fileMaxSizeBytes": 10
+        })
+
+        assert fileFilter.matches("app.py", 10)
+        assert not fileFilter.matches("tests/test_app.py", 1)
+        assert not fileFilter.matches("app.py", 11)
+        assert ProjectFileFilter.fromJobDetails({}).matches("anything", 10 ** 9)
+
+    def test_isValid(self):
+        assert ProjectFileFilter.isValid(None, None, None)
+        assert ProjectFileFilter.isValid(["*.py"], [], 0)
+        assert not ProjectFileFilter.isValid("*.py", None, None)
+        assert not ProjectFileFilter.isValid(["*.py", ""], None, None)
+        assert not ProjectFileFilter.isValid(None, [1], None)
+        assert not ProjectFileFilter.isValid(None, None, -1)
+        assert not ProjectFileFilter.isValid(None, None, "100")
+        assert not ProjectFileFilter.isValid(None, None, True)
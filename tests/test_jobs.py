@@ -0,0 +1,87 @@
+from app.jobs import ProjectDockerImageExportTask
+
+from unittest import mock
+import logging
+import pytest
+
+versionImageURL = "registry.example.com/exports/group/project:env-v3"
+latestImageURL = "registry.example.com/exports/group/project:latest"
+
+class FakeRegistryClient(object):
+    # Answers manifestDigest from the digests given per tag; None for a missing tag
+    def __init__(self, digests, error = None):
+        self.__digests = digests
+        self.__error = error
+        self.requested = []
+
+    def manifestDigest(self, image):
+        self.requested.append(image.tag)
+        if self.__error:
+            raise(self.__error)
+
+        return self.__digests.get(image.tag, None)
+
+@pytest.fixture
+def task():
+    task = ProjectDockerImageExportTask.__new__(ProjectDockerImageExportTask)
+    task._logger = logging.getLogger(__name__)
+    return task
+
+@pytest.fixture
+def registryCopier():
+    with mock.patch("app.jobs.RegistryCopier") as registryCopier:
+        yield registryCopier
+
+
+class TestRegistryPreflight(object):
+    def test_skipsWhenBothTagsHoldTheExpectedDigest(self, task, registryCopier):
+        client = FakeRegistryClient({"env-v3": "sha256:aaa", "latest": "sha256:aaa"})
+
+        preflight = task.registryPreflight(client, versionImageURL, latestImageURL, "sha256:aaa")
+
+        assert preflight["action"] == "skipped"
+        assert preflight["versionDigest"] == "sha256:aaa"
+        registryCopier.assert_not_called()
+
+    def test_repointsAStaleLatestTag(self, task, registryCopier):
+        client = FakeRegistryClient({"env-v3": "sha256:aaa", "latest": "sha256:old"})
+
+        preflight = task.registryPreflight(client, versionImageURL, latestImageURL, "sha256:aaa")
+
+        assert preflight["action"] == "repointedLatest"
+        assert preflight["latestDigest"] == "sha256:aaa"
+        registryCopier.return_value.copy.assert_called_once_with(versionImageURL, latestImageURL)
+
+    def test_exportsWithoutAnExpectedDigest(self, task, registryCopier):
+        # The version tag alone says nothing about the template or base image it was built from
+        client = FakeRegistryClient({"env-v3": "sha256:aaa", "latest": "sha256:aaa"})
+
+        preflight = task.registryPreflight(client, versionImageURL, latestImageURL, None)
+
+        assert preflight["action"] is None
+        assert client.requested == []
+
+    def test_exportsWhenTheDigestDiffers(self, task, registryCopier):
+        client = FakeRegistryClient({"env-v3": "sha256:aaa", "latest": "sha256:aaa"})
+
+        preflight = task.registryPreflight(client, versionImageURL, latestImageURL, "sha256:bbb")
+
+        assert preflight["action"] is None
+        assert preflight["versionDigest"] == "sha256:aaa"
+        registryCopier.assert_not_called()
+
+    def test_exportsWhenTheVersionTagIsMissing(self, task, registryCopier):
+        client = FakeRegistryClient({"latest": "sha256:aaa"})
+
+        preflight = task.registryPreflight(client, versionImageURL, latestImageURL, "sha256:aaa")
+
+        assert preflight["action"] is None
+        assert preflight["versionDigest"] is None
+
+    def test_exportsWhenTheRegistryCannotBeQueried(self, task, registryCopier):
+        client = FakeRegistryClient({}, error = IOError("Connection refused"))
+
+        preflight = task.registryPreflight(client, versionImageURL, latestImageURL, "sha256:aaa")
+
+        assert preflight["action"] is None
+        assert "Connection refused" in preflight["error"]
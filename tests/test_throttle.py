@@ -0,0 +1,124 @@
+from app import app
+from app.throttle import TokenBucket, TrafficGovernor
+from app.cancellation import CancellationToken, ExecutionCancelled
+
+from datetime import datetime, timedelta
+from unittest import mock
+import pytest
+
+trafficSettings = ["EXPORTS_TRAFFIC_LIMITS", "EXPORTS_TRAFFIC_JOB_LIMITS", "EXPORTS_TRAFFIC_LIMIT_SCHEDULE"]
+
+@pytest.fixture
+def trafficConfig():
+    saved = {name: app.config[name] for name in trafficSettings}
+    app.config["EXPORTS_TRAFFIC_LIMITS"] = {}
+    app.config["EXPORTS_TRAFFIC_JOB_LIMITS"] = {}
+    app.config["EXPORTS_TRAFFIC_LIMIT_SCHEDULE"] = []
+    yield app.config
+    app.config.update(saved)
+
+def liveNodes(count):
+    return mock.patch("app.workerPool.liveNodes", return_value = tuple("node-{0}".format(i) for i in range(count)))
+
+def cancelledToken():
+    token = CancellationToken()
+    token.cancel()
+    return token
+
+def window(startOffsetHours, endOffsetHours, **limits):
+    now = datetime.now()
+    return dict(
+        start = (now + timedelta(hours = startOffsetHours)).strftime("%H:%M"),
+        end = (now + timedelta(hours = endOffsetHours)).strftime("%H:%M"),
+        **limits
+    )
+
+
+class TestTokenBucket(object):
+    def test_unlimitedNeverDelays(self):
+        bucket = TokenBucket()
+
+        assert bucket.reserve(10 ** 12) == 0.0
+        assert bucket.stats()["total"] == 10 ** 12
+        assert bucket.stats()["utilization"] is None
+
+    def test_burstThenRate(self):
+        bucket = TokenBucket(rate = 100, burstSeconds = 1.0)
+
+        assert bucket.reserve(100) == 0.0
+        # Half a second's worth past the burst
+        assert bucket.reserve(50) == pytest.approx(0.5, abs = 0.05)
+        # Reservations queue up behind one another
+        assert bucket.reserve(100) == pytest.approx(1.5, abs = 0.05)
+        assert bucket.stats()["throttled_seconds"] == pytest.approx(2.0, abs = 0.1)
+
+    def test_removingTheLimit(self):
+        bucket = TokenBucket(rate = 10)
+        bucket.reserve(1000)
+
+        bucket.setRate(None)
+
+        assert bucket.reserve(1000) == 0.0
+        assert bucket.stats()["limit_per_second"] is None
+
+
+class TestTrafficGovernor(object):
+    def test_channelLimitsAreSplitBetweenLiveNodes(self, trafficConfig):
+        trafficConfig["EXPORTS_TRAFFIC_LIMITS"] = {"s3": {"bytesPerSecond": 1000, "requestsPerSecond": 8}}
+        governor = TrafficGovernor()
+
+        with liveNodes(1):
+            stats = governor.stats()
+        assert stats["nodes"] == 1
+        assert stats["channels"]["s3"]["bytes"]["limit_per_second"] == 1000
+
+        # Applied as soon as the node count changes, not only every refreshSeconds
+        with liveNodes(4):
+            stats = governor.stats()
+        assert stats["nodes"] == 4
+        assert stats["channels"]["s3"]["bytes"]["limit_per_second"] == 250
+        assert stats["channels"]["s3"]["requests"]["limit_per_second"] == 2
+        assert stats["channels"]["domino"]["bytes"]["limit_per_second"] is None
+
+    def test_jobLimitsApplyPerJob(self, trafficConfig):
+        trafficConfig["EXPORTS_TRAFFIC_JOB_LIMITS"] = {"domino": {"bytesPerSecond": 100}}
+        governor = TrafficGovernor()
+
+        # A cancelled execution raises instead of sleeping whenever it would be held back
+        with liveNodes(3):
+            first = governor.limiter("domino", 1, cancelledToken())
+            first.acquire(bytes = 100)
+            with pytest.raises(ExecutionCancelled):
+                first.acquire(bytes = 100)
+
+            # Another job has its own share, and job limits are not split between nodes
+            second = governor.limiter("domino", 2, cancelledToken())
+            second.acquire(bytes = 100)
+            governor.limiter("s3", 1, cancelledToken()).acquire(bytes = 10 ** 9)
+
+        assert governor.stats()["channels"]["domino"]["jobs"] == 2
+
+    def test_scheduleWindowReplacesLimits(self, trafficConfig):
+        trafficConfig["EXPORTS_TRAFFIC_LIMITS"] = {"s3": {"bytesPerSecond": 1000, "requestsPerSecond": 10}}
+        trafficConfig["EXPORTS_TRAFFIC_LIMIT_SCHEDULE"] = [
+            window(1, 2, limits = {"s3": {"bytesPerSecond": 1}}),
+            window(-1, 1, limits = {"s3": {"bytesPerSecond": 500}})
+        ]
+
+        with liveNodes(1):
+            stats = TrafficGovernor().stats()
+
+        assert stats["schedule_window"] == "{0}-{1}".format(trafficConfig["EXPORTS_TRAFFIC_LIMIT_SCHEDULE"][1]["start"], trafficConfig["EXPORTS_TRAFFIC_LIMIT_SCHEDULE"][1]["end"])
+        assert stats["channels"]["s3"]["bytes"]["limit_per_second"] == 500
+        # Limits the window leaves out keep their configured value
+        assert stats["channels"]["s3"]["requests"]["limit_per_second"] == 10
+
+    def test_noWindowKeepsConfiguredLimits(self, trafficConfig):
+        trafficConfig["EXPORTS_TRAFFIC_LIMITS"] = {"domino": {"requestsPerSecond": 5}}
+        trafficConfig["EXPORTS_TRAFFIC_LIMIT_SCHEDULE"] = [window(2, 3, limits = {"domino": {"requestsPerSecond": 1}})]
+
+        with liveNodes(1):
+            stats = TrafficGovernor().stats()
+
+        assert stats["schedule_window"] is None
+        assert stats["channels"]["domino"]["requests"]["limit_per_second"] == 5
@@ -0,0 +1,264 @@
+from app.transfer import TransferPipeline, TransferStalled, S3Uploader, S3SinglePutWriter, S3MultipartWriter, UploadTerminated
+from app.cancellation import CancellationToken, ExecutionCancelled
+
+from time import monotonic, sleep
+import threading
+import pytest
+import io
+
+class MemoryDestination(object):
+    def __init__(self):
+        self.data = bytearray()
+        self.closed = False
+
+    def write(self, data):
+        self.data += data
+        return len(data)
+
+    def close(self):
+        self.closed = True
+
+class BlockedDestination(MemoryDestination):
+    # Never finishes its first write until unblocked
+    def __init__(self):
+        super().__init__()
+        self.unblock = threading.Event()
+
+    def write(self, data):
+        self.unblock.wait()
+        return super().write(data)
+
+class FailingDestination(MemoryDestination):
+    def write(self, data):
+        raise(IOError("No space left on device"))
+
+class FailingSource(object):
+    def __init__(self, failAfter):
+        self.__remaining = failAfter
+
+    def readinto(self, buffer):
+        if not self.__remaining:
+            raise(IOError("Connection reset"))
+        self.__remaining -= 1
+        buffer[:1] = b"x"
+        return 1
+
+class FakeS3Client(object):
+    # Records the put and multipart calls; upload_part blocks on the parts listed in blockedParts until unblocked
+    def __init__(self, blockedParts = ()):
+        self.calls = []
+        self.parts = {}
+        self.unblock = threading.Event()
+        self.__blockedParts = blockedParts
+        self.__lock = threading.Lock()
+
+    def __record(self, *call):
+        with self.__lock:
+            self.calls.append(call)
+
+    def put_object(self, Bucket, Key, Body):
+        self.__record("put", Key)
+        return {"ETag": "\"etag-put\""}
+
+    def create_multipart_upload(self, Bucket, Key):
+        self.__record("create", Key)
+        return {"UploadId": "upload-1"}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.__record("part", PartNumber)
+        if PartNumber in self.__blockedParts:
+            self.unblock.wait()
+        self.parts[PartNumber] = bytes(Body)
+        return {"ETag": "\"etag-{0}\"".format(PartNumber)}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        self.__record("complete", [part["PartNumber"] for part in MultipartUpload["Parts"]])
+        return {"ETag": "\"etag-final\""}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.__record("abort", UploadId)
+
+    def callNames(self):
+        with self.__lock:
+            return [call[0] for call in self.calls]
+
+def waitFor(condition, timeoutSeconds = 5):
+    deadline = monotonic() + timeoutSeconds
+    while not condition():
+        if monotonic() > deadline:
+            return False
+        sleep(0.01)
+
+    return True
+
+
+class TestTransferPipeline(object):
+    def test_copiesReadintoSources(self):
+        source = bytes(range(256)) * 5
+        destination = MemoryDestination()
+
+        pipeline = TransferPipeline(64, 4)
+
+        assert pipeline.run(io.BytesIO(source), destination) == len(source)
+        assert pipeline.bytesTransferred == len(source)
+        assert bytes(destination.data) == source
+        assert not destination.closed
+
+    def test_copiesToEveryDestination(self):
+        source = bytes(range(256)) * 5
+        destinations = [MemoryDestination(), MemoryDestination()]
+
+        pipeline = TransferPipeline(64, 4)
+        errors = pipeline.fanOut(io.BytesIO(source), destinations, close = True)
+
+        assert errors == [None, None]
+        assert pipeline.bytesTransferred == len(source)
+        for destination in destinations:
+            assert bytes(destination.data) == source
+            assert destination.closed
+
+    def test_copiesIteratorSources(self):
+        chunks = [b"a" * 10, b"b" * 100, b"c", b"d" * 37]
+        destination = MemoryDestination()
+
+        assert TransferPipeline(16, 2).run(iter(chunks), destination) == 148
+        assert bytes(destination.data) == b"".join(chunks)
+        assert not destination.closed
+
+    def test_dropsStalledDestination(self):
+        source = b"x" * 4096
+        stalled = BlockedDestination()
+        healthy = MemoryDestination()
+
+        try:
+            started = monotonic()
+            errors = TransferPipeline(64, 2, stallSeconds = 0.2).fanOut(io.BytesIO(source), [stalled, healthy], close = True)
+            elapsed = monotonic() - started
+        finally:
+            stalled.unblock.set()
+
+        assert isinstance(errors[0], TransferStalled)
+        assert errors[1] is None
+        assert bytes(healthy.data) == source
+        assert healthy.closed
+        assert not stalled.closed
+        # Held back by the stalled destination only until it is dropped
+        assert elapsed < 5
+
+    def test_failedDestinationDoesNotStopTheOthers(self):
+        source = b"y" * 1000
+        failing = FailingDestination()
+        healthy = MemoryDestination()
+
+        errors = TransferPipeline(64, 2).fanOut(io.BytesIO(source), [failing, healthy], close = True)
+
+        assert isinstance(errors[0], IOError)
+        assert errors[1] is None
+        assert not failing.closed
+        assert bytes(healthy.data) == source
+
+    def test_stopsOnceEveryDestinationFailed(self):
+        errors = TransferPipeline(1, 2).fanOut(FailingSource(1000), [FailingDestination(), FailingDestination()])
+
+        assert all([isinstance(error, IOError) for error in errors])
+
+    def test_raisesSourceErrorsWithoutClosing(self):
+        destination = MemoryDestination()
+
+        with pytest.raises(IOError):
+            TransferPipeline(1, 2).fanOut(FailingSource(5), [destination], close = True)
+
+        assert not destination.closed
+
+    def test_raisesDestinationErrorsOfASingleDestination(self):
+        with pytest.raises(IOError):
+            TransferPipeline(1, 2).run(io.BytesIO(b"y" * 1000), FailingDestination())
+
+    def test_stopsWhenCancelled(self):
+        cancellation = CancellationToken()
+        cancellation.cancel()
+
+        with pytest.raises(ExecutionCancelled):
+            TransferPipeline(64, 2, cancellation = cancellation).run(io.BytesIO(b"z" * 1000), MemoryDestination())
+
+
+class TestS3Uploader(object):
+    def test_routesBySize(self):
+        uploader = S3Uploader(FakeS3Client(), 100, 64, 2)
+
+        assert isinstance(uploader.open("bucket", "small", 100), S3SinglePutWriter)
+        assert isinstance(uploader.open("bucket", "large", 101), S3MultipartWriter)
+        assert isinstance(uploader.open("bucket", "unknown"), S3MultipartWriter)
+
+    def test_singlePutUploadsOnClose(self):
+        client = FakeS3Client()
+        writer = S3Uploader(client, 100, 64, 2).open("bucket", "key", 10)
+
+        writer.write(b"0123456789")
+        assert client.calls == []
+        writer.close()
+
+        assert client.calls == [("put", "key")]
+        assert writer.etag == "\"etag-put\""
+
+    def test_terminatedSinglePutIsNotUploaded(self):
+        client = FakeS3Client()
+        writer = S3Uploader(client, 100, 64, 2).open("bucket", "key", 10)
+
+        writer.write(b"0123456789")
+        writer.terminate()
+
+        with pytest.raises(UploadTerminated):
+            writer.close()
+        assert client.calls == []
+
+
+class TestS3MultipartWriter(object):
+    def test_uploadsPartsAndCompletes(self):
+        client = FakeS3Client()
+        writer = S3MultipartWriter(client, "bucket", "key", 4, 2)
+
+        writer.write(b"0123456789")
+        writer.close()
+
+        assert client.parts == {1: b"0123", 2: b"4567", 3: b"89"}
+        assert client.calls[-1] == ("complete", [1, 2, 3])
+        assert writer.etag == "\"etag-final\""
+
+    def test_terminateAbortsRightAwayWhenIdle(self):
+        client = FakeS3Client()
+        writer = S3MultipartWriter(client, "bucket", "key", 4, 2)
+        # Less than a part, so nothing is in flight
+        writer.write(b"012")
+
+        writer.terminate()
+
+        assert client.callNames() == ["create", "abort"]
+
+    def test_terminateDoesNotWaitForAStuckPart(self):
+        client = FakeS3Client(blockedParts = (1,))
+        writer = S3MultipartWriter(client, "bucket", "key", 4, 1)
+
+        # The second part waits in write() for the first, stuck one, like the writer thread of a dropped destination
+        writerThread = threading.Thread(target = writer.write, args = (b"01234567",), daemon = True)
+        writerThread.start()
+        assert waitFor(lambda: "part" in client.callNames())
+
+        try:
+            started = monotonic()
+            writer.terminate()
+            assert monotonic() - started < 1
+
+            # Nothing is aborted while the part is still being sent, and late calls do nothing
+            assert "abort" not in client.callNames()
+            writer.write(b"89abcdef")
+            with pytest.raises(UploadTerminated):
+                writer.close()
+        finally:
+            client.unblock.set()
+
+        assert waitFor(lambda: "abort" in client.callNames())
+        writerThread.join(5)
+        assert client.callNames().count("part") == 1
+        assert client.callNames()[-1] == "abort"
+        assert "complete" not in client.callNames()
@@ -0,0 +1,21 @@
+import os
+os.environ.setdefault("SERVICE_ROLE", "worker")
+
+from app import app
+from app import scheduler
+from time import sleep
+import signal
+import sys
+
+# Let "docker stop" shut the scheduler down cleanly; repeated signals must not interrupt the shutdown itself
+def stop(signum, frame):
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    sys.exit(0)
+
+signal.signal(signal.SIGTERM, stop)
+
+try:
+    while scheduler.isRunning():
+        sleep(5)
+except (KeyboardInterrupt, SystemExit):
+    scheduler.shutdown()